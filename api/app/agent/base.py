@@ -6,6 +6,7 @@ from pydantic import BaseModel, Field, model_validator
 
 from app.core.llm import LLM
 from app.core.logger import log_info, log_error, log_warning
+from app.core.setting import settings
 from app.schema import AgentState, Memory, Message, ROLE_TYPE
 
 
@@ -26,7 +27,9 @@ class BaseAgent(BaseModel, ABC):
     )
 
     # Dependencies
-    llm: LLM = Field(default_factory=LLM, description="语言模型实例")
+    llm: Optional[LLM] = Field(
+        None, description="语言模型实例，未提供时按代理名称选择配置档案"
+    )
     memory: Memory = Field(default_factory=Memory, description="代理的记忆存储")
     state: AgentState = Field(default=AgentState.IDLE, description="当前代理状态")
 
@@ -44,11 +47,24 @@ class BaseAgent(BaseModel, ABC):
     def initialize_agent(self) -> "BaseAgent":
         """如果未提供，则使用默认设置初始化代理。"""
         if self.llm is None or not isinstance(self.llm, LLM):
-            self.llm = LLM(config_name=self.name.lower())
+            self.llm = LLM.for_route(self.name)
         if not isinstance(self.memory, Memory):
             self.memory = Memory()
         return self
 
+    def llm_for(self, purpose: str) -> LLM:
+        """按调用用途选择 LLM，例如 judge 类的判断调用可以路由到更小更快的模型
+
+        参数:
+            purpose: 调用用途，如 plan、command、judge
+
+        返回:
+            LLM: 路由到的配置档案对应的实例，没有匹配的路由时为代理自身的实例
+        """
+        if settings.llm.resolve(self.name, purpose) == settings.llm.resolve(self.name):
+            return self.llm
+        return LLM.for_route(self.name, purpose)
+
     @asynccontextmanager
     async def state_context(self, new_state: AgentState):
         """用于安全代理状态转换的上下文管理器。
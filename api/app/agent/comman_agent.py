@@ -1,12 +1,14 @@
+import asyncio
 import json
 from app.agent.base import BaseAgent
 from app.core.logger import log_info, log_error
-from typing import List, Dict
+from typing import List, Dict, Optional
 from app.schema import AgentState
 from dataclasses import asdict
 
 from app.constants.tools.command_tool import CmdRunTool
-from app.runtime.base import execute_command
+from app.core.setting import settings
+from app.runtime.base import run_command, run_speculative
 
 
 class CommandAgent(BaseAgent):
@@ -30,6 +32,8 @@ class CommandAgent(BaseAgent):
         self.max_retries = 5
         self.retry_count = 0
         self.is_retry = False
+        # 最近一条命令的退出码，计划代理据此判断步骤是否失败
+        self.exit_code: Optional[int] = None
 
     async def build_prompt(self, query: str, purpose: str) -> str:
         # 使用函数式编程风格构建提示信息
@@ -78,7 +82,11 @@ class CommandAgent(BaseAgent):
 
             # 获取工具字典并调用LLM
             tool_dict = asdict(self.tools)
-            response = await self.llm.ask_tool(messages=messages, tools=[tool_dict])
+            if settings.chat.stream_tool_calls:
+                return await self._stream_and_execute(messages, tool_dict)
+            response = await self.llm_for("command").ask_tool(
+                messages=messages, tools=[tool_dict], call_type="command"
+            )
 
             # 提取工具调用信息
             extract_command = lambda tool_call: (
@@ -122,7 +130,52 @@ class CommandAgent(BaseAgent):
             log_error(f"错误详情: {traceback.format_exc()}")
             return f"执行步骤失败: {e}"
 
-    async def need_retry(self, command: str, result: str) -> bool:
+    async def _stream_and_execute(self, messages: List[Dict], tool_dict: Dict) -> str:
+        """边接收工具调用边执行：第一条命令在模型生成后续命令时就开始执行
+
+        命令之间可能有先后依赖，因此仍按生成顺序逐条执行。接收中途失败时停止执行
+        （正在执行的命令被取消，尚未开始的不再执行），返回已执行命令的结果与错误。
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        results = []
+
+        async def execute():
+            while (tool_call := await queue.get()) is not None:
+                results.append(
+                    await self._execute_command_in_path(tool_call.function.arguments)
+                )
+
+        executor = asyncio.create_task(execute())
+        try:
+            async for tool_call in self.llm_for("command").stream_tool_calls(
+                messages=messages, tools=[tool_dict], call_type="command"
+            ):
+                await queue.put(tool_call)
+        except BaseException as e:
+            executor.cancel()
+            await asyncio.gather(executor, return_exceptions=True)
+            if not isinstance(e, Exception):
+                raise
+            log_error(f"接收工具调用失败: {e}")
+            self.exit_code = -1
+            return "\n".join(filter(None, results + [f"接收工具调用失败: {e}"]))
+
+        await queue.put(None)
+        await executor
+        if not results:
+            return "没有找到可执行的命令"
+        return "\n".join(filter(None, results))
+
+    async def corrected_command(self, command: str, result: str) -> Optional[str]:
+        """命令失败后让模型给出一条修正命令
+
+        参数:
+            command: 失败的命令
+            result: 命令的输出
+
+        返回:
+            与原命令不同的修正命令；模型没有给出命令或给出的仍是原命令时返回 None
+        """
         messages = [
             {
                 "role": "user",
@@ -131,23 +184,87 @@ class CommandAgent(BaseAgent):
         ]
 
         tool_dict = asdict(self.tools)
-        response = await self.llm.ask_tool(messages=messages, tools=[tool_dict])
+        response = await self.llm_for("judge").ask_tool(
+            messages=messages, tools=[tool_dict], call_type="judge"
+        )
 
+        new_command = ""
         if (
             response
             and hasattr(response, "tool_calls")
             and response.tool_calls
             and hasattr(response.tool_calls[0], "function")
         ):
-
-            new_command_json = response.tool_calls[0].function.arguments
-            new_command = json.loads(new_command_json).get("command", "")
+            try:
+                new_command_json = response.tool_calls[0].function.arguments
+                new_command = json.loads(new_command_json).get("command", "")
+            except (AttributeError, json.JSONDecodeError):
+                new_command = ""
 
         log_info(f"修正后的命令: {new_command}")
-        if new_command == command:
-            return True
-        else:
-            return False
+        if new_command and new_command.strip() != command.strip():
+            return new_command
+        return None
+
+    async def need_retry(self, command: str, result: str) -> bool:
+        """模型给出了与原命令不同的修正命令时才需要重试"""
+        return await self.corrected_command(command, result) is not None
+
+    async def _speculate(self, command: str, result: str) -> Optional[str]:
+        """命令失败后一次生成多个修正命令，在容器副本中并发试运行
+
+        副本没有网络，候选命令在试运行时不会产生外部副作用（需要联网的候选会失败），
+        只有胜出的候选在原容器中重新执行一次并返回其输出；没有候选成功时返回原来的失败输出，
+        交给计划代理重新规划；无法创建副本时返回 None，按原来的方式逐个重试。
+        候选命令通过 llm_for("command") 生成，默认配置的路由把 commandagent.command
+        指向 fast 档案（见 LLM_ROUTES），与逐个重试时的 judge 调用使用同一个档案。
+        """
+        messages = [
+            {
+                "role": "user",
+                "content": await self.build_retry_prompt(command, result),
+            }
+        ]
+        tool_dict = asdict(self.tools)
+        try:
+            responses = await self.llm_for("command").ask_tool(
+                messages=messages,
+                tools=[tool_dict],
+                n=settings.runtime.SPECULATIVE_CANDIDATES,
+                call_type="speculate",
+            )
+        except Exception as e:
+            log_error(f"生成候选命令失败: {e}")
+            return None
+        if not isinstance(responses, list):
+            responses = [responses]
+
+        candidates: List[str] = []
+        for response in responses:
+            for tool_call in getattr(response, "tool_calls", None) or []:
+                try:
+                    candidate = json.loads(tool_call.function.arguments).get("command", "")
+                except (AttributeError, json.JSONDecodeError):
+                    continue
+                if candidate and candidate != command and candidate not in candidates:
+                    candidates.append(candidate)
+        if not candidates:
+            return None
+
+        try:
+            winner, _ = await run_speculative(self.container_id, candidates)
+        except Exception as e:
+            # 运行时不支持副本或没有足够的容量
+            log_error(f"推测执行不可用，改为逐个重试: {e}")
+            return None
+
+        if winner is None:
+            log_info(f"{len(candidates)} 个候选命令均未成功")
+            return result
+        log_info(f"候选命令成功，在原容器中执行: {candidates[winner]}")
+        command_result = await run_command(self.container_id, candidates[winner])
+        self.exit_code = command_result.exit_code
+        return command_result.output
 
     async def _execute_command_in_path(self, arguments_json: str) -> str:
         """在指定路径下执行命令"""
@@ -160,22 +277,35 @@ class CommandAgent(BaseAgent):
             if not command:
                 return "未提供命令"
 
-            result = await execute_command(self.container_id, command)
+            command_result = await run_command(self.container_id, command)
+            self.exit_code = command_result.exit_code
+            result = command_result.output
 
             if (
-                await self.need_retry(command, result)
-                and self.retry_count < self.max_retries
+                self.exit_code != 0
+                and self.retry_count == 0
+                and settings.runtime.SPECULATIVE_CANDIDATES >= 2
             ):
-                self.retry_count += 1
-                return await self._execute_command_in_path(result)
-            else:
+                speculated = await self._speculate(command, result)
+                if speculated is not None:
+                    return speculated
+
+            if self.retry_count >= self.max_retries:
+                return result
+            new_command = await self.corrected_command(command, result)
+            if new_command is None:
                 return result
+            self.retry_count += 1
+            return await self._execute_command_in_path(
+                json.dumps({"command": new_command}, ensure_ascii=False)
+            )
 
         except json.JSONDecodeError:
             error_msg = f"解析命令参数失败: {arguments_json}"
             log_error(error_msg)
             return error_msg
         except Exception as e:
+            self.exit_code = -1
             error_msg = f"执行命令时发生错误: {str(e)}"
             log_error(error_msg)
             return error_msg
@@ -185,14 +315,16 @@ class CommandAgent(BaseAgent):
         messages = [{"role": "user", "content": user_prompt}]
         try:
             tool_dict = asdict(self.tools)
-            response = await self.llm.ask_tool(messages=messages, tools=[tool_dict])
+            response = await self.llm_for("command").ask_tool(
+                messages=messages, tools=[tool_dict], call_type="command"
+            )
 
             # 执行step方法并获取结果
             result = await self.step()
             log_info(f"执行步骤结果: {result}")
 
             # 返回包含响应和执行结果的列表
-            return [{"response": response, "result": result}]
+            return [{"response": response, "result": result, "exit_code": self.exit_code}]
         except Exception as e:
             log_error(f"执行命令失败: {e}")
             return [{"error": f"执行命令失败: {e}"}]
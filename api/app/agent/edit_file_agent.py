@@ -7,7 +7,8 @@ from typing import List, Dict
 from app.schema import AgentState
 from dataclasses import asdict
 from pathlib import Path
-from app.runtime.base import execute_command
+from app.runtime.base import write_file as write_container_file
+from app.runtime.search import update_search_index
 
 
 class EditFileAgent(BaseAgent):
@@ -79,12 +80,14 @@ class EditFileAgent(BaseAgent):
 
                     # 如果有容器ID，则在容器中执行文件写入
                     if self.container_id:
-                        write_command = f'echo "{content}" > {file_path}'
-                        result = await execute_command(self.container_id, write_command)
+                        await write_container_file(self.container_id, file_path, content)
                         results.append(
                             f"在容器 {self.container_id} 中写入文件: {file_path}"
                         )
-                        log_info(f"容器文件写入结果: {result}")
+                        log_info(f"已在容器中写入文件: {file_path}")
+                        await update_search_index(
+                            file_path, content, container_id=self.container_id
+                        )
                     else:
                         # 原有的本地文件写入逻辑
                         ensure_dir = lambda path: Path(path).parent.mkdir(
@@ -97,6 +100,10 @@ class EditFileAgent(BaseAgent):
                         )
                         write_file(file_path, content)
 
+                        await update_search_index(
+                            file_path, content, local_root=self.result_path
+                        )
+
                         results.append(f"已成功写入本地文件: {file_path}")
                         log_info(f"已成功写入本地文件: {file_path}")
 
@@ -0,0 +1,74 @@
+import json
+from app.agent.base import BaseAgent
+from app.core.logger import log_info, log_error
+from app.constants.tools.file_operations import FileOperationsToolDict
+from typing import List, Dict
+from app.schema import AgentState
+from app.runtime.file_operations import run_file_operations, format_results
+
+
+class FileOperationsAgent(BaseAgent):
+    def __init__(
+        self,
+        name: str = "FileOperationsAgent",
+        query: str = "",
+        purpose: str = "",
+        result_path: str = "",
+        container_id: str = "",
+    ):
+        super().__init__(name=name)
+        self.state = AgentState.IDLE
+        self.query = query
+        self.purpose = purpose
+        self.tools = FileOperationsToolDict
+        self.result_path = result_path
+        self.container_id = container_id
+
+    async def build_prompt(self) -> str:
+        format_info = lambda label, content: (
+            f"{label}：{content}" if content else f"没有提供{label}"
+        )
+
+        info_parts = [
+            format_info("用户的提问", self.query),
+            format_info("操作目的", self.purpose),
+            format_info("可用工具", self.tools["function"]["name"]),
+            format_info("当前的文件路径", self.result_path),
+        ]
+
+        return "\n".join(info_parts)
+
+    async def step(self) -> str:
+        try:
+            prompt = await self.build_prompt()
+            messages = [{"role": "user", "content": prompt}]
+            response = await self.llm.ask_tool(messages=messages, tools=[self.tools])
+
+            tool_calls = response.tool_calls if response and response.tool_calls else []
+            # 合并所有调用中的操作，保证只与容器交互一次
+            operations = [
+                operation
+                for tool_call in tool_calls
+                if tool_call.function.name == "file_operations"
+                for operation in json.loads(tool_call.function.arguments).get(
+                    "operations", []
+                )
+            ]
+            if not operations:
+                return "没有执行文件操作"
+
+            results = await run_file_operations(
+                operations,
+                container_id=self.container_id,
+                local_root=self.result_path,
+            )
+            return format_results(results)
+        except Exception as e:
+            error_msg = f"文件操作失败: {str(e)}"
+            log_error(error_msg)
+            return error_msg
+
+    async def run(self) -> List[Dict]:
+        result = await self.step()
+        log_info(f"文件操作结果: {result}")
+        return [{"result": result}]
@@ -1,18 +1,37 @@
 from app.agent.base import BaseAgent
-from app.constants.prompts.plan_prompt import build_plan_prompt
+from app.constants.prompts.plan_prompt import (
+    build_plan_correction_prompt,
+    build_plan_prompt,
+    build_replan_prompt,
+)
 from app.core.logger import log_info
-from app.constants.tools.manus_tools import get_manus_tools
-from typing import List, Dict
-from app.schema import AgentState
-from json import loads
+from app.core.plan_cache import plan_cache
+from app.core.plan_parser import (
+    StreamingJSONParser,
+    drop_last_step,
+    planning_metrics,
+    validate_plan,
+)
+from app.core.setting import settings
+from app.constants.tools.manus_tools import get_manus_tools, get_tool_name
+from typing import Any, Callable, List, Dict, Optional, Tuple
+from app.schema import AgentState, Message
+from json import JSONDecodeError, dumps
 from app.agent.comman_agent import CommandAgent
 from app.agent.edit_file_agent import EditFileAgent
 from app.agent.str_replace_edit_agent import StrReplaceEditAgent
+from app.agent.search_agent import SearchAgent
+from app.agent.file_operations_agent import FileOperationsAgent
 
 
 class PlanAgent(BaseAgent):
     def __init__(
-        self, name: str = "PlanAgent", result_path: str = "", container_id: str = ""
+        self,
+        name: str = "PlanAgent",
+        result_path: str = "",
+        container_id: str = "",
+        on_progress: Optional[Callable[[int, int], Any]] = None,
+        on_checkpoint: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
     ):
         super().__init__(name=name)
         self.plan = []
@@ -23,6 +42,48 @@ class PlanAgent(BaseAgent):
         self.state = AgentState.IDLE
         self.result_path = result_path
         self.container_id = container_id
+        # 每完成一个步骤回调一次，参数为 (已完成步骤数, 总步骤数)
+        self.on_progress = on_progress
+        # 已完成步骤的结果，运行被取消时作为部分结果返回
+        self.step_results: List[Dict] = []
+        # 生成计划与每完成一个步骤后回调一次，参数为 (记录类型, 记录内容)
+        self.on_checkpoint = on_checkpoint
+        # 已写入检查点的记忆消息数，检查点只记录新增的消息
+        self.checkpointed_messages = 0
+        # 计划是否来自计划缓存，复用的计划执行失败时从缓存中移除
+        self.plan_from_cache = False
+        # 本次运行中步骤失败后重新规划的次数
+        self.replans = 0
+        # 本次运行中失败的步骤数（包括重新规划后继续执行的），有失败的计划不写入缓存
+        self.failed_steps = 0
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """从检查点恢复计划、步骤进度与记忆，之后 run(resume=True) 从下一个步骤继续"""
+        self.query = state["query"]
+        self.plan = state["plan"] or []
+        self.current_step = state["current_step"]
+        self.step_results = list(state["step_results"])
+        self.memory.messages = [Message(**message) for message in state["memory"]]
+        self.checkpointed_messages = len(self.memory.messages)
+
+    def checkpoint(self, kind: str, data: Dict[str, Any]) -> None:
+        if self.on_checkpoint:
+            self.on_checkpoint(kind, data)
+
+    def checkpoint_step(self, result: str) -> None:
+        messages = self.memory.messages
+        # 记忆超过上限被截断时，新增部分无法对应，改为记录完整的记忆
+        reset = len(messages) < self.checkpointed_messages
+        new_messages = messages if reset else messages[self.checkpointed_messages :]
+        record = {
+            "current_step": self.current_step,
+            "result": result,
+            "memory": [message.to_dict() for message in new_messages],
+        }
+        if reset:
+            record["memory_reset"] = True
+        self.checkpoint("step", record)
+        self.checkpointed_messages = len(messages)
 
     async def make_plan(self) -> str:
         tools_str = str(self.tools)
@@ -31,10 +92,34 @@ class PlanAgent(BaseAgent):
         )
         messages = [{"role": "user", "content": prompt}]
 
-        response = await self.llm.ask(messages)
+        response = await self.llm_for("plan").ask(
+            messages, response_format=self.response_format(), call_type="plan"
+        )
 
         return response
 
+    @staticmethod
+    def response_format() -> Optional[Dict[str, str]]:
+        return {"type": "json_object"} if settings.planning.JSON_MODE else None
+
+    def parse_plan(self, response: str) -> Tuple[List[Dict], List[str], str]:
+        """解析并校验计划，返回 (合法的步骤, 错误列表, 用于修正的 JSON 文本)"""
+        parser = StreamingJSONParser()
+        parser.feed(response or "")
+        try:
+            parsed, repaired = parser.result()
+        except (ValueError, JSONDecodeError) as e:
+            return [], [f"无法解析 JSON: {e}"], parser.text or response
+        if repaired:
+            planning_metrics["repaired"] += 1
+            parsed = drop_last_step(parsed)
+        tool_names = [get_tool_name(tool) for tool in self.tools]
+        plan, errors = validate_plan(parsed, tool_names)
+        if repaired:
+            # 总是报告截断，让修正轮次补全被丢弃的步骤
+            errors.append("输出被截断，已丢弃最后一个可能不完整的步骤，请输出完整的计划")
+        return plan, errors, dumps(parsed, ensure_ascii=False)
+
     async def build_tools_list(self) -> List[Dict]:
         tools_list = get_manus_tools()
         return tools_list
@@ -85,43 +170,173 @@ class PlanAgent(BaseAgent):
             )
             result = await str_replace_edit_agent.run()
             self.current_step += 1
+        elif current_action["tool"] == "search":
+            search_agent = SearchAgent(
+                query=query,
+                purpose=purpose,
+                result_path=self.result_path,
+                container_id=self.container_id,
+            )
+            result = await search_agent.run()
+            self.current_step += 1
+            return result
+        elif current_action["tool"] == "file_operations":
+            file_operations_agent = FileOperationsAgent(
+                query=query,
+                purpose=purpose,
+                result_path=self.result_path,
+                container_id=self.container_id,
+            )
+            result = await file_operations_agent.run()
+            self.current_step += 1
+            return result
         return f"执行步骤: {current_action}"
 
-    async def run(self, user_query: str) -> List[Dict]:
+    async def run(self, user_query: str, resume: bool = False) -> List[Dict]:
         self.state = AgentState.RUNNING
         self.query = user_query
         self.tools = await self.build_tools_list()
-        plans = await self.make_plan()
+        if not resume:
+            await self.create_plan()
+            self.checkpoint("plan", {"plan": self.plan})
 
         try:
-            if not plans or not plans.strip():
-                self.plan = []
-            else:
-                # 尝试提取JSON部分
-                json_start = plans.find("{")
-                json_end = plans.rfind("}") + 1
-
-                if json_start >= 0 and json_end > json_start:
-                    json_str = plans[json_start:json_end]
-                    parsed_plans = loads(json_str)
-
-                    # 检查是否包含 plan 键
-                    if isinstance(parsed_plans, dict) and "plan" in parsed_plans:
-                        self.plan = parsed_plans["plan"]
-                    else:
-                        # 如果返回的直接是列表，则使用它
-                        self.plan = (
-                            parsed_plans if isinstance(parsed_plans, list) else []
-                        )
-                else:
-                    self.plan = []
-        except Exception as e:
-            log_info(f"解析计划时出错: {str(e)}")
-            # 发生错误时使用空计划
-            self.plan = []
-
-        while self.state != AgentState.FINISHED:
-            step_result = await self.step()
-            log_info(f"执行步骤结果: {step_result}")
+            while self.state != AgentState.FINISHED:
+                index = self.current_step
+                error: Optional[Exception] = None
+                try:
+                    step_result = await self.step()
+                    failed = self.step_failed(step_result)
+                except Exception as e:
+                    log_info(f"步骤 {index} 执行出错: {e}")
+                    error, step_result, failed = e, f"执行步骤失败: {e}", True
+                log_info(f"执行步骤结果: {step_result}")
+                if failed:
+                    self.failed_steps += 1
+                    if self.plan_from_cache:
+                        plan_cache.invalidate(self.query, self.tools)
+                if failed and await self.replan(index, self.failure_output(step_result)):
+                    continue
+                if error is not None:
+                    # 无法重新规划时，抛出异常的步骤仍按失败处理
+                    raise error
+                if self.state != AgentState.FINISHED:
+                    self.step_results.append(
+                        {"step": self.current_step, "result": str(step_result)}
+                    )
+                    self.checkpoint_step(str(step_result))
+                if self.on_progress:
+                    self.on_progress(self.current_step, len(self.plan))
+        except Exception:
+            if self.plan_from_cache:
+                plan_cache.invalidate(self.query, self.tools)
+            raise
 
+        # 从检查点继续的运行不知道中断前的步骤是否失败过，同样不写入缓存
+        if (
+            settings.plan_cache.ENABLED
+            and not resume
+            and not self.plan_from_cache
+            and not self.failed_steps
+        ):
+            plan_cache.store(self.query, self.tools, self.result_path, self.plan)
         return self.plan
+
+    @staticmethod
+    def step_failed(result: Any) -> bool:
+        """子代理的结果中带有错误或非零退出码时视为步骤失败"""
+        items = result if isinstance(result, list) else [result]
+        return any(
+            isinstance(item, dict)
+            and (item.get("error") or item.get("exit_code") not in (None, 0))
+            for item in items
+        )
+
+    @staticmethod
+    def failure_output(result: Any) -> str:
+        """提取失败步骤的输出与退出码，不包含模型响应等其他内容"""
+        if not isinstance(result, list):
+            return str(result)
+        parts = []
+        for item in result:
+            if not isinstance(item, dict):
+                parts.append(str(item))
+                continue
+            output = item.get("error") or item.get("result") or ""
+            if item.get("exit_code") not in (None, 0):
+                output = f"{output}\n(exit code {item['exit_code']})"
+            parts.append(str(output))
+        return "\n".join(parts)
+
+    async def replan(self, index: int, output: str) -> bool:
+        """步骤失败后重新规划从该步骤开始的后续步骤，已完成的步骤与结果保持不变
+
+        只把失败的步骤、它的输出（截取末尾）与剩余步骤发给模型，返回是否替换了后续步骤。
+        """
+        if self.replans >= settings.planning.MAX_REPLANS or index >= len(self.plan):
+            return False
+        self.replans += 1
+        planning_metrics["replans"] += 1
+
+        limit = settings.planning.REPLAN_OUTPUT_CHARS
+        prompt = build_replan_prompt(
+            self.query,
+            dumps(self.plan[index], ensure_ascii=False),
+            output[-limit:] if limit > 0 else output,
+            dumps(self.plan[index + 1 :], ensure_ascii=False),
+            [get_tool_name(tool) for tool in self.tools],
+            self.result_path,
+        )
+        response = await self.llm_for("plan").ask(
+            [{"role": "user", "content": prompt}],
+            response_format=self.response_format(),
+            call_type="replan",
+        )
+        tail, errors, _ = self.parse_plan(response)
+        if not tail:
+            planning_metrics["replan_failures"] += 1
+            log_info(f"重新规划没有得到合法的步骤，继续执行原计划: {errors}")
+            return False
+
+        log_info(f"步骤 {index} 失败，已重新规划后续 {len(tail)} 个步骤")
+        self.plan = self.plan[:index] + tail
+        self.current_step = index
+        self.state = AgentState.RUNNING
+        self.checkpoint("replan", {"current_step": index, "plan": self.plan})
+        return True
+
+    async def create_plan(self) -> None:
+        if settings.plan_cache.ENABLED:
+            cached = plan_cache.lookup(self.query, self.tools, self.result_path)
+            if cached is not None:
+                self.plan = cached
+                self.plan_from_cache = True
+                return
+
+        planning_metrics["plans"] += 1
+        plan, errors, plan_text = self.parse_plan(await self.make_plan())
+        if errors:
+            planning_metrics["invalid"] += 1
+
+        # 计划不合法时只发送原输出与错误让模型修正，不重新规划
+        tool_names = [get_tool_name(tool) for tool in self.tools]
+        for _ in range(settings.planning.MAX_CORRECTIONS):
+            if not errors:
+                break
+            log_info(f"计划不合法，请求修正: {errors}")
+            planning_metrics["corrections"] += 1
+            prompt = build_plan_correction_prompt(plan_text, errors, tool_names)
+            response = await self.llm_for("plan").ask(
+                [{"role": "user", "content": prompt}],
+                response_format=self.response_format(),
+                call_type="plan_correction",
+            )
+            corrected, errors, plan_text = self.parse_plan(response)
+            if corrected:
+                plan = corrected
+
+        if not plan:
+            planning_metrics["failures"] += 1
+        if errors:
+            log_info(f"计划仍有错误，只保留合法的 {len(plan)} 个步骤: {errors}")
+        self.plan = plan
@@ -0,0 +1,70 @@
+import json
+from app.agent.base import BaseAgent
+from app.core.logger import log_info, log_error
+from app.constants.tools.search_tool import CodeSearchTool
+from typing import List, Dict
+from app.schema import AgentState
+from app.runtime.search import search_workspace
+
+
+class SearchAgent(BaseAgent):
+    def __init__(
+        self,
+        name: str = "SearchAgent",
+        query: str = "",
+        purpose: str = "",
+        result_path: str = "",
+        container_id: str = "",
+    ):
+        super().__init__(name=name)
+        self.state = AgentState.IDLE
+        self.query = query
+        self.purpose = purpose
+        self.tools = CodeSearchTool
+        self.result_path = result_path
+        self.container_id = container_id
+
+    async def build_prompt(self) -> str:
+        format_info = lambda label, content: (
+            f"{label}：{content}" if content else f"没有提供{label}"
+        )
+
+        info_parts = [
+            format_info("用户的提问", self.query),
+            format_info("搜索目的", self.purpose),
+            format_info("可用工具", self.tools["function"]["name"]),
+            format_info("当前的文件路径", self.result_path),
+        ]
+
+        return "\n".join(info_parts)
+
+    async def step(self) -> str:
+        try:
+            prompt = await self.build_prompt()
+            messages = [{"role": "user", "content": prompt}]
+            response = await self.llm.ask_tool(messages=messages, tools=[self.tools])
+
+            tool_calls = response.tool_calls if response and response.tool_calls else []
+            results = []
+            for tool_call in tool_calls:
+                if tool_call.function.name != "search":
+                    continue
+                args = json.loads(tool_call.function.arguments)
+                hits = await search_workspace(
+                    args.get("query", ""),
+                    container_id=self.container_id,
+                    local_root=self.result_path,
+                    top_k=args.get("top_k"),
+                )
+                results.extend(hit.format() for hit in hits)
+
+            return "\n".join(results) if results else "没有找到匹配的结果"
+        except Exception as e:
+            error_msg = f"搜索失败: {str(e)}"
+            log_error(error_msg)
+            return error_msg
+
+    async def run(self) -> List[Dict]:
+        result = await self.step()
+        log_info(f"搜索结果: {result}")
+        return [{"result": result}]
@@ -1,5 +1,5 @@
 from .enums import ResponseCode, get_message
-from .exceptions import BusinessException
+from .exceptions import BusinessException, ServiceBusyException
 from .response import (
     ResponseModel,
     create_response,
@@ -19,6 +19,7 @@ __all__ = [
     
     # 异常类
     'BusinessException',
+    'ServiceBusyException',
     
     # 响应模型和响应创建函数
     'ResponseModel',
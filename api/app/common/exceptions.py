@@ -1,3 +1,4 @@
+import math
 from typing import Any, Optional
 from fastapi import status
 from .enums import ResponseCode, get_message
@@ -15,3 +16,16 @@ class BusinessException(Exception):
         self.code = code
         self.msg = msg or get_message(code)
         self.data = data
+
+
+class ServiceBusyException(BusinessException):
+    """服务过载，请求被拒绝，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, resource: str, retry_after: float, msg: Optional[str] = None):
+        self.resource = resource
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            code=ResponseCode.SERVICE_BUSY,
+            msg=msg or f"服务繁忙（{resource}），请 {self.retry_after} 秒后重试",
+            data={"resource": resource, "retry_after": self.retry_after},
+        )
@@ -1,3 +1,6 @@
+from typing import List
+
+
 def build_plan_prompt(
     user_query: str, tools_str: str, context_str: str, result_path: str
 ) -> str:
@@ -54,3 +57,64 @@ def build_plan_prompt(
         context_str=context_str,
         result_path=result_path,
     )
+
+
+def build_plan_correction_prompt(
+    plan_text: str, errors: List[str], tool_names: List[str]
+) -> str:
+    correction_prompt = """The execution plan below is invalid. Fix only the listed problems and keep everything else unchanged.
+
+    Plan:
+    {plan_text}
+
+    Problems:
+    {errors}
+
+    Valid tool names: {tool_names}
+
+    Return the complete corrected plan as a single JSON object with a non-empty "plan" array, where every step has a "tool" and a "purpose". Only return JSON.
+    """
+    return correction_prompt.format(
+        plan_text=plan_text,
+        errors="\n".join(f"- {error}" for error in errors),
+        tool_names=", ".join(tool_names),
+    )
+
+
+def build_replan_prompt(
+    user_query: str,
+    failed_step: str,
+    output: str,
+    remaining_steps: str,
+    tool_names: List[str],
+    result_path: str,
+) -> str:
+    replan_prompt = """A step of an execution plan failed. Revise the rest of the plan so the task can still be completed. Steps before the failed one have already succeeded and must not be repeated.
+
+    User Query:
+    {user_query}
+
+    Failed Step:
+    {failed_step}
+
+    Output of the Failed Step:
+    {output}
+
+    Remaining Steps (not executed yet):
+    {remaining_steps}
+
+    Valid tool names: {tool_names}
+
+    Result Path (current path exists):
+    {result_path}
+
+    Return a JSON object whose "plan" array replaces the failed step and the remaining steps. It may retry the failed step in a corrected form, and every step has a "tool" and a "purpose" in the same format as the steps above. Only return JSON.
+    """
+    return replan_prompt.format(
+        user_query=user_query,
+        failed_step=failed_step,
+        output=output,
+        remaining_steps=remaining_steps,
+        tool_names=", ".join(tool_names),
+        result_path=result_path,
+    )
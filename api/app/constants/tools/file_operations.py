@@ -1 +1,131 @@
- 
\ No newline at end of file
+from typing import TypedDict, Literal, List, Dict
+from dataclasses import dataclass
+
+_FILE_OPERATIONS_DESCRIPTION = """批量文件操作工具，一次调用即可完成多个文件的读取、查看和复制。
+
+### 支持的操作
+* `read`：读取一个或多个文件（`paths`），可以用 `start_line`/`end_line` 指定行范围，或用 `offset`/`length` 指定字节范围
+* `stat`：查看文件或目录的大小、类型、权限和修改时间
+* `glob`：按模式列出文件，支持 `**` 递归匹配，例如 `src/**/*.py`
+* `copy`：递归复制文件或目录（`source` -> `destination`）
+
+### 使用说明
+* 需要了解多个文件时，把所有操作放在同一次调用的 `operations` 中，而不是多次调用 `cat`
+* 单个文件的读取有大小上限，超出部分会被截断并标记
+* 二进制文件不会返回内容，只返回大小
+* 相对路径以工作目录 `/app` 为基准
+"""
+
+
+class FileOperation(TypedDict, total=False):
+    op: Literal["read", "stat", "glob", "copy"]
+    path: str
+    paths: List[str]
+    start_line: int
+    end_line: int
+    offset: int
+    length: int
+    pattern: str
+    source: str
+    destination: str
+
+
+class FileOperationsParameters(TypedDict):
+    operations: List[FileOperation]
+
+
+@dataclass(frozen=True)
+class FileOperationsFunction:
+    name: str
+    description: str
+    parameters: dict
+
+
+@dataclass(frozen=True)
+class FileOperationsTool:
+    type: str
+    function: FileOperationsFunction
+
+    def to_dict(self) -> Dict:
+        """将 FileOperationsTool 转换为字典格式"""
+        return {
+            "type": self.type,
+            "function": {
+                "name": self.function.name,
+                "description": self.function.description,
+                "parameters": self.function.parameters,
+            },
+        }
+
+
+def create_file_operations_parameters() -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "operations": {
+                "type": "array",
+                "description": "The list of file operations to perform in a single round-trip.",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "op": {
+                            "type": "string",
+                            "enum": ["read", "stat", "glob", "copy"],
+                            "description": "The operation to perform.",
+                        },
+                        "paths": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Files for `read` or `stat`.",
+                        },
+                        "start_line": {
+                            "type": "integer",
+                            "description": "Optional for `read`: first line to return (1-indexed, inclusive).",
+                        },
+                        "end_line": {
+                            "type": "integer",
+                            "description": "Optional for `read`: last line to return (1-indexed, inclusive).",
+                        },
+                        "offset": {
+                            "type": "integer",
+                            "description": "Optional for `read`: byte offset to start reading from.",
+                        },
+                        "length": {
+                            "type": "integer",
+                            "description": "Optional for `read`: number of bytes to read.",
+                        },
+                        "pattern": {
+                            "type": "string",
+                            "description": "Required for `glob`, e.g. `**/*.py`.",
+                        },
+                        "source": {
+                            "type": "string",
+                            "description": "Required for `copy`: the file or directory to copy.",
+                        },
+                        "destination": {
+                            "type": "string",
+                            "description": "Required for `copy`: the target path.",
+                        },
+                    },
+                    "required": ["op"],
+                },
+            },
+        },
+        "required": ["operations"],
+    }
+
+
+def create_file_operations_tool(description: str) -> FileOperationsTool:
+    return FileOperationsTool(
+        type="function",
+        function=FileOperationsFunction(
+            name="file_operations",
+            description=description,
+            parameters=create_file_operations_parameters(),
+        ),
+    )
+
+
+FileOperationsToolDict = create_file_operations_tool(
+    _FILE_OPERATIONS_DESCRIPTION
+).to_dict()
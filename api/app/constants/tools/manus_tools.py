@@ -3,6 +3,8 @@ from dataclasses import dataclass
 from .command_tool import CmdRunTool, CommandTool
 from .edit_tool import LLMBasedFileEditTool
 from .str_replace_tool import StrReplaceEditorTool
+from .search_tool import CodeSearchTool
+from .file_operations import FileOperationsToolDict
 
 
 # * 将工具实例转换为统一的字典格式
@@ -39,6 +41,8 @@ MANUS_TOOLS: List[Dict] = register_tools(
     CmdRunTool,
     LLMBasedFileEditTool,
     StrReplaceEditorTool,
+    CodeSearchTool,
+    FileOperationsToolDict,
 )
 
 
@@ -52,6 +56,21 @@ def get_manus_tools() -> List[Dict]:
     return MANUS_TOOLS
 
 
+def get_tool_name(tool: Dict) -> str:
+    """
+    获取工具名称，兼容 {"name": ...} 与 {"type": "function", "function": {"name": ...}} 两种格式
+
+    Args:
+        tool: 工具定义
+
+    Returns:
+        str: 工具名称
+    """
+    if "function" in tool:
+        return tool["function"].get("name", "")
+    return tool.get("name", "")
+
+
 def get_tool_by_name(name: str) -> Dict | None:
     """
     根据工具名称获取工具定义
@@ -62,7 +81,7 @@ def get_tool_by_name(name: str) -> Dict | None:
     Returns:
         Dict | None: 工具定义，如果未找到则返回 None
     """
-    return next((tool for tool in MANUS_TOOLS if tool["name"] == name), None)
+    return next((tool for tool in MANUS_TOOLS if get_tool_name(tool) == name), None)
 
 
 def get_tools_by_capability(required_params: List[str]) -> List[Dict]:
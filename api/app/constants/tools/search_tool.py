@@ -0,0 +1,75 @@
+from typing import TypedDict, Dict
+from dataclasses import dataclass
+
+_SEARCH_DESCRIPTION = """在当前工作区中搜索代码和文本，返回按相关度排序的 `文件:行号: 片段` 结果。
+
+### 使用场景
+* 定位函数、类、变量的定义或引用位置
+* 查找包含某些关键词的配置、文档或日志
+* 需要了解项目结构但不确定文件位置时，优先使用本工具，而不是 `grep -r` 或 `find`
+
+### 查询方式
+* 查询由若干关键词组成，标识符会自动拆分，例如 `getUserName` 可以匹配 `get_user_name`
+* 结果基于 BM25 相关度排序，关键词越具体结果越准确
+* 通过编辑工具写入的文件会自动更新到索引中
+"""
+
+
+class SearchParameters(TypedDict):
+    query: str
+    top_k: int
+
+
+@dataclass(frozen=True)
+class SearchFunction:
+    name: str
+    description: str
+    parameters: dict
+
+
+@dataclass(frozen=True)
+class SearchTool:
+    type: str
+    function: SearchFunction
+
+    def to_dict(self) -> Dict:
+        """将 SearchTool 转换为字典格式"""
+        return {
+            "type": self.type,
+            "function": {
+                "name": self.function.name,
+                "description": self.function.description,
+                "parameters": self.function.parameters,
+            },
+        }
+
+
+def create_search_parameters() -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "Keywords or identifiers to search for, e.g. `parse config loader` or `UserService.create`.",
+            },
+            "top_k": {
+                "type": "integer",
+                "description": "Maximum number of results to return. Default is 10.",
+            },
+        },
+        "required": ["query"],
+    }
+
+
+def create_search_tool(description: str) -> SearchTool:
+    return SearchTool(
+        type="function",
+        function=SearchFunction(
+            name="search",
+            description=description,
+            parameters=create_search_parameters(),
+        ),
+    )
+
+
+CodeSearchTool = create_search_tool(_SEARCH_DESCRIPTION).to_dict()
@@ -1,12 +1,24 @@
 import uuid
 import os
-from fastapi import APIRouter
-from pydantic import BaseModel
-from app.common import success_response, error_response, ResponseCode
+from fastapi import APIRouter, Header
+from pydantic import BaseModel, Field
+from app.common import (
+    BusinessException,
+    success_response,
+    error_response,
+    ResponseCode,
+)
 from app.service.manus_service import (
     generate_conversation_plan as generate_plan_service,
 )
-from app.controller.runtime import create_container
+from app.controller.runtime import create_container, CreateContainerRequest
+from app.core.admission import admission_controller
+from app.core.idempotency import idempotency_store
+from app.core.logger import log_info
+from app.service.job_service import job_manager, QueueFullError
+from app.service.checkpoint_store import checkpoint_store
+from app.service.run_registry import run_registry
+from typing import Optional
 
 router = APIRouter(prefix="/api/manus", tags=["manus"])
 
@@ -14,36 +26,68 @@ router = APIRouter(prefix="/api/manus", tags=["manus"])
 class ManusRequest(BaseModel):
     query: str
     container_id: str
+    # 可选的运行ID，客户端可以在计划执行期间用它取消运行
+    run_id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{1,64}$")
 
 
 @router.post("/create-container")
-async def create_runtime():
+async def create_runtime(request: Optional[CreateContainerRequest] = None):
+    admission_controller.check("container")
     try:
-        container = await create_container()
+        container = await create_container(
+            request.setup_commands if request else None
+        )
         return success_response(data=container.id)
+    except BusinessException:
+        raise
     except Exception as e:
         return error_response(code=ResponseCode.INTERNAL_ERROR, msg=str(e))
 
 
+def idempotent_response(data, replayed: bool):
+    response = success_response(data=data)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
 # 执行命令
 # !todo: 修改为 wobsocket 或 sse
 @router.post("/generate-plan")
-async def generate_conversation_plan(request: ManusRequest):
-    try:
-        # 创建唯一标识符
-        unique_id = str(uuid.uuid4())
-        # 在当前目录下创建结果目录
-        result_path = os.path.join("results", unique_id)
-        # 确保目录存在
-        os.makedirs(result_path, exist_ok=True)
+async def generate_conversation_plan(
+    request: ManusRequest,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+):
+    async def execute():
+        async with admission_controller.admit("plan"):
+            # 创建唯一标识符
+            unique_id = str(uuid.uuid4())
+            # 在当前目录下创建结果目录
+            result_path = os.path.join("results", unique_id)
+            # 确保目录存在
+            os.makedirs(result_path, exist_ok=True)
+
+            log_info(f"已创建结果目录: {result_path}")
 
-        print(f"已创建结果目录: {result_path}")
+            prompt = request.query
+            # 调用服务层函数处理请求
+            result = await generate_plan_service(
+                prompt, result_path, request.container_id, run_id=request.run_id
+            )
+            return dict(result)
 
-        prompt = request.query
-        # 调用服务层函数处理请求
-        result = await generate_plan_service(prompt, result_path, request.container_id)
+    try:
+        # 带幂等键的重试会接上正在执行或已完成的同一次执行，而不是重新生成计划
+        if idempotency_key:
+            result, replayed = await idempotency_store.run(
+                idempotency_key, request.model_dump(), execute
+            )
+        else:
+            result, replayed = await execute(), False
 
-        return success_response(data=dict(result))
+        return idempotent_response(result, replayed)
+    except BusinessException:
+        raise
     except Exception as e:
         import traceback
 
@@ -51,3 +95,105 @@ async def generate_conversation_plan(request: ManusRequest):
         return error_response(
             data={"error": error_detail}, code=ResponseCode.INTERNAL_ERROR
         )
+
+
+@router.post("/jobs")
+async def submit_plan_job(
+    request: ManusRequest,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+):
+    """提交计划生成任务，立即返回任务ID，由后台工作协程执行"""
+
+    async def submit():
+        admission_controller.check("plan")
+        return job_manager.submit(
+            "plan",
+            {
+                "query": request.query,
+                "container_id": request.container_id,
+                "result_path": os.path.join("results", str(uuid.uuid4())),
+            },
+        )
+
+    try:
+        if idempotency_key:
+            job_id, replayed = await idempotency_store.run(
+                idempotency_key, request.model_dump(), submit
+            )
+        else:
+            job_id, replayed = await submit(), False
+        return idempotent_response({"job_id": job_id}, replayed)
+    except BusinessException:
+        raise
+    except QueueFullError as e:
+        return error_response(code=ResponseCode.SERVICE_BUSY, msg=str(e))
+    except Exception as e:
+        return error_response(code=ResponseCode.INTERNAL_ERROR, msg=str(e))
+
+
+@router.get("/jobs/{job_id}")
+async def get_plan_job(job_id: str):
+    """查询任务状态、进度与结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return error_response(code=ResponseCode.NOT_FOUND, msg=f"任务不存在: {job_id}")
+    return success_response(data=job)
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_plan_job(job_id: str):
+    if job_manager.get(job_id) is None:
+        return error_response(code=ResponseCode.NOT_FOUND, msg=f"任务不存在: {job_id}")
+    if not job_manager.cancel(job_id):
+        return error_response(code=ResponseCode.PARAM_ERROR, msg="任务已结束，无法取消")
+    return success_response()
+
+
+@router.get("/runs")
+async def list_plan_runs():
+    """正在执行的计划运行"""
+    return success_response(data=[run.to_dict() for run in run_registry.list_active()])
+
+
+@router.get("/runs/{run_id}")
+async def get_plan_run(run_id: str):
+    run = run_registry.get(run_id)
+    if run is None:
+        return error_response(code=ResponseCode.NOT_FOUND, msg=f"运行不存在: {run_id}")
+    return success_response(data=run.to_dict())
+
+
+@router.post("/runs/{run_id}/cancel")
+async def cancel_plan_run(run_id: str):
+    """取消正在执行的计划：中止进行中的 LLM 请求与容器命令，返回已有的部分结果"""
+    run = run_registry.cancel(run_id)
+    if run is None:
+        if run_registry.get(run_id) is not None:
+            return error_response(code=ResponseCode.PARAM_ERROR, msg="运行已结束，无法取消")
+        return error_response(code=ResponseCode.NOT_FOUND, msg=f"运行不存在: {run_id}")
+    return success_response(data=run.to_dict())
+
+
+@router.post("/runs/{run_id}/resume")
+async def resume_plan_run(run_id: str):
+    """从检查点继续失败或被中断的计划，跳过规划与已完成的步骤"""
+    try:
+        state = checkpoint_store.load(run_id)
+    except ValueError as e:
+        return error_response(code=ResponseCode.PARAM_ERROR, msg=str(e))
+    if state is None:
+        return error_response(code=ResponseCode.NOT_FOUND, msg=f"运行没有检查点: {run_id}")
+    if run_id in {run.id for run in run_registry.list_active()}:
+        return error_response(code=ResponseCode.PARAM_ERROR, msg="运行仍在执行中")
+    if state["plan"] is None:
+        return error_response(code=ResponseCode.PARAM_ERROR, msg="运行尚未生成计划，请重新提交")
+
+    async with admission_controller.admit("plan"):
+        result = await generate_plan_service(
+            state["query"],
+            state["result_path"],
+            state["container_id"],
+            run_id=run_id,
+            resume=True,
+        )
+    return success_response(data=result)
@@ -1,15 +1,66 @@
-from app.runtime.base import create_container, delete_container, execute_command
+import json
+from typing import List, Optional
+
+from app.runtime.cache import command_cache
+from app.runtime.lifecycle import lifecycle_manager
+from app.core.admission import admission_controller
+from app.core.idempotency import idempotency_store
+from app.core.llm import LLM
+from app.core.token_budget import token_budget
+from app.core.plan_cache import plan_cache
+from app.core.plan_parser import planning_metrics
+from app.core.setting import settings
+from app.runtime.backend import RuntimeNotFoundError, get_backend
+from app.runtime.base import (
+    create_container,
+    delete_container,
+    execute_command,
+    execute_commands,
+    iter_command_results,
+    speculation_metrics,
+)
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from app.common import BusinessException
 from app.common.response import success_response, error_response, ResponseCode
 
 router = APIRouter(prefix="/runtime", tags=["runtime"])
 
 
+def free_container_slots() -> int:
+    """剩余可创建的容器数，未配置上限时视为不限"""
+    if not settings.admission.MAX_CONTAINERS:
+        return 1
+    return settings.admission.MAX_CONTAINERS - lifecycle_manager.registry.count()
+
+
+admission_controller.register_capacity("container", free_container_slots)
+
+
+class CreateContainerRequest(BaseModel):
+    setup_commands: List[str] = Field(default_factory=list)
+
+
+class BatchExecuteRequest(BaseModel):
+    container_id: str
+    commands: List[str] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(default=None, ge=1, le=32)
+    timeout: Optional[int] = Field(default=None, ge=1)
+    max_output: Optional[int] = Field(default=None, ge=1)
+    stream: bool = False
+
+
 @router.post("/create")
-async def create_runtime():
+async def create_runtime(request: Optional[CreateContainerRequest] = None):
+    admission_controller.check("container")
     try:
-        container = await create_container()
+        container = await create_container(
+            request.setup_commands if request else None
+        )
         return success_response(data=container.id)
+    except BusinessException:
+        raise
     except Exception as e:
         return error_response(code=ResponseCode.INTERNAL_ERROR, msg=str(e))
 
@@ -19,14 +70,65 @@ async def execute_runtime(container_id: str, command: str):
     try:
         result = await execute_command(container_id, command)
         return success_response(data=result)
+    except RuntimeNotFoundError:
+        return error_response(code=ResponseCode.NOT_FOUND, msg=f"容器不存在: {container_id}")
+    except Exception as e:
+        return error_response(code=ResponseCode.INTERNAL_ERROR, msg=str(e))
+
+
+@router.post("/execute-batch")
+async def execute_batch_runtime(request: BatchExecuteRequest):
+    """并发执行多条命令；stream=true 时按完成顺序以 NDJSON 逐条返回"""
+    options = dict(
+        concurrency=request.concurrency,
+        timeout=request.timeout,
+        max_output=request.max_output,
+    )
+
+    if request.stream:
+
+        async def generate():
+            async for index, result in iter_command_results(
+                request.container_id, request.commands, **options
+            ):
+                yield json.dumps({"index": index, **result.to_dict()}) + "\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    try:
+        results = await execute_commands(
+            request.container_id, request.commands, **options
+        )
+        return success_response(data=[result.to_dict() for result in results])
     except Exception as e:
         return error_response(code=ResponseCode.INTERNAL_ERROR, msg=str(e))
 
 
+@router.get("/metrics")
+async def runtime_metrics():
+    """运行时指标：容器回收情况与命令缓存命中情况"""
+    return success_response(
+        data={
+            "lifecycle": lifecycle_manager.stats(),
+            "command_cache": command_cache.stats(),
+            "backend": get_backend().stats(),
+            "admission": admission_controller.stats(),
+            "idempotency": idempotency_store.stats(),
+            "plan_cache": plan_cache.stats(),
+            "planning": planning_metrics,
+            "speculation": speculation_metrics,
+            "llm": LLM.stats(),
+            "token_budget": token_budget.stats(),
+        }
+    )
+
+
 @router.delete("/delete")
 async def delete_runtime(container_id: str):
     try:
         await delete_container(container_id)
         return success_response()
+    except RuntimeNotFoundError:
+        return error_response(code=ResponseCode.NOT_FOUND, msg=f"容器不存在: {container_id}")
     except Exception as e:
         return error_response(code=ResponseCode.INTERNAL_ERROR, msg=str(e))
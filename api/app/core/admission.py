@@ -0,0 +1,227 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from app.common import ServiceBusyException
+from app.core.logger import log_info
+from app.core.setting import settings
+
+
+class AdmissionGate:
+    """单一资源的并发上限与排队
+
+    采用 CoDel 的思路判断过载：排队时间持续超过 target_delay 达到一个 interval 后
+    进入丢弃状态，新请求直接被拒绝，直到排队时间回落或队列清空。短时的突发只会排队，
+    不会触发拒绝。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        max_queue: int,
+        target_delay: float,
+        interval: float,
+        max_wait: float,
+    ):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.target_delay = target_delay
+        self.interval = interval
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.dropping = False
+        self.blocked_until = 0.0
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self._first_above = 0.0
+        self._service_time = 1.0
+        self.metrics: Dict[str, int] = {"admitted": 0, "rejected": 0, "timeouts": 0}
+
+    def _observe(self, sojourn: float) -> None:
+        now = time.monotonic()
+        if sojourn < self.target_delay:
+            self._first_above = 0.0
+            self.dropping = False
+        elif not self._first_above:
+            self._first_above = now + self.interval
+        elif now >= self._first_above and not self.dropping:
+            self.dropping = True
+            log_info(f"{self.name} 排队时间持续超过 {self.target_delay} 秒，开始拒绝新请求")
+
+    def overloaded(self) -> bool:
+        if time.monotonic() < self.blocked_until:
+            return True
+        if self.dropping and self.waiting == 0:
+            # 队列已清空，下一个请求不会再排队
+            self.dropping = False
+            self._first_above = 0.0
+        if self.dropping:
+            return True
+        return (
+            self._semaphore is not None
+            and self.in_flight >= self.limit
+            and self.waiting >= self.max_queue
+        )
+
+    def retry_after(self) -> float:
+        blocked = self.blocked_until - time.monotonic()
+        if blocked > 0:
+            return blocked
+        return self._service_time * (self.waiting + 1) / max(self.limit, 1)
+
+    def backoff(self, seconds: float) -> None:
+        """下游明确要求退避（例如限流）时，在这段时间内拒绝依赖它的新请求"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self, shed: bool) -> float:
+        """获取一个名额，返回获取名额的时刻；shed 为真时过载或等待过久会被拒绝"""
+        if shed and self.overloaded():
+            self.metrics["rejected"] += 1
+            raise ServiceBusyException(self.name, self.retry_after())
+
+        started = time.monotonic()
+        if self._semaphore is not None:
+            self.waiting += 1
+            try:
+                if shed and self.max_wait > 0 and self._semaphore.locked():
+                    await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+                else:
+                    await self._semaphore.acquire()
+            except asyncio.TimeoutError:
+                self.metrics["timeouts"] += 1
+                raise ServiceBusyException(self.name, self.retry_after())
+            finally:
+                self.waiting -= 1
+
+        acquired = time.monotonic()
+        self._observe(acquired - started)
+        self.in_flight += 1
+        self.metrics["admitted"] += 1
+        return acquired
+
+    def release(self, acquired: float) -> None:
+        self.in_flight -= 1
+        # 指数加权平均的服务时间，用于估算重试间隔
+        self._service_time = 0.8 * self._service_time + 0.2 * (
+            time.monotonic() - acquired
+        )
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "dropping": self.dropping,
+            "service_time": round(self._service_time, 3),
+            **self.metrics,
+        }
+
+
+class AdmissionController:
+    """准入控制
+
+    按资源名管理各自的 AdmissionGate。新请求进入前同时检查它所依赖的资源
+    （例如计划依赖 LLM 调用），以及登记的容量探测函数（例如剩余容器数）。
+    """
+
+    def __init__(
+        self,
+        gates: List[AdmissionGate],
+        dependencies: Optional[Dict[str, List[str]]] = None,
+        enabled: bool = True,
+    ):
+        self.gates: Dict[str, AdmissionGate] = {gate.name: gate for gate in gates}
+        self.dependencies = dependencies or {}
+        self.enabled = enabled
+        self._capacity: Dict[str, Callable[[], int]] = {}
+        self.capacity_retry_after = 30.0
+        self.draining = False
+
+    def register_capacity(self, resource: str, free_slots: Callable[[], int]) -> None:
+        """登记资源的剩余容量探测函数，返回值小于等于 0 时拒绝新请求"""
+        self._capacity[resource] = free_slots
+
+    def start_drain(self) -> None:
+        """服务关闭前调用，之后的新请求一律拒绝，客户端可以重试到其他实例"""
+        self.draining = True
+        log_info("服务即将关闭，停止接受新请求")
+
+    def check(self, resource: str) -> None:
+        """检查资源及其依赖是否可以接受新请求，否则抛出 ServiceBusyException"""
+        if self.draining:
+            raise ServiceBusyException(resource, self.capacity_retry_after)
+        if not self.enabled:
+            return
+        for name in self.dependencies.get(resource, []):
+            gate = self.gates[name]
+            if gate.overloaded():
+                gate.metrics["rejected"] += 1
+                raise ServiceBusyException(name, gate.retry_after())
+        free_slots = self._capacity.get(resource)
+        if free_slots is not None and free_slots() <= 0:
+            raise ServiceBusyException(resource, self.capacity_retry_after)
+
+    @asynccontextmanager
+    async def admit(self, resource: str):
+        """新请求的准入：过载时拒绝，否则在上限内排队"""
+        self.check(resource)
+        gate = self.gates.get(resource) if self.enabled else None
+        if gate is None:
+            yield
+            return
+        acquired = await gate.acquire(shed=True)
+        try:
+            yield
+        finally:
+            gate.release(acquired)
+
+    @asynccontextmanager
+    async def hold(self, resource: str):
+        """已接受的工作内部占用名额：只排队，不拒绝"""
+        gate = self.gates.get(resource) if self.enabled else None
+        if gate is None:
+            yield
+            return
+        acquired = await gate.acquire(shed=False)
+        try:
+            yield
+        finally:
+            gate.release(acquired)
+
+    def backoff(self, resource: str, seconds: float) -> None:
+        gate = self.gates.get(resource)
+        if gate is not None:
+            gate.backoff(seconds)
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+_config = settings.admission
+admission_controller = AdmissionController(
+    gates=[
+        AdmissionGate(
+            "plan",
+            limit=_config.MAX_INFLIGHT_PLANS,
+            max_queue=_config.MAX_PLAN_QUEUE,
+            target_delay=_config.TARGET_DELAY,
+            interval=_config.INTERVAL,
+            max_wait=_config.MAX_WAIT,
+        ),
+        AdmissionGate(
+            "llm",
+            limit=_config.MAX_PENDING_LLM,
+            max_queue=_config.MAX_PENDING_LLM * 4,
+            target_delay=_config.TARGET_DELAY,
+            interval=_config.INTERVAL,
+            max_wait=_config.MAX_WAIT,
+        ),
+    ],
+    dependencies={"plan": ["llm"], "container": []},
+    enabled=_config.ENABLED,
+)
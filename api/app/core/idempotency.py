@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.common import BusinessException, ResponseCode
+from app.core.setting import settings
+
+
+@dataclass
+class IdempotencyEntry:
+    fingerprint: str
+    task: asyncio.Task
+    created_at: float = field(default_factory=time.monotonic)
+    completed_at: Optional[float] = None
+
+
+def request_fingerprint(payload: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+class IdempotencyStore:
+    """幂等键存储
+
+    同一个键的重复请求：执行中则等待同一次执行（single-flight），已完成则在保留期内
+    直接返回保存的结果。执行失败的键会被移除，重试时重新执行。条目数超过上限时优先淘汰
+    最早完成的条目，执行中的条目不会被淘汰。
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, IdempotencyEntry]" = OrderedDict()
+        self.metrics: Dict[str, int] = {"executed": 0, "coalesced": 0, "replayed": 0}
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key in [
+            key
+            for key, entry in self._entries.items()
+            if entry.completed_at is not None and now - entry.completed_at > self.ttl
+        ]:
+            del self._entries[key]
+
+        overflow = len(self._entries) - self.max_entries
+        for key in [
+            key for key, entry in self._entries.items() if entry.completed_at is not None
+        ][: max(overflow, 0)]:
+            del self._entries[key]
+
+    def _on_done(self, key: str, entry: IdempotencyEntry, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        else:
+            entry.completed_at = time.monotonic()
+
+    async def run(
+        self,
+        key: str,
+        payload: Any,
+        factory: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """按幂等键执行，返回 (结果, 是否复用了之前的执行)"""
+        self._evict()
+        fingerprint = request_fingerprint(payload)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise BusinessException(
+                    code=ResponseCode.PARAM_ERROR,
+                    msg="Idempotency-Key 已被用于不同的请求",
+                )
+            self.metrics["replayed" if entry.task.done() else "coalesced"] += 1
+            return await asyncio.shield(entry.task), True
+
+        task = asyncio.create_task(factory())
+        entry = IdempotencyEntry(fingerprint=fingerprint, task=task)
+        self._entries[key] = entry
+        task.add_done_callback(lambda t: self._on_done(key, entry, t))
+        self.metrics["executed"] += 1
+        # 调用方断开连接时执行继续，重试的请求可以接上
+        return await asyncio.shield(task), False
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), **self.metrics}
+
+
+idempotency_store = IdempotencyStore(
+    ttl=settings.idempotency.TTL,
+    max_entries=settings.idempotency.MAX_ENTRIES,
+)
@@ -1,19 +1,31 @@
-from typing import Dict, List, Optional, Union
+import functools
+import json
+import math
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 
 from openai import (
     APIError,
     AsyncAzureOpenAI,
     AsyncOpenAI,
     AuthenticationError,
+    BadRequestError,
     OpenAIError,
     RateLimitError,
 )
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from app.core.admission import admission_controller
+from app.core.plan_parser import StreamingJSONParser
 from app.core.setting import settings, ChatConfig
+from app.core.token_budget import estimate_tokens, token_budget
 from app.core.logger import log_info, log_error
 from app.schema import (
+    Function,
     Message,
+    ToolCall,
     TOOL_CHOICE_TYPE,
     ROLE_VALUES,
     TOOL_CHOICE_VALUES,
@@ -21,7 +33,84 @@ from app.schema import (
 )
 
 
+# 输出因达到 max_tokens 被截断时追加的续写请求
+_CONTINUE_PROMPT = "输出被截断了，请从中断处继续输出剩余内容，不要重复已输出的部分，也不要添加任何说明。"
+
+
+def _message_tokens(message: Any) -> int:
+    """估算响应消息的输出 token 数：内容与工具调用参数"""
+    if message is None:
+        return 0
+    text = message.content or ""
+    for tool_call in message.tool_calls or []:
+        text += tool_call.function.arguments or ""
+    return estimate_tokens(text)
+
+
+def _same_calls(left: List[Tuple[str, str]], right: List[Tuple[str, str]]) -> bool:
+    """比较两组 (工具名, 参数) 是否完全相同，参数按 JSON 解析后比较"""
+
+    def normalize(arguments: str) -> Any:
+        try:
+            return json.loads(arguments)
+        except json.JSONDecodeError:
+            return arguments
+
+    return len(left) == len(right) and all(
+        name_a == name_b and normalize(args_a) == normalize(args_b)
+        for (name_a, args_a), (name_b, args_b) in zip(left, right)
+    )
+
+
+def _llm_slot(func):
+    """每次调用（包括重试）占用一个 LLM 名额，排队时间计入准入控制的过载判断"""
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        async with admission_controller.hold("llm"):
+            with self.measure():
+                return await func(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _report_rate_limit(error: RateLimitError) -> None:
+    """LLM 限流时让准入控制暂停接受新计划"""
+    retry_after = settings.admission.RATE_LIMIT_BACKOFF
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after", retry_after))
+        except (TypeError, ValueError):
+            pass
+    admission_controller.backoff("llm", retry_after)
+
+
+@dataclass
+class _ToolCallBuffer:
+    """流式响应中一个工具调用的增量拼接"""
+
+    index: int
+    id: str = ""
+    name: str = ""
+    arguments: List[str] = field(default_factory=list)
+    parser: StreamingJSONParser = field(default_factory=StreamingJSONParser)
+    emitted: bool = False
+
+    def emit(self) -> Optional[ToolCall]:
+        """返回完整的工具调用，已产出过的返回 None"""
+        if self.emitted:
+            return None
+        self.emitted = True
+        return ToolCall(
+            id=self.id or f"call_{self.index}",
+            function=Function(name=self.name, arguments="".join(self.arguments)),
+        )
+
+
 class LLM:
+    """按配置档案缓存的 LLM 客户端，档案名见 LLMProfileConfig，default 为聊天配置"""
+
     _instances: Dict[str, "LLM"] = {}
 
     def __new__(
@@ -37,7 +126,8 @@ class LLM:
         self, config_name: str = "default", llm_config: Optional[ChatConfig] = None
     ):
         if not hasattr(self, "client"):
-            llm_config = llm_config or settings.chat
+            llm_config = llm_config or settings.llm.profile(config_name, settings.chat)
+            self.profile = config_name
             self.model = llm_config.model
             self.max_tokens = llm_config.max_tokens
             self.temperature = llm_config.temperature
@@ -45,6 +135,21 @@ class LLM:
             self.api_key = llm_config.api_key
             self.api_version = llm_config.api_version
             self.base_url = llm_config.base_url
+            self.input_cost = llm_config.input_cost
+            self.output_cost = llm_config.output_cost
+            # 服务端拒绝 response_format 后不再发送，改为普通文本输出
+            self.supports_response_format = True
+            # 流式响应默认不包含用量，请求在最后一个块中返回；服务端拒绝后不再发送
+            self.supports_stream_usage = True
+            # latency 为累计耗时（秒），不含排队等待 LLM 名额的时间
+            self.metrics: Dict[str, float] = {
+                "calls": 0,
+                "errors": 0,
+                "latency": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost": 0.0,
+            }
             if self.api_type == "azure":
                 self.client = AsyncAzureOpenAI(
                     base_url=self.base_url,
@@ -54,6 +159,127 @@ class LLM:
             else:
                 self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
 
+    @classmethod
+    def for_route(cls, agent: str, purpose: Optional[str] = None) -> "LLM":
+        """按代理名称与调用用途选择配置档案"""
+        return cls(config_name=settings.llm.resolve(agent, purpose))
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, Any]]:
+        """各配置档案的调用次数、耗时、token 用量与费用"""
+        result = {}
+        for name, instance in cls._instances.items():
+            metrics = dict(instance.metrics)
+            calls = metrics["calls"]
+            metrics["avg_latency"] = metrics["latency"] / calls if calls else 0.0
+            result[name] = {"model": instance.model, **metrics}
+        return result
+
+    @contextmanager
+    def measure(self) -> Iterator[None]:
+        """记录一次请求的耗时与是否失败"""
+        started = time.monotonic()
+        self.metrics["calls"] += 1
+        try:
+            yield
+        except Exception:
+            self.metrics["errors"] += 1
+            raise
+        finally:
+            self.metrics["latency"] += time.monotonic() - started
+
+    def record_usage(self, usage: Any) -> int:
+        """记录响应中的 token 用量，返回输出 token 数；没有用量时返回 0"""
+        if usage is None:
+            return 0
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        self.metrics["prompt_tokens"] += prompt
+        self.metrics["completion_tokens"] += completion
+        self.metrics["cost"] += (
+            prompt * self.input_cost + completion * self.output_cost
+        ) / 1_000_000
+        return completion
+
+    def stream_options(self) -> Dict[str, Any]:
+        """流式请求的额外参数：要求返回用量，使输出长度的样本来自真实的 token 数"""
+        if not self.supports_stream_usage:
+            return {}
+        return {"stream_options": {"include_usage": True}}
+
+    def disable_stream_usage(self, error: BadRequestError) -> bool:
+        """服务端不支持 stream_options 时关闭，返回是否关闭"""
+        if self.supports_stream_usage and "stream_options" in str(error):
+            self.supports_stream_usage = False
+            return True
+        return False
+
+    def budget_key(self, call_type: str) -> str:
+        return f"{self.profile}/{call_type}"
+
+    def budget_for(self, call_type: Optional[str]) -> int:
+        """本次请求的 max_tokens：指定调用类型时自适应，否则为配置档案的上限"""
+        if not call_type:
+            return self.max_tokens
+        return token_budget.budget(self.budget_key(call_type), self.max_tokens)
+
+    async def _complete_text(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        temperature: float,
+        stream: bool,
+        extra: Dict[str, Any],
+    ) -> Tuple[str, Optional[str], int]:
+        """发送一次文本补全请求，返回 (内容, 结束原因, 输出 token 数)"""
+        if not stream:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=False,
+                **extra,
+            )
+            tokens = self.record_usage(response.usage)
+            if not response.choices or not response.choices[0].message.content:
+                raise ValueError("Empty or invalid response from LLM")
+            content = response.choices[0].message.content
+            return (
+                content,
+                response.choices[0].finish_reason,
+                tokens or estimate_tokens(content),
+            )
+
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            **self.stream_options(),
+            **extra,
+        )
+
+        collected_messages = []
+        finish_reason, tokens = None, 0
+        try:
+            async for chunk in response:
+                tokens += self.record_usage(getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                chunk_message = chunk.choices[0].delta.content or ""
+                collected_messages.append(chunk_message)
+                print(chunk_message, end="", flush=True)
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+        finally:
+            # 被取消时立即关闭连接，服务端停止生成
+            await response.close()
+
+        print()  # Newline after streaming
+        content = "".join(collected_messages)
+        return content, finish_reason, tokens or estimate_tokens(content)
+
     @staticmethod
     def format_messages(messages: List[Union[dict, Message]]) -> List[dict]:
         """
@@ -103,12 +329,15 @@ class LLM:
         wait=wait_random_exponential(min=1, max=60),
         stop=stop_after_attempt(6),
     )
+    @_llm_slot
     async def ask(
         self,
         messages: List[Union[dict, Message]],
         system_msgs: Optional[List[Union[dict, Message]]] = None,
         stream: bool = True,
         temperature: Optional[float] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+        call_type: Optional[str] = None,
     ) -> str:
         """
         向LLM发送提示并获取响应。
@@ -118,6 +347,9 @@ class LLM:
             system_msgs: 可选的系统消息，将被添加到开头
             stream (bool): 是否流式传输响应
             temperature (float): 响应的采样温度
+            response_format: 结构化输出格式，例如 {"type": "json_object"}，服务端不支持时忽略
+            call_type: 调用类型，例如 plan，按该类型以往的输出长度设置 max_tokens；
+                未指定时使用配置档案的 max_tokens
 
         返回:
             str: 生成的响应
@@ -135,45 +367,57 @@ class LLM:
             else:
                 messages = self.format_messages(messages)
 
-            if not stream:
-                # Non-streaming request
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    max_tokens=self.max_tokens,
-                    temperature=temperature or self.temperature,
-                    stream=False,
+            extra = {}
+            if response_format and self.supports_response_format:
+                extra["response_format"] = response_format
+
+            # 输出被截断时按配置档案的上限续写，拼接各部分
+            max_tokens = self.budget_for(call_type)
+            parts: List[str] = []
+            total_tokens, truncated = 0, False
+            for attempt in range(settings.token_budget.MAX_CONTINUATIONS + 1):
+                content, finish_reason, tokens = await self._complete_text(
+                    messages, max_tokens, temperature or self.temperature, stream, extra
                 )
-                if not response.choices or not response.choices[0].message.content:
-                    raise ValueError("Empty or invalid response from LLM")
-                return response.choices[0].message.content
-
-            # Streaming request
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=self.max_tokens,
-                temperature=temperature or self.temperature,
-                stream=True,
-            )
-
-            collected_messages = []
-            async for chunk in response:
-                chunk_message = chunk.choices[0].delta.content or ""
-                collected_messages.append(chunk_message)
-                print(chunk_message, end="", flush=True)
-
-            print()  # Newline after streaming
-            full_response = "".join(collected_messages).strip()
+                parts.append(content)
+                total_tokens += tokens
+                if finish_reason != "length":
+                    break
+                truncated = truncated or attempt == 0
+                if attempt == settings.token_budget.MAX_CONTINUATIONS:
+                    log_error(f"LLM 输出在续写 {attempt} 次后仍被截断")
+                    break
+                messages = messages + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": _CONTINUE_PROMPT},
+                ]
+                # 续写的部分本身不是完整的 JSON，不能再使用结构化输出
+                extra = {}
+                max_tokens = self.max_tokens
+                if call_type:
+                    token_budget.fallback(self.budget_key(call_type), max_tokens)
+            if call_type:
+                token_budget.observe(self.budget_key(call_type), total_tokens, truncated)
+
+            full_response = "".join(parts).strip()
             if not full_response:
-                raise ValueError("Empty response from streaming LLM")
+                raise ValueError("Empty or invalid response from LLM")
             return full_response
 
         except ValueError as ve:
             log_error(f"Validation error: {ve}")
             raise
+        except BadRequestError as be:
+            log_error(f"OpenAI API error: {be}")
+            if extra and "response_format" in str(be):
+                # 重试时不再使用结构化输出
+                self.supports_response_format = False
+            self.disable_stream_usage(be)
+            raise
         except OpenAIError as oe:
             log_error(f"OpenAI API error: {oe}")
+            if isinstance(oe, RateLimitError):
+                _report_rate_limit(oe)
             raise
         except Exception as e:
             log_error(f"Unexpected error in ask: {e}")
@@ -183,6 +427,7 @@ class LLM:
         wait=wait_random_exponential(min=1, max=60),
         stop=stop_after_attempt(6),
     )
+    @_llm_slot
     async def ask_tool(
         self,
         messages: List[Union[dict, Message]],
@@ -191,6 +436,7 @@ class LLM:
         tools: Optional[List[dict]] = None,
         tool_choice: TOOL_CHOICE_TYPE = ToolChoice.AUTO,  # type: ignore
         temperature: Optional[float] = None,
+        call_type: Optional[str] = None,
         **kwargs,
     ):
         """
@@ -203,10 +449,12 @@ class LLM:
             tools: 要使用的工具列表
             tool_choice: 工具选择策略
             temperature: 响应的采样温度
-            **kwargs: 额外的完成参数
+            call_type: 调用类型，按该类型以往的输出长度设置 max_tokens，
+                输出被截断时按配置档案的上限重新请求
+            **kwargs: 额外的完成参数，n 大于 1 时一次生成多个候选
 
         返回:
-            ChatCompletionMessage: 模型的响应
+            ChatCompletionMessage: 模型的响应；n 大于 1 时为各候选响应的列表
 
         异常:
             ValueError: 如果工具、工具选择或消息无效
@@ -228,21 +476,47 @@ class LLM:
                     if not isinstance(tool, dict) or "type" not in tool:
                         raise ValueError("Each tool must be a dict with 'type' field")
 
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature or self.temperature,
-                max_tokens=self.max_tokens,
-                tools=tools,
-                tool_choice=tool_choice,
-                timeout=timeout,
-                **kwargs,
-            )
+            max_tokens = self.budget_for(call_type)
+            truncated = False
+            while True:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature or self.temperature,
+                    max_tokens=max_tokens,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    timeout=timeout,
+                    **kwargs,
+                )
+                tokens = self.record_usage(response.usage)
+                if max_tokens >= self.max_tokens or not any(
+                    choice.finish_reason == "length" for choice in response.choices
+                ):
+                    break
+                # 工具调用的参数被截断后无法续写，按配置档案的上限重新请求
+                truncated = True
+                max_tokens = self.max_tokens
+                token_budget.fallback(self.budget_key(call_type), max_tokens)
+
+            if call_type and response.choices:
+                # 多个候选时用量为所有候选之和
+                tokens = tokens or sum(
+                    _message_tokens(choice.message) for choice in response.choices
+                )
+                token_budget.observe(
+                    self.budget_key(call_type),
+                    math.ceil(tokens / len(response.choices)),
+                    truncated,
+                )
 
             if not response.choices or not response.choices[0].message:
                 print(response)
                 raise ValueError("Invalid or empty response from LLM")
 
+            if kwargs.get("n", 1) > 1:
+                # 不支持 n 的服务端只返回一个候选
+                return [choice.message for choice in response.choices if choice.message]
             return response.choices[0].message
 
         except ValueError as ve:
@@ -253,9 +527,147 @@ class LLM:
                 log_error("Authentication failed. Check API key.")
             elif isinstance(oe, RateLimitError):
                 log_error("Rate limit exceeded. Consider increasing retry attempts.")
+                _report_rate_limit(oe)
             elif isinstance(oe, APIError):
                 log_error(f"API error: {oe}")
             raise
         except Exception as e:
             log_error(f"Unexpected error in ask_tool: {e}")
             raise
+
+    async def stream_tool_calls(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        timeout: int = 300,
+        tools: Optional[List[dict]] = None,
+        tool_choice: TOOL_CHOICE_TYPE = ToolChoice.AUTO,  # type: ignore
+        temperature: Optional[float] = None,
+        call_type: Optional[str] = None,
+        **kwargs,
+    ) -> AsyncIterator[ToolCall]:
+        """
+        以流式方式请求工具调用，每个调用的参数 JSON 闭合后立即产出，不等待整个响应生成完毕。
+
+        参数与 ask_tool 相同。流式请求中途失败无法透明重试（已产出的调用可能已被执行），
+        因此不做 ask_tool 的重试，只依赖客户端自身对连接错误的重试。
+        最后一个调用的参数因 max_tokens 被截断时，按配置档案的上限重新请求；新的响应以已产出的
+        调用开头时只产出其后的调用，否则抛出 ValueError，由调用方把步骤记为失败。
+
+        产出:
+            ToolCall: 参数已完整的工具调用，按模型生成的顺序
+        """
+        if tool_choice not in TOOL_CHOICE_VALUES:
+            raise ValueError(f"Invalid tool_choice: {tool_choice}")
+
+        if system_msgs:
+            system_msgs = self.format_messages(system_msgs)
+            messages = system_msgs + self.format_messages(messages)
+        else:
+            messages = self.format_messages(messages)
+
+        calls: Dict[int, _ToolCallBuffer] = {}
+        max_tokens = self.budget_for(call_type)
+        finish_reason, tokens = None, 0
+
+        async with admission_controller.hold("llm"):
+            with self.measure():
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature or self.temperature,
+                        max_tokens=max_tokens,
+                        tools=tools,
+                        tool_choice=tool_choice,
+                        timeout=timeout,
+                        stream=True,
+                        **self.stream_options(),
+                        **kwargs,
+                    )
+                except RateLimitError as e:
+                    log_error("Rate limit exceeded while streaming tool calls.")
+                    _report_rate_limit(e)
+                    raise
+                except BadRequestError as e:
+                    # 流式请求不做重试，下次调用时不再要求返回用量
+                    self.disable_stream_usage(e)
+                    raise
+
+                try:
+                    async for chunk in response:
+                        tokens += self.record_usage(getattr(chunk, "usage", None))
+                        if not chunk.choices:
+                            continue
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        for delta in chunk.choices[0].delta.tool_calls or []:
+                            if delta.index not in calls:
+                                # 新的调用开始，之前的调用都已生成完毕
+                                for buffer in calls.values():
+                                    call = buffer.emit()
+                                    if call is not None:
+                                        yield call
+                                calls[delta.index] = _ToolCallBuffer(index=delta.index)
+                            buffer = calls[delta.index]
+                            if delta.id:
+                                buffer.id = delta.id
+                            if delta.function and delta.function.name:
+                                buffer.name += delta.function.name
+                            if delta.function and delta.function.arguments:
+                                buffer.arguments.append(delta.function.arguments)
+                                buffer.parser.feed(delta.function.arguments)
+                                # 参数 JSON 已闭合，不必等到下一个调用开始
+                                if buffer.parser.done:
+                                    call = buffer.emit()
+                                    if call is not None:
+                                        yield call
+                finally:
+                    # 调用方提前结束或被取消时关闭连接，服务端停止生成
+                    await response.close()
+
+                tokens = tokens or estimate_tokens(
+                    "".join("".join(buffer.arguments) for buffer in calls.values())
+                )
+                emitted = [
+                    (buffer.name, "".join(buffer.arguments))
+                    for buffer in calls.values()
+                    if buffer.emitted
+                ]
+                truncated = finish_reason == "length" and len(emitted) < len(calls)
+                if truncated and max_tokens >= self.max_tokens:
+                    raise ValueError("工具调用的参数因达到 max_tokens 被截断")
+                if truncated:
+                    # 最后一个调用的参数被截断：按配置档案的上限重新请求完整响应。已产出的调用
+                    # 可能已在执行，新的响应必须以完全相同的调用开头，才能只产出其后的调用
+                    token_budget.fallback(self.budget_key(call_type), self.max_tokens)
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature or self.temperature,
+                        max_tokens=self.max_tokens,
+                        tools=tools,
+                        tool_choice=tool_choice,
+                        timeout=timeout,
+                        **kwargs,
+                    )
+                    message = response.choices[0].message if response.choices else None
+                    tokens = self.record_usage(response.usage) or _message_tokens(message)
+                    if call_type:
+                        token_budget.observe(self.budget_key(call_type), tokens, True)
+                    tool_calls = (message.tool_calls if message else None) or []
+                    prefix = [
+                        (tool_call.function.name, tool_call.function.arguments)
+                        for tool_call in tool_calls[: len(emitted)]
+                    ]
+                    if not _same_calls(prefix, emitted):
+                        raise ValueError("重新生成的工具调用与已执行的调用不一致，无法续接")
+                    for tool_call in tool_calls[len(emitted) :]:
+                        yield tool_call
+                    return
+
+                if call_type:
+                    token_budget.observe(self.budget_key(call_type), tokens, truncated)
+                for buffer in calls.values():
+                    call = buffer.emit()
+                    if call is not None:
+                        yield call
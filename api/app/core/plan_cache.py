@@ -0,0 +1,241 @@
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from app.constants.tools.manus_tools import get_tool_name
+from app.core.logger import log_info
+from app.core.setting import settings
+
+# 按顺序提取查询中的参数：URL、引号内的内容、路径、带点的名字（文件名、v2.0.1 之类的版本号）、数字
+_SLOT_PATTERN = re.compile(
+    r"https?://\S+"
+    r"|\"[^\"]+\"|'[^']+'|`[^`]+`|“[^”]+”"
+    r"|(?:~|\.{1,2})?/[\w.\-/]+|\b[\w\-]+(?:\.[A-Za-z0-9]{1,8})+\b"
+    r"|\b\d[\d.]*\b"
+)
+# 过短的参数（例如 "3"）在计划文本中无法可靠替换，保留在模板里
+_MIN_SLOT_LENGTH = 3
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]+")
+_WORD = re.compile(r"[a-z0-9_<>]+")
+# 否定词：近似匹配中多出或缺少这些词（例如 "do not"、"不要"）时任务的意思相反
+_NEGATION_WORDS = frozenset(
+    "not no never without except skip avoid nor cannot "
+    "don doesn didn won shouldn mustn isn aren".split()
+)
+_NEGATION_CHARS = re.compile(r"[不别勿没无非禁免]")
+_RESULT_PATH_SLOT = "{{result_path}}"
+_MARKER = re.compile(r"\{\{(?:slot\d+|result_path)\}\}")
+
+
+def extract_slots(query: str) -> Tuple[str, List[str]]:
+    """把查询拆成模板与参数，例如 "run tests in /app/api" -> ("run tests in <slot>", ["/app/api"])"""
+    slots: List[str] = []
+
+    def replace(match: "re.Match") -> str:
+        value = match.group(0).strip("\"'`“”")
+        if len(value) < _MIN_SLOT_LENGTH:
+            return match.group(0)
+        slots.append(value)
+        return "<slot>"
+
+    template = _SLOT_PATTERN.sub(replace, query)
+    return " ".join(template.lower().split()), slots
+
+
+def template_tokens(template: str) -> FrozenSet[str]:
+    """词法相似度使用的词集合：英文按单词，中文按相邻两字"""
+    tokens = set(_WORD.findall(template))
+    for run in _CJK_RUN.findall(template):
+        if len(run) == 1:
+            tokens.add(run)
+        tokens.update(run[i : i + 2] for i in range(len(run) - 1))
+    return frozenset(tokens)
+
+
+def has_negation(tokens: FrozenSet[str]) -> bool:
+    return any(
+        token in _NEGATION_WORDS or _NEGATION_CHARS.search(token) for token in tokens
+    )
+
+
+def tools_fingerprint(tools: List[Dict[str, Any]]) -> str:
+    return hashlib.sha256(
+        json.dumps(tools, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def _slot_marker(index: int) -> str:
+    return f"{{{{slot{index}}}}}"
+
+
+def _json_escape(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)[1:-1]
+
+
+def _replace_all(text: str, replacements: Dict[str, str]) -> str:
+    """一次性替换，较长的值优先，已替换的内容不会被再次替换"""
+    replacements = {old: new for old, new in replacements.items() if old}
+    if not replacements:
+        return text
+    pattern = re.compile(
+        "|".join(re.escape(old) for old in sorted(replacements, key=len, reverse=True))
+    )
+    return pattern.sub(lambda match: replacements[match.group(0)], text)
+
+
+@dataclass
+class PlanTemplate:
+    template: str
+    tokens: FrozenSet[str]
+    fingerprint: str
+    slot_count: int
+    # 计划的 JSON 文本，参数与结果路径已替换为占位符
+    plan_text: str
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+class PlanCache:
+    """计划模板缓存
+
+    键为规范化后的查询模板加上工具集指纹。命中时把当前查询的参数填回缓存的计划，
+    不再调用 LLM 生成计划；没有完全相同的模板时，在参数个数相同、词集合互为包含关系的
+    条目中按 Jaccard 相似度查找足够接近的模板，差异中有否定词时不视为同一任务。
+    复用前检查计划中的工具都仍在当前的工具列表中。
+    """
+
+    def __init__(self, max_entries: int, similarity: float, ttl: float):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.ttl = ttl
+        self.entries: "OrderedDict[Tuple[str, str], PlanTemplate]" = OrderedDict()
+        self.metrics: Dict[str, int] = {
+            "hits": 0,
+            "near_hits": 0,
+            "misses": 0,
+            "invalid": 0,
+            "stored": 0,
+        }
+
+    def _expired(self, entry: PlanTemplate) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry.created_at > self.ttl
+
+    def _find(
+        self, template: str, fingerprint: str, slot_count: int
+    ) -> Tuple[Optional[Tuple[str, str]], bool]:
+        """返回 (缓存键, 是否为近似匹配)"""
+        key = (template, fingerprint)
+        if key in self.entries:
+            return key, False
+
+        tokens = template_tokens(template)
+        best_key, best_score = None, 0.0
+        for candidate_key, entry in self.entries.items():
+            if entry.fingerprint != fingerprint or entry.slot_count != slot_count:
+                continue
+            # 只允许多出或缺少词（例如 "please"），有词被替换（例如 flask 换成 django）
+            # 说明是不同的任务
+            if not (tokens <= entry.tokens or entry.tokens <= tokens):
+                continue
+            # 多出或缺少的是否定词时意思相反，例如 "不要删除测试" 与 "删除测试"
+            if has_negation(tokens ^ entry.tokens):
+                continue
+            union = len(tokens | entry.tokens)
+            score = len(tokens & entry.tokens) / union if union else 0.0
+            if score > best_score:
+                best_key, best_score = candidate_key, score
+        if best_key is not None and best_score >= self.similarity:
+            return best_key, True
+        return None, False
+
+    @staticmethod
+    def _valid(plan: Any, tools: List[Dict[str, Any]]) -> bool:
+        names = {get_tool_name(tool) for tool in tools}
+        return (
+            isinstance(plan, list)
+            and bool(plan)
+            and all(isinstance(step, dict) and step.get("tool") in names for step in plan)
+        )
+
+    def lookup(
+        self, query: str, tools: List[Dict[str, Any]], result_path: str
+    ) -> Optional[List[Dict[str, Any]]]:
+        """查找可复用的计划，已填入当前查询的参数；没有时返回 None"""
+        template, slots = extract_slots(query)
+        fingerprint = tools_fingerprint(tools)
+        key, near = self._find(template, fingerprint, len(slots))
+        if key is None:
+            self.metrics["misses"] += 1
+            return None
+
+        entry = self.entries[key]
+        if self._expired(entry):
+            del self.entries[key]
+            self.metrics["misses"] += 1
+            return None
+
+        values = {_slot_marker(index): _json_escape(value) for index, value in enumerate(slots)}
+        values[_RESULT_PATH_SLOT] = _json_escape(result_path)
+        plan = json.loads(
+            _MARKER.sub(lambda match: values[match.group(0)], entry.plan_text)
+        )
+        if not self._valid(plan, tools):
+            del self.entries[key]
+            self.metrics["invalid"] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        entry.hits += 1
+        self.metrics["near_hits" if near else "hits"] += 1
+        log_info(f"计划缓存命中{'（近似）' if near else ''}: {entry.template}")
+        return plan
+
+    def store(
+        self,
+        query: str,
+        tools: List[Dict[str, Any]],
+        result_path: str,
+        plan: List[Dict[str, Any]],
+    ) -> None:
+        """保存执行成功的计划，参数与结果路径替换为占位符"""
+        if not self._valid(plan, tools):
+            return
+        template, slots = extract_slots(query)
+        markers = {_json_escape(value): _slot_marker(index) for index, value in enumerate(slots)}
+        if len(result_path) >= _MIN_SLOT_LENGTH:
+            markers[_json_escape(result_path)] = _RESULT_PATH_SLOT
+        plan_text = _replace_all(json.dumps(plan, ensure_ascii=False), markers)
+
+        fingerprint = tools_fingerprint(tools)
+        self.entries[(template, fingerprint)] = PlanTemplate(
+            template=template,
+            tokens=template_tokens(template),
+            fingerprint=fingerprint,
+            slot_count=len(slots),
+            plan_text=plan_text,
+        )
+        self.entries.move_to_end((template, fingerprint))
+        self.metrics["stored"] += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, query: str, tools: List[Dict[str, Any]]) -> None:
+        """复用的计划执行失败时移除对应的模板"""
+        template, slots = extract_slots(query)
+        key, _ = self._find(template, tools_fingerprint(tools), len(slots))
+        if key is not None:
+            del self.entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self.entries), **self.metrics}
+
+
+plan_cache = PlanCache(
+    max_entries=settings.plan_cache.MAX_ENTRIES,
+    similarity=settings.plan_cache.SIMILARITY,
+    ttl=settings.plan_cache.TTL,
+)
@@ -0,0 +1,159 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_CLOSERS = {"{": "}", "[": "]"}
+# 根括号之后（跳过空白）可以出现的第一个字符，用来排除 "Plan [v1]:" 这类说明文字中的括号
+_VALUE_STARTS = {"{": '"}', "[": '{["]-0123456789tfn'}
+
+# 计划生成的统计：invalid 为首次输出不合法的次数，repaired 为修复了截断输出的次数，
+# corrections 为追加的修正轮次，failures 为修正后仍没有合法步骤的次数，
+# replans 为步骤失败后重新规划后续步骤的次数，replan_failures 为重新规划没有得到合法步骤的次数
+planning_metrics: Dict[str, int] = {
+    "plans": 0,
+    "invalid": 0,
+    "repaired": 0,
+    "corrections": 0,
+    "failures": 0,
+    "replans": 0,
+    "replan_failures": 0,
+}
+
+
+class StreamingJSONParser:
+    """边接收边解析的 JSON 解析器
+
+    跳过根对象之前的内容（说明文字、代码块标记），根对象闭合后忽略之后的内容。
+    根对象是第一个后面紧跟 JSON 值（或直接闭合）的 { 或 [，说明文字中的 [v1] 之类不算。
+    输出被截断时，从最近一个完整的元素处截断并补全括号，得到尽可能多的内容。
+
+    工具调用参数在流式接收时逐块喂入，参数闭合即可执行；计划是在完整响应返回后一次性喂入的，
+    用到的是跳过说明文字与修复截断的能力。
+    """
+
+    def __init__(self):
+        self._chars: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self.started = False
+        # 尚未确定是否为根对象的括号，等看到其后第一个非空白字符再决定
+        self._candidate: Optional[str] = None
+        self.done = False
+        self.error: Optional[str] = None
+        # 可以安全截断的位置与当时未闭合的括号，用于修复截断的输出
+        self._cut_points: List[Tuple[int, Tuple[str, ...]]] = []
+
+    def feed(self, chunk: str) -> None:
+        for char in chunk:
+            if self.done or self.error:
+                return
+            if not self.started:
+                if self._candidate is None or char.isspace():
+                    if self._candidate is None and char in _CLOSERS:
+                        self._candidate = char
+                    continue
+                bracket, self._candidate = self._candidate, None
+                if char not in _VALUE_STARTS[bracket]:
+                    if char in _CLOSERS:
+                        self._candidate = char
+                    continue
+                self.started = True
+                self._open(bracket)
+
+            self._chars.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in _CLOSERS:
+                self._open(char, appended=True)
+            elif char in "}]":
+                if not self._stack or _CLOSERS[self._stack[-1]] != char:
+                    self.error = f"括号不匹配: {char}"
+                    return
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+            elif char == ",":
+                self._cut_points.append((len(self._chars) - 1, tuple(self._stack)))
+
+    def _open(self, char: str, appended: bool = False) -> None:
+        if not appended:
+            self._chars.append(char)
+        self._stack.append(char)
+        self._cut_points.append((len(self._chars), tuple(self._stack)))
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chars)
+
+    def result(self) -> Tuple[Any, bool]:
+        """返回 (解析结果, 是否经过修复)，无法解析时抛出 ValueError"""
+        if not self.started:
+            raise ValueError("输出中没有 JSON 对象")
+        text = self.text
+        if self.done:
+            return json.loads(text), False
+
+        # 先尝试直接补全括号；截断在字符串中间时不补全字符串，半截的值没有意义，
+        # 退回到最近一个完整的元素
+        candidates = [] if self._in_string else [(text, tuple(self._stack))]
+        candidates += [(text[:pos], stack) for pos, stack in reversed(self._cut_points)]
+        for prefix, stack in candidates:
+            closing = "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+            try:
+                return json.loads(prefix + closing), True
+            except json.JSONDecodeError:
+                continue
+        raise ValueError("无法修复被截断的 JSON")
+
+
+def drop_last_step(parsed: Any) -> Any:
+    """去掉修复后计划的最后一个步骤
+
+    截断位置之前的最后一个步骤可能只写了一半（例如命令只到 rm -rf /app/bu 就被截断），
+    无法判断它是否完整，修复后的计划一律不执行它。
+    """
+    if isinstance(parsed, dict) and isinstance(parsed.get("plan"), list):
+        return {**parsed, "plan": parsed["plan"][:-1]}
+    if isinstance(parsed, list):
+        return parsed[:-1]
+    return parsed
+
+
+def validate_plan(
+    parsed: Any, tool_names: Iterable[str]
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """按计划格式校验解析结果，返回 (合法的步骤, 错误列表)"""
+    names = set(tool_names)
+    if isinstance(parsed, dict):
+        if "plan" not in parsed:
+            return [], ['根对象缺少 "plan" 数组']
+        steps = parsed["plan"]
+    else:
+        steps = parsed
+    if not isinstance(steps, list):
+        return [], ['"plan" 必须是数组']
+    if not steps:
+        return [], ['"plan" 不能为空']
+
+    valid: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict):
+            errors.append(f"plan[{index}] 必须是对象")
+            continue
+        tool = step.get("tool")
+        if tool not in names:
+            errors.append(f'plan[{index}].tool "{tool}" 不是可用的工具')
+            continue
+        if not isinstance(step.get("purpose"), (dict, str)):
+            errors.append(f'plan[{index}] 缺少 "purpose"')
+            continue
+        valid.append(step)
+    return valid, errors
@@ -1,9 +1,14 @@
-from typing import Optional, Dict, Any
+import asyncio
+import json
+import os
+import time
+from typing import Optional, Dict, Any, AsyncIterator, List
 from functools import partial
 from contextlib import asynccontextmanager
 import aiodocker
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 
 
 class SandboxConfig(BaseModel):
@@ -13,11 +18,31 @@ class SandboxConfig(BaseModel):
     timeout: int = 30  # 秒
     command: Optional[str] = None
     working_dir: str = "/sandbox"
+    max_output_bytes: int = 1024 * 1024  # 输出上限，超出后终止容器
+
+
+class BatchSandboxRequest(BaseModel):
+    snippets: List[str] = Field(..., min_length=1)
+    image: str = "ubuntu:latest"
+    memory_limit: str = "512m"
+    cpu_limit: float = 0.5
+    timeout: int = 10  # 每个片段的超时时间（秒）
+    max_output_bytes: int = 64 * 1024  # 每个片段的输出上限
+    pool_size: int = Field(default=4, ge=1, le=32)
+
+
+# 片段之间重置容器：结束残留进程（PID 1 与自身除外）并清空可写目录（包括共享内存）
+_RESET_SCRIPT = (
+    "kill -9 -1 2>/dev/null; "
+    "find /sandbox /tmp /dev/shm -mindepth 1 -delete 2>/dev/null; true"
+)
 
 
 class SandboxManager:
-    def __init__(self):
+    def __init__(self, max_concurrency: Optional[int] = None):
         self.docker = None
+        # 同时运行的沙箱数量按 CPU 核数限制
+        self.semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
 
     async def __aenter__(self):
         self.docker = aiodocker.Docker()
@@ -47,44 +72,249 @@ class SandboxManager:
             },
         }
 
-    async def run_sandbox(self, config: SandboxConfig) -> Dict[str, Any]:
-        """运行沙箱环境"""
-        container_config = self.create_container_config(config)
+    @classmethod
+    def create_pool_container_config(cls, config: SandboxConfig) -> Dict[str, Any]:
+        """常驻容器配置：沿用相同的安全策略，只有 tmpfs 上的工作目录与 /tmp 可写"""
+        container_config = cls.create_container_config(config)
+        container_config["Cmd"] = ["sleep", "infinity"]
+        container_config["HostConfig"]["Tmpfs"] = {
+            config.working_dir: "rw,exec,size=64m,mode=1777",
+            "/tmp": "rw,size=64m,mode=1777",
+        }
+        return container_config
 
+    async def _remove_container(self, container) -> None:
         try:
-            container = await self.docker.containers.create(config=container_config)
+            await container.delete(force=True)
+        except aiodocker.DockerError as e:
+            if e.status != 404:
+                raise
 
-            await container.start()
+    async def stream_sandbox(self, config: SandboxConfig) -> AsyncIterator[Dict[str, Any]]:
+        """运行沙箱并逐段产出输出
+
+        依次产出 {"type": "output", "data": ...}，最后产出
+        {"type": "exit", "exit_code": ..., "timed_out": ..., "truncated": ...}。
+        无论正常结束、超时、超出输出上限还是调用方断开，容器都会被删除。
+        """
+        container_config = self.create_container_config(config)
 
-            # 等待容器执行完成或超时
+        async with self.semaphore:
+            container = await self.docker.containers.create(config=container_config)
             try:
-                await container.wait(timeout=config.timeout)
-            except TimeoutError:
-                await container.kill()
-                raise HTTPException(
-                    status_code=408, detail="Sandbox execution timed out"
-                )
+                await container.start()
 
-            # 获取日志
-            logs = await container.log(stdout=True, stderr=True)
+                deadline = time.monotonic() + config.timeout
+                remaining_bytes = config.max_output_bytes
+                timed_out = truncated = False
+                logs = container.log(stdout=True, stderr=True, follow=True)
+                try:
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            timed_out = True
+                            break
+                        try:
+                            chunk = await asyncio.wait_for(logs.__anext__(), remaining)
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            timed_out = True
+                            break
 
-            # 清理容器
-            await container.delete(force=True)
+                        data = chunk.encode("utf-8")
+                        if len(data) > remaining_bytes:
+                            chunk = data[:remaining_bytes].decode("utf-8", errors="ignore")
+                            truncated = True
+                        remaining_bytes -= len(data)
+                        if chunk:
+                            yield {"type": "output", "data": chunk}
+                        if truncated:
+                            break
+                finally:
+                    await logs.aclose()
 
-            return {"status": "success", "logs": "".join(logs)}
+                # 超时或超出输出上限时容器仍在运行，由下面的强制删除终止
+                exit_code = None
+                if not (timed_out or truncated):
+                    exit_code = (await container.wait())["StatusCode"]
 
+                yield {
+                    "type": "exit",
+                    "exit_code": exit_code,
+                    "timed_out": timed_out,
+                    "truncated": truncated,
+                }
+            finally:
+                # 调用方断开时本协程可能已被取消，删除操作不能再被打断
+                await asyncio.shield(self._remove_container(container))
+
+    async def run_sandbox(self, config: SandboxConfig) -> Dict[str, Any]:
+        """运行沙箱环境，等待结束后一次性返回全部输出"""
+        try:
+            output = []
+            async for event in self.stream_sandbox(config):
+                if event["type"] == "output":
+                    output.append(event["data"])
+                else:
+                    result = event
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Sandbox execution failed: {str(e)}"
             )
 
+        if result["timed_out"]:
+            raise HTTPException(status_code=408, detail="Sandbox execution timed out")
+
+        return {
+            "status": "success",
+            "logs": "".join(output),
+            "exit_code": result["exit_code"],
+            "truncated": result["truncated"],
+        }
+
+
+    async def _exec_snippet(
+        self, container, snippet: str, config: SandboxConfig
+    ) -> Dict[str, Any]:
+        """在常驻容器中执行一个片段，超时由容器内的 timeout 命令负责"""
+        cmd = [
+            "timeout",
+            "--kill-after=1",
+            str(config.timeout),
+            "/bin/sh",
+            "-c",
+            snippet,
+        ]
+        started = time.monotonic()
+        exec_ = await container.exec(cmd, workdir=config.working_dir)
+        output = bytearray()
+        truncated = False
+        async with exec_.start(detach=False) as stream:
+            while True:
+                message = await stream.read_out()
+                if message is None:
+                    break
+                room = config.max_output_bytes - len(output)
+                if len(message.data) > room:
+                    truncated = True
+                output.extend(message.data[: max(room, 0)])
+
+        exit_code = (await exec_.inspect())["ExitCode"]
+        # 137 既可能是 timeout 的 --kill-after，也可能是内存超限被内核结束，按容器状态区分
+        oom_killed = False
+        if exit_code == 137:
+            oom_killed = (await container.show())["State"].get("OOMKilled", False)
+        return {
+            "exit_code": exit_code,
+            "output": output.decode("utf-8", errors="replace"),
+            "truncated": truncated,
+            "timed_out": exit_code == 124 or (exit_code == 137 and not oom_killed),
+            "oom_killed": oom_killed,
+            "duration": round(time.monotonic() - started, 4),
+        }
+
+    async def _reset_container(self, container) -> None:
+        exec_ = await container.exec(["/bin/sh", "-c", _RESET_SCRIPT])
+        async with exec_.start(detach=False) as stream:
+            while await stream.read_out() is not None:
+                pass
+
+    async def run_batch(self, request: BatchSandboxRequest) -> List[Dict[str, Any]]:
+        """在少量常驻容器中依次执行多个片段，每个片段之后重置容器
+
+        容器只在批次开始时创建一次，片段的额外开销只有一次 exec 与一次重置。
+        """
+        config = SandboxConfig(
+            image=request.image,
+            memory_limit=request.memory_limit,
+            cpu_limit=request.cpu_limit,
+            timeout=request.timeout,
+            max_output_bytes=request.max_output_bytes,
+        )
+        container_config = self.create_pool_container_config(config)
+        pool_size = min(request.pool_size, len(request.snippets))
+
+        pool: asyncio.Queue = asyncio.Queue()
+        containers = []
+
+        async def start_container():
+            container = await self.docker.containers.create(config=container_config)
+            containers.append(container)
+            await container.start()
+            return container
+
+        async def replace_container(container):
+            # 替换失败时放回原容器，后续片段会快速失败并再次尝试替换，而不会一直等待空的池
+            await asyncio.shield(self._remove_container(container))
+            try:
+                return await start_container()
+            except Exception:
+                return container
+
+        async def run_one(index: int, snippet: str) -> Dict[str, Any]:
+            container = await pool.get()
+            try:
+                async with self.semaphore:
+                    # 容器内的 timeout 失效时（例如容器被冻结）留出兜底时间
+                    result = await asyncio.wait_for(
+                        self._exec_snippet(container, snippet, config),
+                        config.timeout + 10,
+                    )
+                    if result["oom_killed"]:
+                        # 容器的 OOMKilled 状态不会复位，换一个新容器，避免后续片段被误判
+                        container = await replace_container(container)
+                    else:
+                        await self._reset_container(container)
+            except Exception as e:
+                result = {"exit_code": None, "output": "", "error": str(e)}
+                # 状态未知的容器不再复用，换一个新的
+                container = await replace_container(container)
+            finally:
+                pool.put_nowait(container)
+            return {"index": index, **result}
+
+        try:
+            for container in await asyncio.gather(
+                *(start_container() for _ in range(pool_size))
+            ):
+                pool.put_nowait(container)
+            return await asyncio.gather(
+                *(run_one(i, snippet) for i, snippet in enumerate(request.snippets))
+            )
+        finally:
+            await asyncio.shield(
+                asyncio.gather(
+                    *(self._remove_container(c) for c in containers),
+                    return_exceptions=True,
+                )
+            )
+
+
+# 生命周期内共享的沙箱管理器，复用同一个 aiodocker 会话及其连接池
+_shared_manager: Optional[SandboxManager] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _shared_manager
+    async with SandboxManager() as manager:
+        _shared_manager = manager
+        try:
+            yield
+        finally:
+            _shared_manager = None
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 
 @asynccontextmanager
 async def get_sandbox_manager():
-    """异步上下文管理器获取沙箱管理器"""
+    """异步上下文管理器获取沙箱管理器，未运行在应用生命周期内时临时创建"""
+    if _shared_manager is not None:
+        yield _shared_manager
+        return
     async with SandboxManager() as manager:
         yield manager
 
@@ -96,6 +326,31 @@ async def run_in_sandbox(config: SandboxConfig):
         return await manager.run_sandbox(config)
 
 
+@app.post("/sandbox/stream")
+async def stream_in_sandbox(config: SandboxConfig):
+    """在沙箱中运行命令，以 NDJSON 逐段返回输出"""
+
+    async def generate():
+        async with get_sandbox_manager() as manager:
+            async for event in manager.stream_sandbox(config):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/sandbox/batch")
+async def run_batch_in_sandbox(request: BatchSandboxRequest):
+    """在复用的沙箱容器中批量执行代码片段，按输入顺序返回每个片段的结果"""
+    async with get_sandbox_manager() as manager:
+        try:
+            results = await manager.run_batch(request)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Sandbox batch execution failed: {str(e)}"
+            )
+    return {"status": "success", "results": results}
+
+
 # 示例使用
 @app.post("/sandbox/execute")
 async def execute_command(command: str):
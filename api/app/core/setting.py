@@ -94,6 +94,70 @@ class ChatConfig(BaseSettings):
     temperature: float = Field(default=1.0, env="TEMPERATURE")
     api_type: str = Field(default="openai", env="API_TYPE")
     api_version: str = Field(default="v1", env="API_VERSION")
+    # 命令代理以流式方式接收工具调用，每个调用的参数生成完毕即开始执行
+    stream_tool_calls: bool = Field(default=True, env="STREAM_TOOL_CALLS")
+    # 每百万输入/输出 token 的价格，用于统计各配置档案的费用，0 表示不统计
+    input_cost: float = Field(default=0.0, env="INPUT_COST")
+    output_cost: float = Field(default=0.0, env="OUTPUT_COST")
+
+
+class LLMProfileConfig(BaseSettings):
+    """LLM 配置档案，按代理名称与调用用途选择不同的模型
+
+    PROFILES 为 档案名 -> 覆盖聊天配置的字段（model、max_tokens、temperature、base_url、
+    api_key、api_type、api_version、input_cost、output_cost），未覆盖的字段沿用聊天配置。
+    ROUTES 为 路由 -> 档案名，路由按 "代理名.用途"、"*.用途"、"代理名" 的顺序匹配，
+    代理名为小写，都不匹配时使用 default 档案（即聊天配置）。
+    """
+
+    PROFILES: Dict[str, Dict[str, Any]] = Field(
+        default={"fast": {"max_tokens": 1024, "temperature": 0.2}}, env="PROFILES"
+    )
+    ROUTES: Dict[str, str] = Field(
+        default={"*.judge": "fast", "commandagent.command": "fast"}, env="ROUTES"
+    )
+
+    model_config = SettingsConfigDict(env_prefix="LLM_")
+
+    def resolve(self, agent: str, purpose: Optional[str] = None) -> str:
+        """返回代理在该用途下使用的档案名"""
+        agent = agent.lower()
+        keys = [f"{agent}.{purpose}", f"*.{purpose}"] if purpose else []
+        for key in keys + [agent]:
+            if key in self.ROUTES:
+                return self.ROUTES[key]
+        return "default"
+
+    def profile(self, name: str, base: ChatConfig) -> ChatConfig:
+        """在聊天配置上应用档案的覆盖字段"""
+        if name == "default" and name not in self.PROFILES:
+            return base
+        if name not in self.PROFILES:
+            raise ValueError(f"未定义的 LLM 配置档案: {name}")
+        overrides = self.PROFILES[name]
+        unknown = set(overrides) - set(ChatConfig.model_fields)
+        if unknown:
+            raise ValueError(f"LLM 配置档案 {name} 中有未知字段: {sorted(unknown)}")
+        return base.model_copy(update=overrides)
+
+
+class TokenBudgetConfig(BaseSettings):
+    """按调用类型自适应的输出 token 上限
+
+    上限取最近 WINDOW 次输出长度的 PERCENTILE 分位数乘以 MARGIN，不低于 MIN_TOKENS，
+    不高于配置档案的 max_tokens；样本少于 MIN_SAMPLES 时使用配置档案的 max_tokens。
+    输出被截断时最多续写 MAX_CONTINUATIONS 次。
+    """
+
+    ENABLED: bool = Field(default=True, env="ENABLED")
+    PERCENTILE: float = Field(default=0.95, env="PERCENTILE")
+    MARGIN: float = Field(default=1.25, env="MARGIN")
+    MIN_TOKENS: int = Field(default=64, env="MIN_TOKENS")
+    MIN_SAMPLES: int = Field(default=20, env="MIN_SAMPLES")
+    WINDOW: int = Field(default=200, env="WINDOW")
+    MAX_CONTINUATIONS: int = Field(default=2, env="MAX_CONTINUATIONS")
+
+    model_config = SettingsConfigDict(env_prefix="TOKEN_BUDGET_")
 
 
 class SandboxConfig(BaseSettings):
@@ -107,6 +171,203 @@ class SandboxConfig(BaseSettings):
     working_dir: str = "/sandbox"
 
 
+class SearchConfig(BaseSettings):
+    """代码搜索索引配置"""
+
+    INDEX_DIR: str = Field(default="results/.search_index", env="INDEX_DIR")
+    CHUNK_LINES: int = Field(default=20, env="CHUNK_LINES")
+    MAX_FILE_BYTES: int = Field(default=1024 * 1024, env="MAX_FILE_BYTES")
+    TOP_K: int = Field(default=10, env="TOP_K")
+    # 编辑后延迟保存索引的秒数，期间的多次编辑合并为一次写盘
+    SAVE_DELAY: float = Field(default=2.0, env="SAVE_DELAY")
+
+    model_config = SettingsConfigDict(env_prefix="SEARCH_")
+
+
+class FileOperationsConfig(BaseSettings):
+    """批量文件操作配置"""
+
+    MAX_READ_BYTES: int = Field(default=64 * 1024, env="MAX_READ_BYTES")
+    MAX_GLOB_RESULTS: int = Field(default=500, env="MAX_GLOB_RESULTS")
+
+    model_config = SettingsConfigDict(env_prefix="FILE_OPS_")
+
+
+class RuntimeConfig(BaseSettings):
+    """容器运行时配置"""
+
+    # 运行时后端: docker 或 local（本地子进程，适用于可信任务与 CI）
+    BACKEND: str = Field(default="docker", env="BACKEND")
+    BASE_IMAGE: str = Field(default="box-2", env="BASE_IMAGE")
+
+    # Docker 连接，留空则使用环境变量 DOCKER_HOST 或本地 socket
+    DOCKER_BASE_URL: Optional[str] = Field(default=None, env="DOCKER_BASE_URL")
+    DOCKER_POOL_SIZE: int = Field(default=32, env="DOCKER_POOL_SIZE")
+    CONTAINER_CACHE_TTL: float = Field(default=30.0, env="CONTAINER_CACHE_TTL")
+    CONTAINER_MEMORY: str = Field(default="512m", env="CONTAINER_MEMORY")
+    CONTAINER_CPUS: float = Field(default=1.0, env="CONTAINER_CPUS")
+
+    # 多主机调度：非空时在这些 Docker 端点之间按资源分配容器，default 表示上面的默认连接
+    # （环境快照与共享缓存卷只在默认连接上启用）。主机容量为 0 时从 docker info 获取
+    DOCKER_HOSTS: List[str] = Field(default=[], env="DOCKER_HOSTS")
+    HOST_MEMORY_MB: int = Field(default=0, env="HOST_MEMORY_MB")
+    HOST_CPUS: float = Field(default=0, env="HOST_CPUS")
+    HOST_MAX_EXECS: int = Field(default=64, env="HOST_MAX_EXECS")
+    SCHEDULER_HEADROOM: float = Field(default=0.1, env="SCHEDULER_HEADROOM")
+
+    # 容器生命周期，时间单位为秒，0 表示不限制
+    STATE_DB: str = Field(default="results/runtime.db", env="STATE_DB")
+    CONTAINER_IDLE_TTL: float = Field(default=1800, env="CONTAINER_IDLE_TTL")
+    CONTAINER_MAX_AGE: float = Field(default=6 * 3600, env="CONTAINER_MAX_AGE")
+    REAP_INTERVAL: float = Field(default=60, env="REAP_INTERVAL")
+    SNAPSHOT_ON_REAP: bool = Field(default=False, env="SNAPSHOT_ON_REAP")
+
+    # 只读命令结果缓存，命令需完整匹配以下正则之一才会被缓存
+    COMMAND_CACHE_ENABLED: bool = Field(default=True, env="COMMAND_CACHE_ENABLED")
+    COMMAND_CACHE_MAX_ENTRIES: int = Field(default=2048, env="COMMAND_CACHE_MAX_ENTRIES")
+    COMMAND_CACHE_PATTERNS: List[str] = Field(
+        default=[
+            r"ls(\s+-{1,2}[\w-]+)*(\s+[\w./~-]+)*",
+            r"(cat|head|tail|wc|stat|file|du)(\s+-{1,2}[\w-]+)*(\s+[\w./~-]+)+",
+            r"pwd",
+            r"tree(\s+-{1,2}[\w-]+)*(\s+[\w./~-]+)*",
+            r"git\s+(status|log|diff)(\s+[\w./~-]+)*",
+        ],
+        env="COMMAND_CACHE_PATTERNS",
+    )
+    # 镜像级别的事实（工具版本等），同一镜像的新容器之间共享
+    IMAGE_FACT_PATTERNS: List[str] = Field(
+        default=[
+            # 只匹配已知工具的版本查询，其他命令的 -v 往往是 verbose 之类的选项
+            r"(python3?|pip3?|uv|node|npm|npx|yarn|pnpm|git|go|rustc|cargo|gcc|g\+\+"
+            r"|clang|make|cmake|ruby|php|perl|bash|curl|wget|docker)\s+(--version|-V)",
+            r"(node|npm|npx|yarn|pnpm)\s+-v",
+            r"(go|uv|docker)\s+version",
+            r"java\s+-version",
+            r"which\s+[\w.-]+",
+            r"uname(\s+-\w+)?",
+            r"cat\s+/etc/os-release",
+        ],
+        env="IMAGE_FACT_PATTERNS",
+    )
+
+    # 环境快照：匹配以下正则（search）的成功命令视为安装步骤
+    SNAPSHOT_ENABLED: bool = Field(default=True, env="SNAPSHOT_ENABLED")
+    MAX_SNAPSHOT_IMAGES: int = Field(default=20, env="MAX_SNAPSHOT_IMAGES")
+    SETUP_COMMAND_PATTERNS: List[str] = Field(
+        default=[
+            r"\b(curl|wget)\b.*\|\s*(ba)?sh\b",
+            r"\bnvm\s+(install|alias)\b",
+            r"\buv\s+(pip\s+install|sync|venv|python\s+install|tool\s+install)\b",
+            r"\bpip3?\s+install\b",
+            r"\bnpm\s+(install|ci|i)\b",
+            r"\bapt(-get)?\s+(update|install)\b",
+        ],
+        env="SETUP_COMMAND_PATTERNS",
+    )
+
+    # 包管理器共享缓存卷（uv/pip/npm/nvm）
+    CACHE_VOLUMES_ENABLED: bool = Field(default=False, env="CACHE_VOLUMES_ENABLED")
+    CACHE_VOLUME_MAX_MB: int = Field(default=4096, env="CACHE_VOLUME_MAX_MB")
+    CACHE_PRUNE_INTERVAL: float = Field(default=3600, env="CACHE_PRUNE_INTERVAL")
+    # 最近 CACHE_PRUNE_GRACE 秒内读写过的条目不清理，避免删除正在安装中使用的条目
+    CACHE_PRUNE_GRACE: float = Field(default=600, env="CACHE_PRUNE_GRACE")
+
+    # 批量执行命令
+    EXEC_CONCURRENCY: int = Field(default=4, env="EXEC_CONCURRENCY")
+    EXEC_TIMEOUT: int = Field(default=120, env="EXEC_TIMEOUT")
+    MAX_OUTPUT_CHARS: int = Field(default=16000, env="MAX_OUTPUT_CHARS")
+    # 命令失败后一次生成的候选命令数，在容器副本中并发试运行，小于 2 时不启用（默认）。
+    # 每次试运行都要一次多候选的 LLM 调用、提交容器镜像（提交期间容器暂停）并启动
+    # 同样规格的多个容器，grep 无匹配这类正常的非零退出也会触发，按需开启
+    SPECULATIVE_CANDIDATES: int = Field(default=0, env="SPECULATIVE_CANDIDATES")
+
+    # 本地后端：隔离方式为 none 或 namespaces，配置 cgroup v2 目录后限制资源
+    LOCAL_ROOT: str = Field(default="results/sessions", env="LOCAL_ROOT")
+    LOCAL_ISOLATION: str = Field(default="none", env="LOCAL_ISOLATION")
+    LOCAL_NETWORK: bool = Field(default=True, env="LOCAL_NETWORK")
+    LOCAL_CGROUP_ROOT: Optional[str] = Field(default=None, env="LOCAL_CGROUP_ROOT")
+    LOCAL_MEMORY_LIMIT: str = Field(default="512m", env="LOCAL_MEMORY_LIMIT")
+    LOCAL_CPU_LIMIT: float = Field(default=1.0, env="LOCAL_CPU_LIMIT")
+
+    model_config = SettingsConfigDict(env_prefix="RUNTIME_")
+
+
+class JobConfig(BaseSettings):
+    """后台任务配置"""
+
+    DB_PATH: str = Field(default="results/jobs.db", env="DB_PATH")
+    WORKERS: int = Field(default=4, env="WORKERS")
+    MAX_QUEUE: int = Field(default=100, env="MAX_QUEUE")
+
+    model_config = SettingsConfigDict(env_prefix="JOB_")
+
+
+class CheckpointConfig(BaseSettings):
+    """计划运行检查点配置，每个运行一个追加写入的 JSONL 文件"""
+
+    DIR: str = Field(default="results/checkpoints", env="DIR")
+    # 启动时清理：超过 TTL 秒未更新的检查点删除，剩余的超过 MAX_FILES 个时删除最旧的，0 表示不限制
+    TTL: float = Field(default=7 * 24 * 3600, env="TTL")
+    MAX_FILES: int = Field(default=1000, env="MAX_FILES")
+
+    model_config = SettingsConfigDict(env_prefix="CHECKPOINT_")
+
+
+class PlanCacheConfig(BaseSettings):
+    """计划模板缓存配置，SIMILARITY 为近似匹配所需的最低 Jaccard 相似度，TTL 单位为秒"""
+
+    ENABLED: bool = Field(default=True, env="ENABLED")
+    MAX_ENTRIES: int = Field(default=500, env="MAX_ENTRIES")
+    SIMILARITY: float = Field(default=0.9, env="SIMILARITY")
+    TTL: float = Field(default=86400, env="TTL")
+
+    model_config = SettingsConfigDict(env_prefix="PLAN_CACHE_")
+
+
+class PlanningConfig(BaseSettings):
+    """计划生成配置，JSON_MODE 为真时请求模型的 JSON 输出模式"""
+
+    JSON_MODE: bool = Field(default=True, env="JSON_MODE")
+    # 计划不合法时追加的修正轮次上限，修正只发送错误与原输出，不重新规划
+    MAX_CORRECTIONS: int = Field(default=1, env="MAX_CORRECTIONS")
+    # 步骤失败时只用失败的步骤、它的输出与剩余步骤重新规划后续步骤，REPLAN_OUTPUT_CHARS
+    # 为发送给模型的输出长度上限
+    MAX_REPLANS: int = Field(default=2, env="MAX_REPLANS")
+    REPLAN_OUTPUT_CHARS: int = Field(default=2000, env="REPLAN_OUTPUT_CHARS")
+
+    model_config = SettingsConfigDict(env_prefix="PLANNING_")
+
+
+class AdmissionConfig(BaseSettings):
+    """准入控制配置，上限为 0 表示不限制，时间单位为秒"""
+
+    ENABLED: bool = Field(default=True, env="ENABLED")
+    MAX_INFLIGHT_PLANS: int = Field(default=8, env="MAX_INFLIGHT_PLANS")
+    MAX_PLAN_QUEUE: int = Field(default=16, env="MAX_PLAN_QUEUE")
+    MAX_PENDING_LLM: int = Field(default=16, env="MAX_PENDING_LLM")
+    MAX_CONTAINERS: int = Field(default=0, env="MAX_CONTAINERS")
+    # 排队时间持续超过 TARGET_DELAY 达到 INTERVAL 后开始拒绝新请求
+    TARGET_DELAY: float = Field(default=5.0, env="TARGET_DELAY")
+    INTERVAL: float = Field(default=30.0, env="INTERVAL")
+    MAX_WAIT: float = Field(default=60.0, env="MAX_WAIT")
+    # LLM 限流且响应中没有 Retry-After 时的退避时间
+    RATE_LIMIT_BACKOFF: float = Field(default=10.0, env="RATE_LIMIT_BACKOFF")
+    # 关闭时等待正在执行的计划完成的最长时间，超时的计划保存检查点后中断
+    DRAIN_TIMEOUT: float = Field(default=30.0, env="DRAIN_TIMEOUT")
+
+    model_config = SettingsConfigDict(env_prefix="ADMISSION_")
+
+
+class IdempotencyConfig(BaseSettings):
+    """幂等键配置，TTL 为结果保留时间（秒）"""
+
+    TTL: float = Field(default=3600, env="TTL")
+    MAX_ENTRIES: int = Field(default=1000, env="MAX_ENTRIES")
+
+    model_config = SettingsConfigDict(env_prefix="IDEMPOTENCY_")
+
+
 class Settings(BaseSettings):
     """组合所有配置的主类"""
 
@@ -117,6 +378,17 @@ class Settings(BaseSettings):
     cors: CORSConfig = CORSConfig()
     logger: LOGGERConfig = LOGGERConfig()
     chat: ChatConfig = ChatConfig()  # 聊天代理配置
+    llm: LLMProfileConfig = LLMProfileConfig()  # LLM 配置档案与路由
+    token_budget: TokenBudgetConfig = TokenBudgetConfig()  # 输出 token 上限配置
+    search: SearchConfig = SearchConfig()  # 代码搜索配置
+    file_ops: FileOperationsConfig = FileOperationsConfig()  # 批量文件操作配置
+    runtime: RuntimeConfig = RuntimeConfig()  # 容器运行时配置
+    job: JobConfig = JobConfig()  # 后台任务配置
+    checkpoint: CheckpointConfig = CheckpointConfig()  # 运行检查点配置
+    plan_cache: PlanCacheConfig = PlanCacheConfig()  # 计划模板缓存配置
+    planning: PlanningConfig = PlanningConfig()  # 计划生成配置
+    admission: AdmissionConfig = AdmissionConfig()  # 准入控制配置
+    idempotency: IdempotencyConfig = IdempotencyConfig()  # 幂等键配置
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
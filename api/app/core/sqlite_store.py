@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+
+class SQLiteStore:
+    """SQLite 登记表的基类
+
+    连接在第一次使用时才打开并建表，导入模块时不会创建数据库文件。
+    子类在 SCHEMA 中给出建表语句，读写时使用 `with self._lock, self._conn:`。
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self._open_lock:
+                if self._connection is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    connection = sqlite3.connect(self.path, check_same_thread=False)
+                    with connection:
+                        connection.execute(self.SCHEMA)
+                    self._connection = connection
+        return self._connection
+
+    def close(self) -> None:
+        """关闭连接，之后再次使用时重新打开"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,113 @@
+import math
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict
+
+from app.core.setting import settings
+
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """响应中没有用量时粗略估算 token 数：中日文字符与标点每个至少一个 token，其余约四个字符一个"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return max(1, cjk + math.ceil((len(text) - cjk) / 4))
+
+
+@dataclass
+class _CallTypeStats:
+    samples: Deque[int]
+    budget: int = 0
+    truncations: int = 0
+    fallbacks: int = 0
+    requests: int = 0
+    reserved: int = 0
+
+
+class TokenBudget:
+    """按调用类型自适应的输出 token 上限
+
+    每种调用类型（配置档案/调用用途，例如 fast/judge）记录最近 WINDOW 次响应的输出长度，
+    上限取其 PERCENTILE 分位数乘以 MARGIN，并限制在 [MIN_TOKENS, 配置档案的 max_tokens] 内。
+    样本不足 MIN_SAMPLES 时使用配置档案的 max_tokens。服务端按 max_tokens 预留
+    每分钟 token 配额，较小的上限让同样的配额容纳更多并发请求。
+    输出因达到上限被截断时由调用方按配置档案的 max_tokens 续写或重新请求，
+    截断后的完整长度同样计入样本，上限随之升高。
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        percentile: float,
+        margin: float,
+        min_tokens: int,
+        min_samples: int,
+        window: int,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.margin = margin
+        self.min_tokens = min_tokens
+        self.min_samples = min_samples
+        self.window = window
+        self._stats: Dict[str, _CallTypeStats] = {}
+
+    def _get(self, key: str) -> _CallTypeStats:
+        if key not in self._stats:
+            self._stats[key] = _CallTypeStats(samples=deque(maxlen=self.window))
+        return self._stats[key]
+
+    def budget(self, key: str, cap: int) -> int:
+        """返回该调用类型本次请求的 max_tokens，cap 为配置档案的上限"""
+        stats = self._get(key)
+        stats.requests += 1
+        if not self.enabled or len(stats.samples) < self.min_samples:
+            stats.budget = cap
+        else:
+            ordered = sorted(stats.samples)
+            index = max(0, math.ceil(self.percentile * len(ordered)) - 1)
+            stats.budget = min(
+                cap, max(self.min_tokens, math.ceil(ordered[index] * self.margin))
+            )
+        stats.reserved += stats.budget
+        return stats.budget
+
+    def observe(self, key: str, tokens: int, truncated: bool = False) -> None:
+        """记录一次调用的完整输出长度（包括续写部分），truncated 表示首次请求被截断"""
+        stats = self._get(key)
+        stats.samples.append(tokens)
+        if truncated:
+            stats.truncations += 1
+
+    def fallback(self, key: str, cap: int) -> None:
+        """截断后按配置档案上限续写或重新请求"""
+        stats = self._get(key)
+        stats.fallbacks += 1
+        stats.reserved += cap
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            key: {
+                "budget": stats.budget,
+                "samples": len(stats.samples),
+                "requests": stats.requests,
+                "truncations": stats.truncations,
+                "fallbacks": stats.fallbacks,
+                "reserved_tokens": stats.reserved,
+            }
+            for key, stats in self._stats.items()
+        }
+
+
+token_budget = TokenBudget(
+    enabled=settings.token_budget.ENABLED,
+    percentile=settings.token_budget.PERCENTILE,
+    margin=settings.token_budget.MARGIN,
+    min_tokens=settings.token_budget.MIN_TOKENS,
+    min_samples=settings.token_budget.MIN_SAMPLES,
+    window=settings.token_budget.WINDOW,
+)
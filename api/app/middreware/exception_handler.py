@@ -2,14 +2,22 @@ from typing import Callable
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
-from app.common import BusinessException, error_response, ResponseCode
+from app.common import (
+    BusinessException,
+    ServiceBusyException,
+    error_response,
+    ResponseCode,
+)
 
 
 async def handle_business_exception(
     request: Request, exc: BusinessException
 ) -> JSONResponse:
     """处理业务异常"""
-    return error_response(code=exc.code, msg=exc.msg, data=exc.data)
+    response = error_response(code=exc.code, msg=exc.msg, data=exc.data)
+    if isinstance(exc, ServiceBusyException):
+        response.headers["Retry-After"] = str(exc.retry_after)
+    return response
 
 
 async def handle_validation_exception(
@@ -0,0 +1,122 @@
+import io
+import posixpath
+import shlex
+import subprocess
+import tarfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.runtime.backend import get_backend
+from app.runtime.lifecycle import lifecycle_manager
+
+# 建索引、批量读取时默认跳过的目录
+DEFAULT_EXCLUDES = [
+    ".git",
+    "node_modules",
+    ".venv",
+    "venv",
+    "__pycache__",
+    ".mypy_cache",
+    ".pytest_cache",
+    "dist",
+    "build",
+]
+
+
+class IterStream(io.RawIOBase):
+    """把 docker 返回的字节块生成器包装成只读的文件对象，供 tarfile 流式解析"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def is_binary(data: bytes) -> bool:
+    """简单的二进制检测：前 8KB 中出现 NUL 字节即视为二进制"""
+    return b"\x00" in data[:8192]
+
+
+def stream_container_tar(container_id: str, script: str) -> Iterator[bytes]:
+    """在容器内执行一段输出 tar 流的脚本，返回 stdout 字节块生成器
+
+    读取期间容器登记为使用中，不会被回收。
+    """
+    with lifecycle_manager.in_use(container_id):
+        yield from get_backend().stream_tar(container_id, script)
+
+
+def stream_local_tar(workdir: str, script: str) -> Iterator[bytes]:
+    """在本地目录执行同样的脚本，用于没有容器的工作区"""
+    process = subprocess.Popen(
+        ["/bin/bash", "-c", script],
+        cwd=workdir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while chunk := process.stdout.read(64 * 1024):
+            yield chunk
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def read_tar_members(chunks: Iterable[bytes]) -> Dict[str, bytes]:
+    """流式解析 tar，返回 成员名 -> 内容 的字典（只保留普通文件）"""
+    members: Dict[str, bytes] = {}
+    with tarfile.open(fileobj=IterStream(chunks), mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            fileobj = tar.extractfile(member)
+            if fileobj is not None:
+                members[posixpath.normpath(member.name)] = fileobj.read()
+    return members
+
+
+def iter_container_files(
+    container_id: str,
+    root: str = "/app",
+    max_bytes: int = 1024 * 1024,
+    excludes: Optional[List[str]] = None,
+) -> Iterator[Tuple[str, bytes]]:
+    """通过一次 tar 流读取容器目录下的所有普通文件
+
+    参数:
+        container_id: 容器ID
+        root: 容器内的根目录
+        max_bytes: 单文件大小上限，超过的文件直接跳过
+        excludes: 需要排除的目录名
+
+    返回:
+        (容器内绝对路径, 文件内容) 的生成器
+    """
+    exclude_args = " ".join(
+        f"--exclude={shlex.quote(name)}" for name in (excludes or DEFAULT_EXCLUDES)
+    )
+    script = f"tar -C {shlex.quote(root)} {exclude_args} -cf - . 2>/dev/null"
+
+    with tarfile.open(
+        fileobj=IterStream(stream_container_tar(container_id, script)), mode="r|"
+    ) as tar:
+        for member in tar:
+            if not member.isfile() or member.size > max_bytes:
+                continue
+            fileobj = tar.extractfile(member)
+            if fileobj is None:
+                continue
+            path = posixpath.normpath(posixpath.join(root, member.name))
+            yield path, fileobj.read()
@@ -0,0 +1,136 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.setting import settings
+
+
+class RuntimeNotFoundError(Exception):
+    """运行时（容器或本地会话）不存在"""
+
+
+def parse_memory(limit: str) -> int:
+    """把 512m / 2g 形式的内存限制转换为字节"""
+    units = {"k": 1024, "m": 1024**2, "g": 1024**3}
+    limit = limit.strip().lower()
+    if limit and limit[-1] in units:
+        return int(float(limit[:-1]) * units[limit[-1]])
+    return int(limit)
+
+
+@dataclass
+class RuntimeHandle:
+    """运行时句柄，对调用方屏蔽容器与本地会话的差异"""
+
+    id: str
+    image: str = ""
+    # 创建时尚未执行、需要由上层继续执行的安装命令
+    pending_setup: List[str] = field(default_factory=list)
+    raw: Any = None
+
+
+class RuntimeBackend(ABC):
+    """命令执行运行时的后端接口
+
+    后端只负责隔离环境本身的创建、执行、读写与删除；命令结果缓存、生命周期登记等
+    与后端无关的逻辑由 app.runtime.base 中的函数统一处理。
+    """
+
+    name: str = "base"
+
+    async def start(self) -> None:
+        """应用启动时调用"""
+
+    async def shutdown(self) -> None:
+        """应用关闭时调用"""
+
+    @abstractmethod
+    async def create(self, setup_commands: List[str]) -> RuntimeHandle:
+        """创建运行时，可以利用缓存跳过部分安装命令，剩余的放在 pending_setup 中"""
+
+    @abstractmethod
+    async def describe(self, runtime_id: str) -> RuntimeHandle:
+        """获取运行时的完整ID与镜像，不存在时抛出 RuntimeNotFoundError"""
+
+    @abstractmethod
+    async def exec(
+        self, runtime_id: str, command: str, workdir: str, timeout: Optional[int]
+    ) -> Tuple[int, bytes]:
+        """执行命令，返回 (退出码, 合并后的输出)，超时返回 124"""
+
+    @abstractmethod
+    async def write_file(self, runtime_id: str, path: str, data: bytes) -> None:
+        """写入文件，父目录不存在时自动创建"""
+
+    @abstractmethod
+    async def read_file(self, runtime_id: str, path: str) -> bytes:
+        """读取文件"""
+
+    @abstractmethod
+    def stream_tar(self, runtime_id: str, script: str) -> Iterator[bytes]:
+        """执行一段向标准输出写 tar 流的脚本，返回字节块生成器（同步，在线程中消费）"""
+
+    @abstractmethod
+    async def delete(self, runtime_id: str) -> None:
+        """删除运行时"""
+
+    async def stop(self, runtime_id: str) -> None:
+        """优雅停止运行时中的进程，默认不做任何事"""
+
+    async def fork(self, runtime_id: str, count: int) -> List[RuntimeHandle]:
+        """复制运行时的当前状态，创建 count 个副本用于推测执行，副本用 delete 删除
+
+        副本必须没有网络：试运行的命令不能产生外部副作用，也不能因监听同一端口而互相冲突。
+        不支持复制或无法隔离网络的后端抛出 NotImplementedError。
+        """
+        raise NotImplementedError(f"{self.name} 后端不支持复制运行时")
+
+    async def capacity(self) -> Tuple[int, float]:
+        """主机可分配的 (内存字节数, CPU 核数)，供多主机调度使用"""
+        return 0, 0.0
+
+    async def memory_usage(self, runtime_id: str) -> int:
+        """当前内存占用（字节），无法获取时返回 0"""
+        return 0
+
+    async def snapshot(self, runtime_id: str) -> None:
+        """回收前的快照，默认不做任何事"""
+
+    async def after_exec(self, runtime_id: str, command: str, exit_code: int) -> None:
+        """命令执行完成后的钩子，默认不做任何事"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+_backend: Optional[RuntimeBackend] = None
+
+
+def create_backend(name: str) -> RuntimeBackend:
+    """按名称创建后端，按需导入，未使用 Docker 时不需要安装 docker 依赖"""
+    if name == "docker" and settings.runtime.DOCKER_HOSTS:
+        from app.runtime.scheduler import ScheduledBackend
+
+        return ScheduledBackend.from_settings()
+    if name == "docker":
+        from app.runtime.docker_backend import DockerBackend
+
+        return DockerBackend()
+    if name == "local":
+        from app.runtime.local_backend import LocalBackend
+
+        return LocalBackend()
+    raise ValueError(f"未知的运行时后端: {name}")
+
+
+def get_backend() -> RuntimeBackend:
+    global _backend
+    if _backend is None:
+        _backend = create_backend(settings.runtime.BACKEND)
+    return _backend
+
+
+def set_backend(backend: RuntimeBackend) -> None:
+    """替换全局后端，供测试或多主机调度使用"""
+    global _backend
+    _backend = backend
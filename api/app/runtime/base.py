@@ -1,49 +1,293 @@
-from docker import DockerClient
-from docker.errors import NotFound, DockerException
+import asyncio
+import time
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 
-client = DockerClient()
+from app.core.setting import settings
+from app.runtime.backend import RuntimeHandle, get_backend
+from app.runtime.cache import command_cache
+from app.runtime.lifecycle import lifecycle_manager
+from app.runtime.search import forget_search_index
+from app.core.logger import log_error
 
+# coreutils timeout 在超时后返回 124，被 KILL 时返回 137
+_TIMEOUT_EXIT_CODES = (124, 137)
 
-async def create_container():
-    try:
 
-        container = client.containers.create(
-            "box-2",
-            detach=True,
-            mem_limit="512m",
-            network_mode="host",
-        )
+@dataclass
+class CommandResult:
+    """单条命令的执行结果"""
+
+    command: str
+    exit_code: int
+    output: str
+    truncated: bool = False
+    timed_out: bool = False
+    cached: bool = False
+    duration: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def truncate_output(output: str, max_bytes: int) -> Tuple[str, bool]:
+    """超长输出保留首尾两部分，错误信息通常出现在末尾"""
+    if max_bytes <= 0 or len(output) <= max_bytes:
+        return output, False
+    half = max_bytes // 2
+    omitted = len(output) - 2 * half
+    return f"{output[:half]}\n... 省略 {omitted} 个字符 ...\n{output[-half:]}", True
+
+
+async def create_container(setup_commands: Optional[List[str]] = None) -> RuntimeHandle:
+    """创建容器（或本地会话，取决于配置的运行时后端）
+
+    参数:
+        setup_commands: 可选的环境安装命令序列。若其前缀已有环境快照，
+            则直接从快照镜像启动，只执行剩余的命令。只有给出安装命令创建的容器
+            才会提交环境快照，供之后给出相同前缀的创建请求复用。
+
+    返回:
+        RuntimeHandle: 运行时句柄，id 即后续接口使用的容器ID
+    """
+    handle = await get_backend().create(setup_commands or [])
+    lifecycle_manager.track(handle.id, handle.image)
+
+    for command in handle.pending_setup:
+        result = await run_command(handle.id, command)
+        if result.exit_code != 0:
+            log_error(f"环境安装命令执行失败: {command}\n{result.output}")
+            break
 
-        container.start()
+    return handle
 
-        _, output = container.exec_run(
-            cmd=["mkdir", "-p", "/app"],
-            user="root",
+
+async def run_command(
+    container_id: str,
+    command: str,
+    workdir: str = "/app",
+    timeout: Optional[int] = None,
+    max_output: Optional[int] = None,
+) -> CommandResult:
+    """在容器中执行命令并返回包含退出码的结构化结果
+
+    参数:
+        container_id: 容器ID
+        command: 要执行的 bash 命令
+        workdir: 工作目录
+        timeout: 超时时间（秒），为空则不限制
+        max_output: 输出的最大字符数，为空则不截断
+
+    返回:
+        CommandResult: 执行结果
+    """
+    backend = get_backend()
+    handle = await backend.describe(container_id)
+    lifecycle_manager.touch(handle.id)
+
+    use_cache = settings.runtime.COMMAND_CACHE_ENABLED and command_cache.is_cacheable(
+        command
+    )
+    if use_cache:
+        cached = command_cache.get(handle.id, handle.image, workdir, command)
+        if cached is not None:
+            output, truncated = truncate_output(cached, max_output or 0)
+            return CommandResult(
+                command=command,
+                exit_code=0,
+                output=output,
+                truncated=truncated,
+                cached=True,
+            )
+    else:
+        # 可能产生写操作的命令，执行前后都让缓存失效
+        command_cache.bump(handle.id)
+
+    generation = command_cache.generation(handle.id)
+    started = time.monotonic()
+    with lifecycle_manager.in_use(handle.id):
+        exit_code, output = await backend.exec(handle.id, command, workdir, timeout)
+    duration = time.monotonic() - started
+    result = output.decode("utf-8", errors="replace")
+
+    if not use_cache:
+        command_cache.bump(handle.id)
+        await backend.after_exec(handle.id, command, exit_code)
+    elif exit_code == 0:
+        command_cache.put(
+            handle.id, handle.image, workdir, command, result, generation
         )
 
-        return container
-    except DockerException as e:
-        raise
+    result, truncated = truncate_output(result, max_output or 0)
+    return CommandResult(
+        command=command,
+        exit_code=exit_code,
+        output=result,
+        truncated=truncated,
+        timed_out=bool(timeout) and exit_code in _TIMEOUT_EXIT_CODES,
+        duration=duration,
+    )
+
+
+async def write_file(container_id: str, path: str, content: str) -> None:
+    """写入文件，相对路径相对于 /app，内容不经过 shell 转义"""
+    backend = get_backend()
+    # 短ID与完整ID指向同一容器，缓存与活跃状态都按完整ID记录
+    handle = await backend.describe(container_id)
+    with lifecycle_manager.in_use(handle.id):
+        await backend.write_file(handle.id, path, content.encode("utf-8"))
+    command_cache.bump(handle.id)
+
+
+async def read_file(container_id: str, path: str) -> str:
+    """读取文件，相对路径相对于 /app"""
+    backend = get_backend()
+    handle = await backend.describe(container_id)
+    with lifecycle_manager.in_use(handle.id):
+        data = await backend.read_file(handle.id, path)
+    return data.decode("utf-8", errors="replace")
 
 
-async def execute_command(container_id: str, command: str):
+async def execute_command(container_id: str, command: str, workdir: str = "/app"):
+    result = await run_command(container_id, command, workdir)
+    return result.output
+
+
+async def iter_command_results(
+    container_id: str,
+    commands: List[str],
+    concurrency: Optional[int] = None,
+    timeout: Optional[int] = None,
+    max_output: Optional[int] = None,
+    workdir: str = "/app",
+) -> AsyncIterator[Tuple[int, CommandResult]]:
+    """在同一容器中并发执行多条命令，按完成顺序产出 (序号, 结果)"""
+    semaphore = asyncio.Semaphore(concurrency or settings.runtime.EXEC_CONCURRENCY)
+    timeout = timeout or settings.runtime.EXEC_TIMEOUT
+    max_output = max_output or settings.runtime.MAX_OUTPUT_CHARS
+
+    async def run_one(index: int, command: str) -> Tuple[int, CommandResult]:
+        async with semaphore:
+            try:
+                return index, await run_command(
+                    container_id, command, workdir, timeout, max_output
+                )
+            except Exception as e:
+                return index, CommandResult(command=command, exit_code=-1, output=str(e))
+
+    tasks = [
+        asyncio.create_task(run_one(index, command))
+        for index, command in enumerate(commands)
+    ]
     try:
-        container = client.containers.get(container_id)
-        exit_code, output = container.exec_run(
-            cmd=["/bin/bash", "-c", command],
-            workdir="/app",
-            user="root",
-            stream=False,
-        )
-        return output.decode("utf-8")
-    except DockerException as e:
-        raise
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def execute_commands(
+    container_id: str,
+    commands: List[str],
+    concurrency: Optional[int] = None,
+    timeout: Optional[int] = None,
+    max_output: Optional[int] = None,
+    workdir: str = "/app",
+) -> List[CommandResult]:
+    """在同一容器中并发执行多条命令，结果按输入顺序返回"""
+    results: List[Optional[CommandResult]] = [None] * len(commands)
+    async for index, result in iter_command_results(
+        container_id, commands, concurrency, timeout, max_output, workdir
+    ):
+        results[index] = result
+    return results
 
 
 async def delete_container(container_id: str):
+    handle = await get_backend().describe(container_id)
+    await get_backend().delete(handle.id)
+    lifecycle_manager.untrack(handle.id)
+    command_cache.forget(handle.id)
+    await forget_search_index(handle.id)
+
+
+# 推测执行的统计：rounds 为试运行轮次，wins 为有候选成功的轮次
+speculation_metrics: Dict[str, int] = {"rounds": 0, "wins": 0, "candidates": 0}
+_cleanup_tasks: Set[asyncio.Task] = set()
+
+
+async def fork_container(container_id: str, count: int) -> List[RuntimeHandle]:
+    """创建容器当前状态的副本，副本同样登记到生命周期管理，异常退出时会被回收"""
+    handle = await get_backend().describe(container_id)
+    forks = await get_backend().fork(handle.id, count)
+    for fork in forks:
+        lifecycle_manager.track(fork.id, fork.image)
+    return forks
+
+
+async def _discard_forks(forks: List[RuntimeHandle]) -> None:
+    for fork in forks:
+        try:
+            await delete_container(fork.id)
+        except Exception as e:
+            log_error(f"删除容器副本 {fork.id} 失败: {e}")
+
+
+async def run_speculative(
+    container_id: str,
+    commands: List[str],
+    timeout: Optional[int] = None,
+    max_output: Optional[int] = None,
+    workdir: str = "/app",
+) -> Tuple[Optional[int], List[Optional[CommandResult]]]:
+    """在容器的副本中并发试运行候选命令，原容器不受影响
+
+    第一个退出码为 0 的候选胜出，其余仍在执行的候选被取消。副本在后台删除。
+
+    返回:
+        (胜出候选的序号，没有成功的候选时为 None, 各候选的结果，被取消的为 None)
+    """
+    timeout = timeout or settings.runtime.EXEC_TIMEOUT
+    max_output = max_output or settings.runtime.MAX_OUTPUT_CHARS
+    forks = await fork_container(container_id, len(commands))
+    speculation_metrics["rounds"] += 1
+    speculation_metrics["candidates"] += len(commands)
+
+    tasks = {
+        asyncio.create_task(
+            run_command(fork.id, command, workdir, timeout, max_output)
+        ): index
+        for index, (fork, command) in enumerate(zip(forks, commands))
+    }
+    results: List[Optional[CommandResult]] = [None] * len(commands)
+    winner: Optional[int] = None
     try:
-        container = client.containers.get(container_id)
-        container.stop()
-        container.remove()
-    except DockerException as e:
-        raise
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                index = tasks[task]
+                try:
+                    results[index] = task.result()
+                except Exception as e:
+                    results[index] = CommandResult(
+                        command=commands[index], exit_code=-1, output=str(e)
+                    )
+                if results[index].exit_code == 0 and winner is None:
+                    winner = index
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 删除容器可能需要等待容器停止，不阻塞调用方
+        cleanup = asyncio.create_task(_discard_forks(forks))
+        _cleanup_tasks.add(cleanup)
+        cleanup.add_done_callback(_cleanup_tasks.discard)
+
+    if winner is not None:
+        speculation_metrics["wins"] += 1
+    return winner, results
+
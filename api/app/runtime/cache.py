@@ -0,0 +1,118 @@
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.core.setting import settings
+
+
+class CommandCache:
+    """只读命令的结果缓存
+
+    容器级缓存的键为 (容器ID, 工作目录, 文件系统代数, 命令)。任何不在白名单中的命令
+    或文件编辑都会让该容器的代数加一，旧的缓存项随之失效并由 LRU 淘汰。
+
+    镜像级缓存保存工具版本等镜像自带的事实，只对尚未发生写操作（代数为 0）的容器生效，
+    因为容器内安装新工具后这些事实就不再可靠。
+    """
+
+    def __init__(
+        self,
+        patterns: List[str],
+        image_patterns: List[str],
+        max_entries: int = 2048,
+    ):
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.image_patterns = [re.compile(pattern) for pattern in image_patterns]
+        self.max_entries = max_entries
+        self.generations: Dict[str, int] = {}
+        self.entries: "OrderedDict[Tuple[str, str, int, str], str]" = OrderedDict()
+        self.image_entries: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(command: str) -> str:
+        return " ".join(command.split())
+
+    def is_read_only(self, command: str) -> bool:
+        command = self._normalize(command)
+        return any(pattern.fullmatch(command) for pattern in self.patterns)
+
+    def is_image_fact(self, command: str) -> bool:
+        command = self._normalize(command)
+        return any(pattern.fullmatch(command) for pattern in self.image_patterns)
+
+    def is_cacheable(self, command: str) -> bool:
+        return self.is_read_only(command) or self.is_image_fact(command)
+
+    def generation(self, container_id: str) -> int:
+        return self.generations.get(container_id, 0)
+
+    def bump(self, container_id: str) -> None:
+        """文件系统可能发生了变化，使该容器的缓存失效"""
+        self.generations[container_id] = self.generation(container_id) + 1
+
+    def forget(self, container_id: str) -> None:
+        self.generations.pop(container_id, None)
+        for key in [key for key in self.entries if key[0] == container_id]:
+            del self.entries[key]
+
+    def get(
+        self, container_id: str, image_id: str, cwd: str, command: str
+    ) -> Optional[str]:
+        command = self._normalize(command)
+        generation = self.generation(container_id)
+
+        key = (container_id, cwd, generation, command)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        image_key = (image_id, cwd, command)
+        if generation == 0 and image_key in self.image_entries:
+            self.image_entries.move_to_end(image_key)
+            self.hits += 1
+            return self.image_entries[image_key]
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        container_id: str,
+        image_id: str,
+        cwd: str,
+        command: str,
+        output: str,
+        generation: int,
+    ) -> None:
+        """写入缓存，generation 为命令开始执行时的代数，执行期间代数变化则放弃写入"""
+        command = self._normalize(command)
+        if generation != self.generation(container_id):
+            return
+
+        if generation == 0 and self.is_image_fact(command):
+            self._store(self.image_entries, (image_id, cwd, command), output)
+        self._store(self.entries, (container_id, cwd, generation, command), output)
+
+    def _store(self, entries: OrderedDict, key: Tuple, output: str) -> None:
+        entries[key] = output
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "image_entries": len(self.image_entries),
+        }
+
+
+command_cache = CommandCache(
+    patterns=settings.runtime.COMMAND_CACHE_PATTERNS,
+    image_patterns=settings.runtime.IMAGE_FACT_PATTERNS,
+    max_entries=settings.runtime.COMMAND_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,347 @@
+import asyncio
+import io
+import posixpath
+import tarfile
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from docker import DockerClient
+from docker.errors import DockerException, ImageNotFound, NotFound
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.runtime.backend import (
+    RuntimeBackend,
+    RuntimeHandle,
+    RuntimeNotFoundError,
+    parse_memory,
+)
+from app.runtime.docker_client import (
+    ContainerHandleCache,
+    close_docker_client,
+    container_handles,
+    get_docker_client,
+)
+from app.runtime.snapshot import snapshot_manager
+from app.runtime.volumes import cache_volume_manager, container_volume_options
+
+
+# 命令在 timeout 下运行（timeout 会成为独立进程组的组长，0 表示不限时），
+# 进程组号写入 pid 文件，取消时据此结束整个进程组。
+# 结束后把退出码跟在标记（$3，每次执行随机生成）后面写到输出末尾，省去一次 exec_inspect
+_EXEC_WRAPPER = (
+    'timeout --kill-after=5 "$1" /bin/bash -c "$0" & pid=$!; '
+    'echo "$pid" > "$2"; wait "$pid"; code=$?; rm -f "$2"; '
+    'printf "%s%d\\n" "$3" "$code"; exit "$code"'
+)
+# pid 文件可能还没来得及写入，稍等片刻
+_KILL_SCRIPT = (
+    'for i in 1 2 3 4 5 6 7 8 9 10; do [ -s "$0" ] && break; sleep 0.2; done; '
+    '[ -s "$0" ] && kill -KILL -- -"$(cat "$0")"; rm -f "$0"'
+)
+
+
+class DockerBackend(RuntimeBackend):
+    """基于 Docker 容器的运行时
+
+    未指定 base_url 时使用共享的默认连接，并启用环境快照与共享缓存卷；
+    指定 base_url 时（多主机调度）使用独立的连接与句柄缓存。
+    """
+
+    name = "docker"
+
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = base_url
+        self.primary = base_url is None
+        self._client: Optional[DockerClient] = None
+        # 副本容器ID -> 创建它所用的临时镜像，最后一个副本删除后删除镜像
+        self._fork_images: Dict[str, str] = {}
+        if self.primary:
+            self.handles = container_handles
+        else:
+            self.handles = ContainerHandleCache(
+                client_getter=lambda: self.client,
+                ttl=settings.runtime.CONTAINER_CACHE_TTL,
+            )
+
+    @property
+    def client(self) -> DockerClient:
+        if self.primary:
+            return get_docker_client()
+        if self._client is None:
+            self._client = DockerClient(
+                base_url=self.base_url, max_pool_size=settings.runtime.DOCKER_POOL_SIZE
+            )
+        return self._client
+
+    @property
+    def snapshots_enabled(self) -> bool:
+        return self.primary and settings.runtime.SNAPSHOT_ENABLED
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.client.ping)
+        await asyncio.to_thread(self.handles.start_watcher)
+        if self.primary:
+            await cache_volume_manager.start()
+        log_info(f"Docker 运行时已启动: {self.base_url or 'default'}")
+
+    async def shutdown(self) -> None:
+        if self.primary:
+            await cache_volume_manager.stop()
+            snapshot_manager.registry.close()
+        self.handles.stop_watcher()
+        if self.primary:
+            await asyncio.to_thread(close_docker_client)
+        elif self._client is not None:
+            await asyncio.to_thread(self._client.close)
+            self._client = None
+
+    async def capacity(self) -> Tuple[int, float]:
+        info = await asyncio.to_thread(self.client.info)
+        return int(info.get("MemTotal", 0)), float(info.get("NCPU", 0))
+
+    def _get(self, runtime_id: str):
+        try:
+            return self.handles.get(runtime_id)
+        except NotFound as e:
+            raise RuntimeNotFoundError(runtime_id) from e
+
+    async def create(self, setup_commands: List[str]) -> RuntimeHandle:
+        base_image_id = (
+            await asyncio.to_thread(self.client.images.get, settings.runtime.BASE_IMAGE)
+        ).id
+
+        image, restored = settings.runtime.BASE_IMAGE, 0
+        if self.snapshots_enabled:
+            snapshot_image, restored = await snapshot_manager.find_snapshot(
+                base_image_id, setup_commands
+            )
+            image = snapshot_image or image
+
+        try:
+            container = await asyncio.to_thread(self._start_container, image)
+        except ImageNotFound:
+            if image == settings.runtime.BASE_IMAGE:
+                raise
+            # 快照镜像在查找之后被删除，改为从基础镜像启动并执行全部安装命令
+            snapshot_manager.discard_image(image)
+            image, restored = settings.runtime.BASE_IMAGE, 0
+            container = await asyncio.to_thread(self._start_container, image)
+        self.handles.put(container)
+        # 快照只能通过创建时给出的安装命令复用，没有安装命令的容器不记录安装序列
+        if self.snapshots_enabled and setup_commands:
+            snapshot_manager.start_chain(
+                container.id, base_image_id, setup_commands[:restored]
+            )
+
+        return RuntimeHandle(
+            id=container.id,
+            image=image,
+            pending_setup=setup_commands[restored:],
+            raw=container,
+        )
+
+    def _start_container(self, image: str, network_mode: str = "host"):
+        container = self.client.containers.create(
+            image,
+            detach=True,
+            mem_limit=parse_memory(settings.runtime.CONTAINER_MEMORY),
+            nano_cpus=int(settings.runtime.CONTAINER_CPUS * 1e9),
+            network_mode=network_mode,
+            **(container_volume_options() if self.primary else {}),
+        )
+        container.start()
+        container.exec_run(cmd=["mkdir", "-p", "/app"], user="root")
+        return container
+
+    async def fork(self, runtime_id: str, count: int) -> List[RuntimeHandle]:
+        """把容器提交为临时镜像，再从镜像启动 count 个副本，镜像层在副本间共享（写时复制）
+
+        副本没有网络，试运行的命令不会产生外部副作用，监听端口也不会互相冲突。
+        """
+        container = await asyncio.to_thread(self._get, runtime_id)
+        image = await asyncio.to_thread(
+            container.commit, repository="manus-fork", tag=uuid.uuid4().hex[:12]
+        )
+        started = await asyncio.gather(
+            *(
+                asyncio.to_thread(self._start_container, image.id, "none")
+                for _ in range(count)
+            ),
+            return_exceptions=True,
+        )
+        forks = [fork for fork in started if not isinstance(fork, BaseException)]
+        errors = [fork for fork in started if isinstance(fork, BaseException)]
+        if errors:
+            for fork in forks:
+                await asyncio.to_thread(fork.remove, force=True)
+            await asyncio.to_thread(self._remove_image, image.id)
+            raise errors[0]
+
+        handles = []
+        for fork in forks:
+            self.handles.put(fork)
+            self._fork_images[fork.id] = image.id
+            handles.append(RuntimeHandle(id=fork.id, image=image.id, raw=fork))
+        return handles
+
+    def _remove_image(self, image_id: str) -> None:
+        try:
+            self.client.images.remove(image_id)
+        except DockerException as e:
+            log_error(f"删除副本镜像 {image_id} 失败: {e}")
+
+    async def describe(self, runtime_id: str) -> RuntimeHandle:
+        container = await asyncio.to_thread(self._get, runtime_id)
+        return RuntimeHandle(
+            id=container.id, image=container.attrs.get("Image", ""), raw=container
+        )
+
+    def _exec(
+        self,
+        runtime_id: str,
+        command: str,
+        workdir: str,
+        timeout: Optional[int],
+        pidfile: str,
+    ) -> Tuple[int, bytes]:
+        """直接通过底层 API 按容器ID执行命令，不再需要先 inspect 容器
+
+        退出码从输出末尾的标记中读取，每次执行只需要 exec_create 与 exec_start 两次请求；
+        没有标记时（例如包装脚本本身被结束）才回退到 exec_inspect。
+        """
+        marker = f"\n__manus_exit_{uuid.uuid4().hex}__"
+        cmd = [
+            "/bin/bash",
+            "-c",
+            _EXEC_WRAPPER,
+            command,
+            str(timeout or 0),
+            pidfile,
+            marker,
+        ]
+        api = self.client.api
+        try:
+            exec_id = api.exec_create(runtime_id, cmd, workdir=workdir, user="root")["Id"]
+        except NotFound as e:
+            raise RuntimeNotFoundError(runtime_id) from e
+        output = api.exec_start(exec_id)
+
+        start = output.rfind(marker.encode())
+        end = output.find(b"\n", start + len(marker)) if start >= 0 else -1
+        if end < 0:
+            return api.exec_inspect(exec_id)["ExitCode"], output
+        exit_code = int(output[start + len(marker) : end])
+        # 标记之后的内容来自仍在运行的后台进程，保留在输出中
+        return exit_code, output[:start] + output[end + 1 :]
+
+    async def exec(
+        self, runtime_id: str, command: str, workdir: str, timeout: Optional[int]
+    ) -> Tuple[int, bytes]:
+        pidfile = f"/tmp/.manus-exec-{uuid.uuid4().hex}.pid"
+        try:
+            return await asyncio.to_thread(
+                self._exec, runtime_id, command, workdir, timeout, pidfile
+            )
+        except asyncio.CancelledError:
+            # 线程中的 exec 无法被取消，需要在容器内结束对应的进程组
+            await asyncio.shield(asyncio.to_thread(self._kill_exec, runtime_id, pidfile))
+            raise
+
+    def _kill_exec(self, runtime_id: str, pidfile: str) -> None:
+        try:
+            api = self.client.api
+            exec_id = api.exec_create(
+                runtime_id, ["/bin/bash", "-c", _KILL_SCRIPT, pidfile], user="root"
+            )["Id"]
+            api.exec_start(exec_id)
+        except DockerException as e:
+            log_error(f"结束容器 {runtime_id} 中被取消的命令失败: {e}")
+
+    async def after_exec(self, runtime_id: str, command: str, exit_code: int) -> None:
+        if self.snapshots_enabled:
+            await snapshot_manager.record(runtime_id, command, exit_code)
+
+    async def write_file(self, runtime_id: str, path: str, data: bytes) -> None:
+        path = posixpath.join("/app", path)
+        directory, filename = posixpath.split(path)
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        def _write():
+            container = self._get(runtime_id)
+            container.exec_run(cmd=["mkdir", "-p", directory], user="root")
+            container.put_archive(directory, buffer.getvalue())
+
+        await asyncio.to_thread(_write)
+
+    async def read_file(self, runtime_id: str, path: str) -> bytes:
+        path = posixpath.join("/app", path)
+
+        def _read() -> bytes:
+            stream, _ = self._get(runtime_id).get_archive(path)
+            with tarfile.open(fileobj=io.BytesIO(b"".join(stream))) as tar:
+                member = tar.next()
+                fileobj = tar.extractfile(member) if member else None
+                if fileobj is None:
+                    raise IsADirectoryError(path)
+                return fileobj.read()
+
+        return await asyncio.to_thread(_read)
+
+    def stream_tar(self, runtime_id: str, script: str) -> Iterator[bytes]:
+        _, stream = self._get(runtime_id).exec_run(
+            cmd=["/bin/bash", "-c", script],
+            workdir="/app",
+            user="root",
+            stdout=True,
+            stderr=False,
+            stream=True,
+        )
+        return stream
+
+    async def delete(self, runtime_id: str) -> None:
+        def _delete():
+            container = self._get(runtime_id)
+            container.stop()
+            container.remove()
+            return container.id
+
+        container_id = await asyncio.to_thread(_delete)
+        self.handles.invalidate(container_id)
+        snapshot_manager.forget(container_id)
+        image_id = self._fork_images.pop(container_id, None)
+        if image_id is not None and image_id not in self._fork_images.values():
+            await asyncio.to_thread(self._remove_image, image_id)
+
+    async def stop(self, runtime_id: str) -> None:
+        container = await asyncio.to_thread(self._get, runtime_id)
+        await asyncio.to_thread(container.stop, timeout=10)
+
+    async def memory_usage(self, runtime_id: str) -> int:
+        try:
+            container = await asyncio.to_thread(self._get, runtime_id)
+            stats = await asyncio.to_thread(container.stats, stream=False)
+            return int(stats.get("memory_stats", {}).get("usage", 0))
+        except DockerException:
+            return 0
+
+    async def snapshot(self, runtime_id: str) -> None:
+        """把容器提交为镜像，便于事后排查或恢复"""
+        container = await asyncio.to_thread(self._get, runtime_id)
+        await asyncio.to_thread(
+            container.commit, repository="manus-reaped", tag=container.short_id
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.primary:
+            return {"backend": self.name, "base_url": self.base_url}
+        return {
+            "backend": self.name,
+            "snapshots": snapshot_manager.stats(),
+            "cache_volumes": cache_volume_manager.stats(),
+        }
@@ -0,0 +1,133 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from docker import DockerClient
+from docker.models.containers import Container
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+
+_client: Optional[DockerClient] = None
+_client_lock = threading.Lock()
+
+
+def get_docker_client() -> DockerClient:
+    """获取共享的 Docker 客户端（首次调用时创建），底层连接池保持长连接"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                kwargs = dict(max_pool_size=settings.runtime.DOCKER_POOL_SIZE)
+                if settings.runtime.DOCKER_BASE_URL:
+                    _client = DockerClient(
+                        base_url=settings.runtime.DOCKER_BASE_URL, **kwargs
+                    )
+                else:
+                    _client = DockerClient.from_env(**kwargs)
+    return _client
+
+
+def close_docker_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+class ContainerHandleCache:
+    """容器句柄缓存
+
+    避免每次执行命令前都调用一次 inspect。缓存项在 TTL 到期后失效，
+    同时后台线程监听 Docker 事件，容器状态变化时立即失效。
+    """
+
+    # 这些事件会改变容器的状态或配置
+    INVALIDATING_EVENTS = {
+        "start",
+        "restart",
+        "stop",
+        "die",
+        "kill",
+        "oom",
+        "pause",
+        "unpause",
+        "rename",
+        "update",
+        "destroy",
+    }
+
+    def __init__(
+        self, client_getter: Callable[[], DockerClient] = None, ttl: float = 30.0
+    ):
+        self.client_getter = client_getter or get_docker_client
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[Container, float]] = {}
+        self._lock = threading.Lock()
+        self._events = None
+        self._watcher: Optional[threading.Thread] = None
+
+    def get(self, container_id: str) -> Container:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(container_id)
+            if entry and entry[1] > now:
+                return entry[0]
+
+        container = self.client_getter().containers.get(container_id)
+        self.put(container)
+        return container
+
+    def put(self, container: Container) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[container.id] = (container, expires)
+            # 同时支持短ID访问
+            self._entries[container.short_id] = (container, expires)
+
+    def invalidate(self, container_id: str) -> None:
+        with self._lock:
+            for key in [
+                key
+                for key, (container, _) in self._entries.items()
+                if key == container_id or container.id == container_id
+            ]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _watch(self) -> None:
+        try:
+            for event in self._events:
+                if event.get("Action") in self.INVALIDATING_EVENTS:
+                    self.invalidate(event.get("id") or event["Actor"]["ID"])
+        except Exception as e:
+            # 关闭事件流时也会走到这里
+            if self._events is not None:
+                log_error(f"Docker 事件监听中断: {e}")
+                self.clear()
+
+    def start_watcher(self) -> None:
+        if self._watcher is not None:
+            return
+        self._events = self.client_getter().events(
+            decode=True, filters={"type": "container"}
+        )
+        self._watcher = threading.Thread(
+            target=self._watch, name="docker-events", daemon=True
+        )
+        self._watcher.start()
+        log_info("Docker 事件监听已启动")
+
+    def stop_watcher(self) -> None:
+        events, self._events = self._events, None
+        if events is not None:
+            events.close()
+        self._watcher = None
+        self.clear()
+
+
+container_handles = ContainerHandleCache(ttl=settings.runtime.CONTAINER_CACHE_TTL)
@@ -0,0 +1,218 @@
+import asyncio
+import re
+import shlex
+from typing import Any, Dict, List, Optional
+
+from app.core.setting import settings
+from app.runtime.backend import get_backend
+from app.runtime.cache import command_cache
+from app.runtime.archive import (
+    is_binary,
+    read_tar_members,
+    stream_container_tar,
+    stream_local_tar,
+)
+
+# glob 模式只允许普通路径字符和通配符，避免注入
+_GLOB_PATTERN = re.compile(r"^[\w./*?\[\]!\- ]+$")
+
+_STAT_FORMAT = "%s\t%F\t%a\t%Y\t%n"
+
+
+def _read_script(key: str, path: str, op: Dict[str, Any], cap: int) -> str:
+    """生成单个文件的读取脚本，多读 1 字节用于判断是否截断"""
+    quoted = shlex.quote(path)
+    start_line, end_line = op.get("start_line"), op.get("end_line")
+    offset, length = op.get("offset"), op.get("length")
+
+    if start_line or end_line:
+        start = max(int(start_line or 1), 1)
+        end = f"{int(end_line)}" if end_line and int(end_line) > 0 else "$"
+        reader = f"sed -n '{start},{end}p' {quoted}"
+    elif offset or length:
+        reader = f"tail -c +{int(offset or 0) + 1} {quoted}"
+        if length:
+            reader += f" | head -c {min(int(length), cap + 1)}"
+    else:
+        reader = f"cat {quoted}"
+
+    return (
+        f'stat -c %s {quoted} > "$tmp/{key}.size" 2> "$tmp/{key}.err" && '
+        f'{reader} 2>> "$tmp/{key}.err" | head -c {cap + 1} > "$tmp/{key}.data"'
+    )
+
+
+def build_script(operations: List[Dict[str, Any]], cap: int, glob_limit: int) -> str:
+    """把一批文件操作编译成一段脚本，结果写入临时目录后统一打包为 tar 流输出"""
+    lines = ['tmp=$(mktemp -d)', "shopt -s globstar nullglob"]
+    for i, op in enumerate(operations):
+        name = op.get("op")
+        if name == "read":
+            for j, path in enumerate(op.get("paths") or [op.get("path", "")]):
+                lines.append(_read_script(f"{i}-{j}", path, op, cap))
+        elif name == "stat":
+            paths = " ".join(
+                shlex.quote(path) for path in op.get("paths") or [op.get("path", "")]
+            )
+            lines.append(
+                f"stat -c '{_STAT_FORMAT}' {paths} > \"$tmp/{i}.stat\" 2> \"$tmp/{i}.err\""
+            )
+        elif name == "glob":
+            pattern = op.get("pattern", "")
+            if not _GLOB_PATTERN.match(pattern):
+                lines.append(f'echo "非法的 glob 模式" > "$tmp/{i}.err"')
+                continue
+            # 通过未加引号的变量展开完成路径匹配，变量内容不会被当作命令执行
+            lines.append(
+                f"(IFS=$'\\n'; p={shlex.quote(pattern)}; "
+                f"for f in $p; do printf '%s\\n' \"$f\"; done) "
+                f'| head -n {glob_limit + 1} > "$tmp/{i}.glob"'
+            )
+        elif name == "copy":
+            source = shlex.quote(op.get("source", ""))
+            destination = shlex.quote(op.get("destination", ""))
+            lines.append(
+                f'mkdir -p "$(dirname {destination})" && '
+                f'cp -a {source} {destination} 2> "$tmp/{i}.err"; '
+                f'echo $? > "$tmp/{i}.copy"'
+            )
+        else:
+            lines.append(f'echo "不支持的操作: {shlex.quote(str(name))}" > "$tmp/{i}.err"')
+    lines.append('tar -C "$tmp" -cf - .')
+    lines.append('rm -rf "$tmp"')
+    return "\n".join(lines)
+
+
+def _text(members: Dict[str, bytes], name: str) -> str:
+    return members.get(name, b"").decode("utf-8", errors="replace").strip()
+
+
+def _collect_read(
+    members: Dict[str, bytes], key: str, path: str, cap: int
+) -> Dict[str, Any]:
+    error = _text(members, f"{key}.err")
+    if f"{key}.size" not in members or error:
+        return {"path": path, "error": error or "读取失败"}
+
+    data = members.get(f"{key}.data", b"")
+    size = int(_text(members, f"{key}.size") or 0)
+    if is_binary(data):
+        return {"path": path, "size": size, "binary": True}
+    return {
+        "path": path,
+        "size": size,
+        "truncated": len(data) > cap,
+        "content": data[:cap].decode("utf-8", errors="replace"),
+    }
+
+
+def parse_results(
+    operations: List[Dict[str, Any]],
+    members: Dict[str, bytes],
+    cap: int,
+    glob_limit: int,
+) -> List[Dict[str, Any]]:
+    results = []
+    for i, op in enumerate(operations):
+        name = op.get("op")
+        result: Dict[str, Any] = {"op": name}
+        if name == "read":
+            paths = op.get("paths") or [op.get("path", "")]
+            result["files"] = [
+                _collect_read(members, f"{i}-{j}", path, cap)
+                for j, path in enumerate(paths)
+            ]
+        elif name == "stat":
+            entries = []
+            for line in _text(members, f"{i}.stat").splitlines():
+                size, file_type, mode, mtime, path = line.split("\t", 4)
+                entries.append(
+                    {
+                        "path": path,
+                        "size": int(size),
+                        "type": file_type,
+                        "mode": mode,
+                        "mtime": int(mtime),
+                    }
+                )
+            result["entries"] = entries
+        elif name == "glob":
+            matches = _text(members, f"{i}.glob").splitlines()
+            result["matches"] = matches[:glob_limit]
+            result["truncated"] = len(matches) > glob_limit
+        elif name == "copy":
+            result["success"] = _text(members, f"{i}.copy") == "0"
+
+        error = _text(members, f"{i}.err")
+        if error:
+            result["error"] = error
+        results.append(result)
+    return results
+
+
+async def run_file_operations(
+    operations: List[Dict[str, Any]],
+    container_id: str = "",
+    local_root: str = "",
+    max_bytes: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """在一次 tar 流往返中完成一批文件操作
+
+    参数:
+        operations: 操作列表，每项包含 op（read/stat/glob/copy）及其参数
+        container_id: 容器ID，为空时在本地目录 local_root 中执行
+        local_root: 本地工作区目录
+        max_bytes: 单文件读取上限，默认取配置
+
+    返回:
+        与 operations 一一对应的结果列表
+    """
+    cap = max_bytes or settings.file_ops.MAX_READ_BYTES
+    glob_limit = settings.file_ops.MAX_GLOB_RESULTS
+    script = build_script(operations, cap, glob_limit)
+
+    if container_id:
+        # 缓存按完整ID记录，短ID先解析
+        container_id = (await get_backend().describe(container_id)).id
+    chunks = (
+        stream_container_tar(container_id, script)
+        if container_id
+        else stream_local_tar(local_root or ".", script)
+    )
+    writes = container_id and any(op.get("op") == "copy" for op in operations)
+    if writes:
+        command_cache.bump(container_id)
+    members = await asyncio.to_thread(read_tar_members, chunks)
+    if writes:
+        command_cache.bump(container_id)
+    return parse_results(operations, members, cap, glob_limit)
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    """把结果整理成适合放进提示词的文本"""
+    parts = []
+    for result in results:
+        name = result["op"]
+        if "error" in result and name != "read":
+            parts.append(f"[{name}] 错误: {result['error']}")
+            continue
+        if name == "read":
+            for item in result["files"]:
+                if "error" in item:
+                    parts.append(f"[read] {item['path']}: 错误: {item['error']}")
+                elif item.get("binary"):
+                    parts.append(f"[read] {item['path']}: 二进制文件 ({item['size']} 字节)")
+                else:
+                    suffix = " (已截断)" if item["truncated"] else ""
+                    parts.append(f"[read] {item['path']}{suffix}\n{item['content']}")
+        elif name == "stat":
+            parts.extend(
+                f"[stat] {e['path']} {e['type']} {e['size']} 字节 权限 {e['mode']}"
+                for e in result["entries"]
+            )
+        elif name == "glob":
+            suffix = "\n(结果已截断)" if result["truncated"] else ""
+            parts.append("[glob]\n" + "\n".join(result["matches"]) + suffix)
+        elif name == "copy":
+            parts.append(f"[copy] {'成功' if result['success'] else '失败'}")
+    return "\n\n".join(parts)
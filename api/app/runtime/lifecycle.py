@@ -0,0 +1,234 @@
+import asyncio
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.core.sqlite_store import SQLiteStore
+from app.runtime.backend import RuntimeNotFoundError, get_backend
+
+SnapshotHook = Callable[[Any], Any]
+
+
+class ContainerRegistry(SQLiteStore):
+    """容器登记表，保存在 SQLite 中，进程重启后仍然可以回收之前创建的容器
+
+    最后活跃时间先记录在内存中，由回收循环定期批量写回，避免每次执行命令都写盘。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS containers (
+            id TEXT PRIMARY KEY,
+            image TEXT,
+            created_at REAL NOT NULL,
+            last_active REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._dirty: Dict[str, float] = {}
+
+    def register(self, container_id: str, image: str = "") -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO containers VALUES (?, ?, ?, ?)",
+                (container_id, image, now, now),
+            )
+
+    def touch(self, container_id: str) -> None:
+        self._dirty[container_id] = time.time()
+
+    def flush(self) -> None:
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE containers SET last_active = ? WHERE id = ?",
+                [(last_active, container_id) for container_id, last_active in dirty.items()],
+            )
+
+    def remove(self, container_id: str) -> None:
+        self._dirty.pop(container_id, None)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM containers WHERE id = ?", (container_id,))
+
+    def list_all(self) -> List[Dict[str, Any]]:
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, image, created_at, last_active FROM containers"
+            ).fetchall()
+        return [
+            {"id": row[0], "image": row[1], "created_at": row[2], "last_active": row[3]}
+            for row in rows
+        ]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM containers").fetchone()[0]
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+
+class LifecycleManager:
+    """容器生命周期管理：按空闲时间和最大存活时间回收容器"""
+
+    def __init__(
+        self,
+        registry: ContainerRegistry,
+        idle_ttl: float,
+        max_age: float,
+        interval: float,
+    ):
+        self.registry = registry
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self.interval = interval
+        self.snapshot_hooks: List[SnapshotHook] = []
+        self.metrics: Dict[str, int] = {
+            "reaped_idle": 0,
+            "reaped_max_age": 0,
+            "reaped_missing": 0,
+            "reap_errors": 0,
+            "reclaimed_memory_bytes": 0,
+        }
+        self._task: Optional[asyncio.Task] = None
+        # 容器ID -> 正在进行的操作数，tar 流可能在线程中读取，计数需要加锁
+        self._active: Dict[str, int] = {}
+        self._active_lock = threading.Lock()
+
+    def register_snapshot_hook(self, hook: SnapshotHook) -> None:
+        """注册回收前的快照钩子，钩子在容器停止之后、删除之前调用，参数为容器ID"""
+        self.snapshot_hooks.append(hook)
+
+    def track(self, container_id: str, image: str = "") -> None:
+        self.registry.register(container_id, image)
+
+    def touch(self, container_id: str) -> None:
+        self.registry.touch(container_id)
+
+    def untrack(self, container_id: str) -> None:
+        self.registry.remove(container_id)
+
+    @contextmanager
+    def in_use(self, container_id: str) -> Iterator[None]:
+        """执行命令、读写文件或读取 tar 流期间容器不会被回收，开始与结束时都刷新活跃时间"""
+        with self._active_lock:
+            self._active[container_id] = self._active.get(container_id, 0) + 1
+        self.touch(container_id)
+        try:
+            yield
+        finally:
+            self.touch(container_id)
+            with self._active_lock:
+                remaining = self._active[container_id] - 1
+                if remaining:
+                    self._active[container_id] = remaining
+                else:
+                    del self._active[container_id]
+
+    def is_active(self, container_id: str) -> bool:
+        return container_id in self._active
+
+    def _expired_reason(self, entry: Dict[str, Any], now: float) -> Optional[str]:
+        if self.max_age and now - entry["created_at"] > self.max_age:
+            return "max_age"
+        if self.idle_ttl and now - entry["last_active"] > self.idle_ttl:
+            return "idle"
+        return None
+
+    async def _reap(self, container_id: str, reason: str) -> None:
+        backend = get_backend()
+        try:
+            memory = await backend.memory_usage(container_id)
+            await backend.stop(container_id)
+        except RuntimeNotFoundError:
+            self.untrack(container_id)
+            self.metrics["reaped_missing"] += 1
+            return
+
+        for hook in self.snapshot_hooks:
+            try:
+                result = hook(container_id)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                log_error(f"容器 {container_id} 快照钩子执行失败: {e}")
+
+        await backend.delete(container_id)
+        self.untrack(container_id)
+        # 搜索索引依赖本模块，在这里延迟导入
+        from app.runtime.search import forget_search_index
+
+        await forget_search_index(container_id)
+
+        self.metrics[f"reaped_{reason}"] += 1
+        self.metrics["reclaimed_memory_bytes"] += memory
+        log_info(f"已回收容器 {container_id} (原因: {reason}, 内存: {memory} 字节)")
+
+    async def reap_once(self) -> int:
+        """执行一轮回收，返回本轮回收的容器数"""
+        now = time.time()
+        reaped = 0
+        for entry in await asyncio.to_thread(self.registry.list_all):
+            reason = self._expired_reason(entry, now)
+            if reason is None or self.is_active(entry["id"]):
+                continue
+            try:
+                await self._reap(entry["id"], reason)
+                reaped += 1
+            except Exception as e:
+                self.metrics["reap_errors"] += 1
+                log_error(f"回收容器 {entry['id']} 失败: {e}")
+        return reaped
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap_once()
+            except Exception as e:
+                log_error(f"容器回收循环出错: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            log_info("容器回收任务已启动")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.registry.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": self.registry.count(),
+            "active": len(self._active),
+            **self.metrics,
+        }
+
+
+lifecycle_manager = LifecycleManager(
+    registry=ContainerRegistry(settings.runtime.STATE_DB),
+    idle_ttl=settings.runtime.CONTAINER_IDLE_TTL,
+    max_age=settings.runtime.CONTAINER_MAX_AGE,
+    interval=settings.runtime.REAP_INTERVAL,
+)
+
+if settings.runtime.SNAPSHOT_ON_REAP:
+    lifecycle_manager.register_snapshot_hook(
+        lambda container_id: get_backend().snapshot(container_id)
+    )
@@ -0,0 +1,265 @@
+import asyncio
+import os
+import re
+import shutil
+import signal
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.runtime.archive import stream_local_tar
+from app.runtime.backend import (
+    RuntimeBackend,
+    RuntimeHandle,
+    RuntimeNotFoundError,
+    parse_memory,
+)
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+# 命令与脚本中的 /app 绝对路径，不匹配 /apple、/var/app 这类路径
+_APP_PATH = re.compile(r"(?<![\w./-])/app(?![\w.-])")
+# 会话目录会以文本形式替换进命令，只允许不需要引号的字符
+_SAFE_PATH = re.compile(r"^[\w./-]+$")
+
+# 以 unshare 创建独立的用户、PID、挂载、IPC 与主机名命名空间
+_NAMESPACE_PREFIX = [
+    "unshare",
+    "--user",
+    "--map-root-user",
+    "--pid",
+    "--fork",
+    "--mount-proc",
+    "--ipc",
+    "--uts",
+]
+
+
+class LocalBackend(RuntimeBackend):
+    """本地子进程运行时
+
+    每个会话对应 LOCAL_ROOT 下的一个工作目录，命令以子进程方式执行。用于可信任务与 CI，
+    避免容器 exec 的开销。可选地使用 Linux 命名空间隔离进程，并把会话放入 cgroup v2
+    子组以限制内存和 CPU（需要对 LOCAL_CGROUP_ROOT 有写权限）。
+
+    容器内的工作目录 /app 会映射到会话目录：工作目录、文件读写，以及命令与 tar 脚本中
+    出现的 /app 绝对路径都替换为会话目录，命令输出中的会话目录再换回 /app。
+    其余绝对路径按宿主机路径处理。
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self.root = Path(settings.runtime.LOCAL_ROOT).resolve()
+        self.isolation = settings.runtime.LOCAL_ISOLATION
+        self.cgroup_root = settings.runtime.LOCAL_CGROUP_ROOT
+        self._processes: Dict[str, Set[int]] = {}
+        # 没有网络的副本会话
+        self._offline: Set[str] = set()
+
+    async def start(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not _SAFE_PATH.match(str(self.root)):
+            raise RuntimeError(f"LOCAL_ROOT 只能包含字母、数字与 ._-/ 字符: {self.root}")
+        if self.isolation == "namespaces" and not shutil.which("unshare"):
+            log_error("未找到 unshare，本地运行时将不使用命名空间隔离")
+            self.isolation = "none"
+        log_info(f"本地运行时已启动: {self.root} (隔离: {self.isolation})")
+
+    def _session_dir(self, runtime_id: str) -> Path:
+        if not _SESSION_ID.match(runtime_id):
+            raise RuntimeNotFoundError(runtime_id)
+        path = self.root / runtime_id
+        if not path.is_dir():
+            raise RuntimeNotFoundError(runtime_id)
+        return path
+
+    def _map_path(self, runtime_id: str, path: str) -> Path:
+        session_dir = self._session_dir(runtime_id)
+        if path == "/app" or path.startswith("/app/"):
+            return session_dir / path[len("/app") :].lstrip("/")
+        return Path(path) if os.path.isabs(path) else session_dir / path
+
+    def _map_script(self, runtime_id: str, script: str) -> str:
+        """把命令中的 /app 绝对路径替换为会话目录"""
+        session_dir = str(self._session_dir(runtime_id))
+        return _APP_PATH.sub(lambda _: session_dir, script)
+
+    def _cgroup_dir(self, runtime_id: str) -> Optional[Path]:
+        return Path(self.cgroup_root) / f"manus-{runtime_id}" if self.cgroup_root else None
+
+    def _setup_cgroup(self, runtime_id: str) -> None:
+        cgroup = self._cgroup_dir(runtime_id)
+        if cgroup is None:
+            return
+        try:
+            cgroup.mkdir(exist_ok=True)
+            memory = parse_memory(settings.runtime.LOCAL_MEMORY_LIMIT)
+            (cgroup / "memory.max").write_text(str(memory))
+            period = 100000
+            quota = int(settings.runtime.LOCAL_CPU_LIMIT * period)
+            (cgroup / "cpu.max").write_text(f"{quota} {period}")
+        except OSError as e:
+            log_error(f"创建 cgroup 失败，本会话不做资源限制: {e}")
+
+    def _preexec(self, runtime_id: str) -> Optional[Callable[[], None]]:
+        cgroup = self._cgroup_dir(runtime_id)
+        if cgroup is None or not cgroup.is_dir():
+            return None
+        procs = str(cgroup / "cgroup.procs")
+
+        def join_cgroup():
+            with open(procs, "w") as f:
+                f.write(str(os.getpid()))
+
+        return join_cgroup
+
+    def _env(self, session_dir: Path) -> Dict[str, str]:
+        return {
+            "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"),
+            "HOME": str(session_dir),
+            "LANG": os.environ.get("LANG", "C.UTF-8"),
+            "TERM": "dumb",
+        }
+
+    async def create(self, setup_commands: List[str]) -> RuntimeHandle:
+        runtime_id = uuid.uuid4().hex
+        session_dir = self.root / runtime_id
+        await asyncio.to_thread(session_dir.mkdir, parents=True)
+        await asyncio.to_thread(self._setup_cgroup, runtime_id)
+        return RuntimeHandle(
+            id=runtime_id, image=self.name, pending_setup=list(setup_commands)
+        )
+
+    async def fork(self, runtime_id: str, count: int) -> List[RuntimeHandle]:
+        """复制会话目录，文件系统支持时使用 reflink（写时复制）
+
+        只复制会话目录本身，命令写到会话目录之外的内容不会被隔离。副本在独立的网络命名空间中
+        执行命令，因此需要命名空间隔离。
+        """
+        if self.isolation != "namespaces":
+            raise NotImplementedError("本地运行时需要命名空间隔离才能创建没有网络的副本")
+        source = self._session_dir(runtime_id)
+        handles = []
+        for _ in range(count):
+            fork_id = uuid.uuid4().hex
+            target = self.root / fork_id
+            process = await asyncio.create_subprocess_exec(
+                "cp",
+                "-a",
+                "--reflink=auto",
+                str(source),
+                str(target),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            if await process.wait() != 0:
+                # 不支持 --reflink 的 cp（例如 BSD）退回到普通复制
+                await asyncio.to_thread(shutil.rmtree, target, True)
+                await asyncio.to_thread(shutil.copytree, source, target, symlinks=True)
+            await asyncio.to_thread(self._setup_cgroup, fork_id)
+            self._offline.add(fork_id)
+            handles.append(RuntimeHandle(id=fork_id, image=self.name))
+        return handles
+
+    async def describe(self, runtime_id: str) -> RuntimeHandle:
+        self._session_dir(runtime_id)
+        return RuntimeHandle(id=runtime_id, image=self.name)
+
+    async def exec(
+        self, runtime_id: str, command: str, workdir: str, timeout: Optional[int]
+    ) -> Tuple[int, bytes]:
+        session_dir = self._session_dir(runtime_id)
+        cwd = self._map_path(runtime_id, workdir)
+        cwd.mkdir(parents=True, exist_ok=True)
+
+        argv = ["/bin/bash", "-c", self._map_script(runtime_id, command)]
+        if self.isolation == "namespaces":
+            prefix = list(_NAMESPACE_PREFIX)
+            if not settings.runtime.LOCAL_NETWORK or runtime_id in self._offline:
+                prefix.append("--net")
+            argv = prefix + argv
+
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            cwd=str(cwd),
+            env=self._env(session_dir),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+            preexec_fn=self._preexec(runtime_id),
+        )
+        pids = self._processes.setdefault(runtime_id, set())
+        pids.add(process.pid)
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), timeout)
+            return process.returncode, output.replace(str(session_dir).encode(), b"/app")
+        except asyncio.TimeoutError:
+            self._kill(process.pid)
+            await process.wait()
+            return 124, b""
+        except asyncio.CancelledError:
+            self._kill(process.pid)
+            raise
+        finally:
+            pids.discard(process.pid)
+
+    @staticmethod
+    def _kill(pid: int, sig: int = signal.SIGKILL) -> None:
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def write_file(self, runtime_id: str, path: str, data: bytes) -> None:
+        target = self._map_path(runtime_id, path)
+
+        def _write():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+
+        await asyncio.to_thread(_write)
+
+    async def read_file(self, runtime_id: str, path: str) -> bytes:
+        return await asyncio.to_thread(self._map_path(runtime_id, path).read_bytes)
+
+    def stream_tar(self, runtime_id: str, script: str) -> Iterator[bytes]:
+        return stream_local_tar(
+            str(self._session_dir(runtime_id)), self._map_script(runtime_id, script)
+        )
+
+    async def stop(self, runtime_id: str) -> None:
+        for pid in list(self._processes.get(runtime_id, ())):
+            self._kill(pid, signal.SIGTERM)
+
+    async def delete(self, runtime_id: str) -> None:
+        session_dir = self._session_dir(runtime_id)
+        for pid in self._processes.pop(runtime_id, set()):
+            self._kill(pid)
+        self._offline.discard(runtime_id)
+        await asyncio.to_thread(shutil.rmtree, session_dir, True)
+        cgroup = self._cgroup_dir(runtime_id)
+        if cgroup is not None and cgroup.is_dir():
+            try:
+                cgroup.rmdir()
+            except OSError as e:
+                log_error(f"删除 cgroup 失败: {e}")
+
+    async def capacity(self) -> Tuple[int, float]:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        return memory, float(os.cpu_count() or 1)
+
+    async def memory_usage(self, runtime_id: str) -> int:
+        cgroup = self._cgroup_dir(runtime_id)
+        try:
+            return int((cgroup / "memory.current").read_text()) if cgroup else 0
+        except (OSError, ValueError):
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "isolation": self.isolation,
+            "running_processes": sum(len(pids) for pids in self._processes.values()),
+        }
@@ -0,0 +1,336 @@
+import asyncio
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.common import ServiceBusyException
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.core.sqlite_store import SQLiteStore
+from app.runtime.backend import (
+    RuntimeBackend,
+    RuntimeHandle,
+    RuntimeNotFoundError,
+    parse_memory,
+)
+
+
+class NoCapacityError(ServiceBusyException):
+    """所有主机都没有足够的剩余资源
+
+    作为 ServiceBusyException 由全局异常处理返回 SERVICE_BUSY 并设置 Retry-After，
+    建议的重试间隔为一个回收周期，空闲容器回收后才会腾出资源。
+    """
+
+    def __init__(self, msg: str):
+        super().__init__("container", settings.runtime.REAP_INTERVAL, msg)
+
+    def __str__(self) -> str:
+        return self.msg
+
+
+@dataclass
+class HostState:
+    """单个主机的容量与已分配资源"""
+
+    name: str
+    backend: RuntimeBackend
+    memory: int = 0
+    cpus: float = 0.0
+    max_execs: int = 64
+    allocated_memory: int = 0
+    allocated_cpus: float = 0.0
+    containers: int = 0
+    active_execs: int = 0
+    healthy: bool = False
+
+    def fits(self, memory: int, cpus: float, headroom: float) -> bool:
+        usable = 1 - headroom
+        return (
+            self.allocated_memory + memory <= self.memory * usable
+            and self.allocated_cpus + cpus <= self.cpus * usable
+        )
+
+    def utilization(self, memory: int = 0, cpus: float = 0.0) -> float:
+        """分配后内存与 CPU 中较高的占用比例"""
+        return max(
+            (self.allocated_memory + memory) / self.memory if self.memory else 1.0,
+            (self.allocated_cpus + cpus) / self.cpus if self.cpus else 1.0,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "memory": self.memory,
+            "cpus": self.cpus,
+            "allocated_memory": self.allocated_memory,
+            "allocated_cpus": self.allocated_cpus,
+            "containers": self.containers,
+            "active_execs": self.active_execs,
+            "utilization": round(self.utilization(), 4),
+        }
+
+
+class PlacementRegistry(SQLiteStore):
+    """容器所在主机的登记表，进程重启后仍能把命令路由到原主机"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS placements (
+            id TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            memory INTEGER NOT NULL,
+            cpus REAL NOT NULL
+        )
+    """
+
+    def add(self, runtime_id: str, host: str, memory: int, cpus: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO placements VALUES (?, ?, ?, ?)",
+                (runtime_id, host, memory, cpus),
+            )
+
+    def remove(self, runtime_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM placements WHERE id = ?", (runtime_id,))
+
+    def list_all(self) -> List[Tuple[str, str, int, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, host, memory, cpus FROM placements"
+            ).fetchall()
+
+
+class ScheduledBackend(RuntimeBackend):
+    """多主机调度后端
+
+    每个主机是一个独立的后端实例。新容器按最佳适配（分配后占用最高但仍留有余量的主机）
+    放置，以便把负载集中在少数主机上、为大任务保留整机空间；正在执行的命令数达到上限的
+    主机只有在没有其他选择时才会被使用。之后的所有调用按容器所在主机路由。
+    """
+
+    name = "scheduled"
+
+    def __init__(
+        self,
+        hosts: List[HostState],
+        registry: PlacementRegistry,
+        container_memory: int,
+        container_cpus: float,
+        headroom: float = 0.1,
+    ):
+        self.hosts: Dict[str, HostState] = {host.name: host for host in hosts}
+        self.registry = registry
+        self.container_memory = container_memory
+        self.container_cpus = container_cpus
+        self.headroom = headroom
+        # 容器ID -> (主机名, 内存, CPU)
+        self._placements: Dict[str, Tuple[str, int, float]] = {}
+        self.metrics: Dict[str, int] = {"placed": 0, "rejected": 0}
+
+    @classmethod
+    def from_settings(cls) -> "ScheduledBackend":
+        from app.runtime.docker_backend import DockerBackend
+
+        runtime = settings.runtime
+        hosts = [
+            HostState(
+                name=url,
+                backend=DockerBackend(None if url == "default" else url),
+                memory=runtime.HOST_MEMORY_MB * 1024 * 1024,
+                cpus=runtime.HOST_CPUS,
+                max_execs=runtime.HOST_MAX_EXECS,
+            )
+            for url in runtime.DOCKER_HOSTS
+        ]
+        return cls(
+            hosts,
+            PlacementRegistry(runtime.STATE_DB),
+            container_memory=parse_memory(runtime.CONTAINER_MEMORY),
+            container_cpus=runtime.CONTAINER_CPUS,
+            headroom=runtime.SCHEDULER_HEADROOM,
+        )
+
+    async def _start_host(self, host: HostState) -> None:
+        try:
+            await host.backend.start()
+            memory, cpus = await host.backend.capacity()
+            host.memory = host.memory or memory
+            host.cpus = host.cpus or cpus
+            host.healthy = True
+        except Exception as e:
+            host.healthy = False
+            log_error(f"主机 {host.name} 启动失败，不参与调度: {e}")
+
+    async def start(self) -> None:
+        await asyncio.gather(*(self._start_host(host) for host in self.hosts.values()))
+        if not any(host.healthy for host in self.hosts.values()):
+            raise RuntimeError("没有可用的运行时主机")
+
+        for runtime_id, name, memory, cpus in await asyncio.to_thread(
+            self.registry.list_all
+        ):
+            if name in self.hosts:
+                self._assign(runtime_id, self.hosts[name], memory, cpus)
+            else:
+                self.registry.remove(runtime_id)
+        log_info(
+            "多主机调度已启动: "
+            + ", ".join(
+                f"{host.name} ({host.containers} 个容器)" for host in self.hosts.values()
+            )
+        )
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(
+            *(host.backend.shutdown() for host in self.hosts.values() if host.healthy),
+            return_exceptions=True,
+        )
+        self.registry.close()
+
+    def _assign(self, runtime_id: str, host: HostState, memory: int, cpus: float) -> None:
+        self._placements[runtime_id] = (host.name, memory, cpus)
+        host.allocated_memory += memory
+        host.allocated_cpus += cpus
+        host.containers += 1
+
+    def _release(self, runtime_id: str) -> None:
+        placement = self._placements.pop(runtime_id, None)
+        if placement is None:
+            return
+        name, memory, cpus = placement
+        host = self.hosts[name]
+        host.allocated_memory = max(0, host.allocated_memory - memory)
+        host.allocated_cpus = max(0.0, host.allocated_cpus - cpus)
+        host.containers = max(0, host.containers - 1)
+
+    def place(self) -> HostState:
+        """选择放置新容器的主机"""
+        memory, cpus = self.container_memory, self.container_cpus
+        candidates = [
+            host
+            for host in self.hosts.values()
+            if host.healthy and host.fits(memory, cpus, self.headroom)
+        ]
+        if not candidates:
+            self.metrics["rejected"] += 1
+            raise NoCapacityError("所有运行时主机的资源都已分配完")
+
+        return max(
+            candidates,
+            key=lambda h: (h.active_execs < h.max_execs, h.utilization(memory, cpus)),
+        )
+
+    def _host_for(self, runtime_id: str) -> Tuple[HostState, str]:
+        """返回 (主机, 完整ID)，支持短ID"""
+        placement = self._placements.get(runtime_id)
+        if placement is not None:
+            return self.hosts[placement[0]], runtime_id
+        for full_id, (name, _, _) in self._placements.items():
+            if full_id.startswith(runtime_id):
+                return self.hosts[name], full_id
+        raise RuntimeNotFoundError(runtime_id)
+
+    async def create(self, setup_commands: List[str]) -> RuntimeHandle:
+        memory, cpus = self.container_memory, self.container_cpus
+        host = self.place()
+        # 在创建期间就预留资源，避免并发创建时超额分配
+        pending_id = f"pending-{uuid.uuid4().hex}"
+        self._assign(pending_id, host, memory, cpus)
+        try:
+            handle = await host.backend.create(setup_commands)
+        finally:
+            self._release(pending_id)
+
+        self._assign(handle.id, host, memory, cpus)
+        await asyncio.to_thread(self.registry.add, handle.id, host.name, memory, cpus)
+        self.metrics["placed"] += 1
+        return handle
+
+    async def fork(self, runtime_id: str, count: int) -> List[RuntimeHandle]:
+        """副本与原容器在同一主机上创建，同样按容器规格预留资源"""
+        host, full_id = self._host_for(runtime_id)
+        memory, cpus = self.container_memory, self.container_cpus
+        if not host.fits(memory * count, cpus * count, self.headroom):
+            self.metrics["rejected"] += 1
+            raise NoCapacityError(f"主机 {host.name} 没有足够的资源创建 {count} 个副本")
+        pending_ids = [f"pending-{uuid.uuid4().hex}" for _ in range(count)]
+        for pending_id in pending_ids:
+            self._assign(pending_id, host, memory, cpus)
+        try:
+            handles = await host.backend.fork(full_id, count)
+        finally:
+            for pending_id in pending_ids:
+                self._release(pending_id)
+
+        for handle in handles:
+            self._assign(handle.id, host, memory, cpus)
+            await asyncio.to_thread(self.registry.add, handle.id, host.name, memory, cpus)
+        return handles
+
+    async def describe(self, runtime_id: str) -> RuntimeHandle:
+        host, runtime_id = self._host_for(runtime_id)
+        return await host.backend.describe(runtime_id)
+
+    async def exec(
+        self, runtime_id: str, command: str, workdir: str, timeout: Optional[int]
+    ) -> Tuple[int, bytes]:
+        host, runtime_id = self._host_for(runtime_id)
+        host.active_execs += 1
+        try:
+            return await host.backend.exec(runtime_id, command, workdir, timeout)
+        finally:
+            host.active_execs -= 1
+
+    async def after_exec(self, runtime_id: str, command: str, exit_code: int) -> None:
+        host, runtime_id = self._host_for(runtime_id)
+        await host.backend.after_exec(runtime_id, command, exit_code)
+
+    async def write_file(self, runtime_id: str, path: str, data: bytes) -> None:
+        host, runtime_id = self._host_for(runtime_id)
+        await host.backend.write_file(runtime_id, path, data)
+
+    async def read_file(self, runtime_id: str, path: str) -> bytes:
+        host, runtime_id = self._host_for(runtime_id)
+        return await host.backend.read_file(runtime_id, path)
+
+    def stream_tar(self, runtime_id: str, script: str) -> Iterator[bytes]:
+        host, runtime_id = self._host_for(runtime_id)
+        return host.backend.stream_tar(runtime_id, script)
+
+    async def delete(self, runtime_id: str) -> None:
+        host, full_id = self._host_for(runtime_id)
+        try:
+            await host.backend.delete(full_id)
+        except RuntimeNotFoundError:
+            # 容器已不存在，同样释放它占用的配额
+            await self._forget(full_id)
+            raise
+        await self._forget(full_id)
+
+    async def _forget(self, runtime_id: str) -> None:
+        self._release(runtime_id)
+        await asyncio.to_thread(self.registry.remove, runtime_id)
+
+    async def stop(self, runtime_id: str) -> None:
+        host, runtime_id = self._host_for(runtime_id)
+        await host.backend.stop(runtime_id)
+
+    async def memory_usage(self, runtime_id: str) -> int:
+        host, runtime_id = self._host_for(runtime_id)
+        return await host.backend.memory_usage(runtime_id)
+
+    async def snapshot(self, runtime_id: str) -> None:
+        host, runtime_id = self._host_for(runtime_id)
+        await host.backend.snapshot(runtime_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "hosts": [host.to_dict() for host in self.hosts.values()],
+            "host_backends": {
+                name: host.backend.stats() for name, host in self.hosts.items()
+            },
+            **self.metrics,
+        }
@@ -0,0 +1,421 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import math
+import os
+import posixpath
+import re
+import shlex
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.runtime.archive import DEFAULT_EXCLUDES, is_binary, iter_container_files
+from app.runtime.backend import get_backend
+from app.runtime.cache import command_cache
+from app.runtime.lifecycle import lifecycle_manager
+
+# 标识符、数字以及单个汉字都作为词元
+_TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[一-鿿]")
+# 拆分驼峰命名
+_CAMEL_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """将文本拆分为小写词元，标识符额外拆分出 snake_case / camelCase 的组成部分"""
+    tokens: List[str] = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        word = match.group(0)
+        tokens.append(word.lower())
+        parts = [
+            part.lower()
+            for piece in word.split("_")
+            for part in _CAMEL_PATTERN.findall(piece)
+        ]
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if len(part) > 1)
+    return tokens
+
+
+@dataclass
+class SearchHit:
+    path: str
+    line: int
+    snippet: str
+    score: float
+
+    def format(self) -> str:
+        return f"{self.path}:{self.line}: {self.snippet}"
+
+
+class SearchIndex:
+    """基于 BM25 的倒排索引
+
+    文档以文件内固定行数的片段为单位，便于返回 file:line 形式的结果。
+    """
+
+    k1: float = 1.2
+    b: float = 0.75
+
+    def __init__(self, chunk_lines: int = 20):
+        self.chunk_lines = chunk_lines
+        self.next_id = 0
+        # doc_id -> (文件路径, 起始行号, 行内容)
+        self.chunks: Dict[int, Tuple[str, int, List[str]]] = {}
+        self.doc_len: Dict[int, int] = {}
+        self.total_len = 0
+        # 词元 -> {doc_id: 词频}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.file_chunks: Dict[str, List[int]] = {}
+        # 索引反映的工作区状态的时间，保存在磁盘上，进程重启后据此检查文件是否有变化
+        self.built_at = 0.0
+        # 索引反映的容器文件系统代数（见 CommandCache），只在内存中有效
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self.file_chunks)
+
+    def remove_file(self, path: str) -> None:
+        for doc_id in self.file_chunks.pop(path, []):
+            _, _, lines = self.chunks.pop(doc_id)
+            for term in set(tokenize("\n".join(lines))):
+                docs = self.postings.get(term)
+                if docs is None:
+                    continue
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+            self.total_len -= self.doc_len.pop(doc_id, 0)
+
+    def add_file(self, path: str, text: str) -> None:
+        """添加或替换一个文件的索引"""
+        self.remove_file(path)
+        lines = text.splitlines()
+        doc_ids = []
+        for start in range(0, len(lines), self.chunk_lines):
+            chunk = lines[start : start + self.chunk_lines]
+            counts = Counter(tokenize("\n".join(chunk)))
+            if not counts:
+                continue
+            doc_id = self.next_id
+            self.next_id += 1
+            self.chunks[doc_id] = (path, start + 1, chunk)
+            length = sum(counts.values())
+            self.doc_len[doc_id] = length
+            self.total_len += length
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            doc_ids.append(doc_id)
+        self.file_chunks[path] = doc_ids
+
+    def search(self, query: str, top_k: int = 10) -> List[SearchHit]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.doc_len:
+            return []
+
+        total_docs = len(self.doc_len)
+        avg_len = self.total_len / total_docs
+        scores: Dict[int, float] = {}
+        for term in terms:
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (
+                    tf + norm
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [self._make_hit(doc_id, score, terms) for doc_id, score in ranked[:top_k]]
+
+    def _make_hit(self, doc_id: int, score: float, terms: List[str]) -> SearchHit:
+        path, start, lines = self.chunks[doc_id]
+        term_set = set(terms)
+        # 片段内命中词元最多的一行作为展示行
+        best_offset = max(
+            range(len(lines)),
+            key=lambda i: len(term_set.intersection(tokenize(lines[i]))),
+        )
+        snippet = lines[best_offset].strip()[:200]
+        return SearchHit(path=path, line=start + best_offset, snippet=snippet, score=score)
+
+    def to_dict(self) -> Dict:
+        return {
+            "chunk_lines": self.chunk_lines,
+            "next_id": self.next_id,
+            "chunks": {
+                str(doc_id): [path, start, lines]
+                for doc_id, (path, start, lines) in self.chunks.items()
+            },
+            "doc_len": {str(doc_id): length for doc_id, length in self.doc_len.items()},
+            "postings": {
+                term: [[doc_id, tf] for doc_id, tf in docs.items()]
+                for term, docs in self.postings.items()
+            },
+            "file_chunks": self.file_chunks,
+            "built_at": self.built_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SearchIndex":
+        index = cls(chunk_lines=data["chunk_lines"])
+        index.next_id = data["next_id"]
+        index.chunks = {
+            int(doc_id): (path, start, lines)
+            for doc_id, (path, start, lines) in data["chunks"].items()
+        }
+        index.doc_len = {int(doc_id): length for doc_id, length in data["doc_len"].items()}
+        index.total_len = sum(index.doc_len.values())
+        index.postings = {
+            term: {doc_id: tf for doc_id, tf in docs}
+            for term, docs in data["postings"].items()
+        }
+        index.file_chunks = data["file_chunks"]
+        index.built_at = data.get("built_at", 0.0)
+        return index
+
+    def save(self, path: Path) -> None:
+        _write_index(path, self.to_dict())
+
+    @classmethod
+    def load(cls, path: Path) -> "SearchIndex":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def _write_index(path: Path, payload: Dict) -> None:
+    """写入同目录下的唯一临时文件后原子替换，并发写入互不覆盖"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            # 索引随编辑频繁落盘，压缩速度比压缩率更重要
+            with gzip.open(raw, "wt", encoding="utf-8", compresslevel=1) as f:
+                json.dump(payload, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# 每个工作区一个索引，常驻内存
+_indexes: Dict[str, SearchIndex] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+# 等待落盘的工作区 -> 延迟保存任务，连续编辑只写一次盘
+_pending_saves: Dict[str, asyncio.Task] = {}
+
+
+def workspace_key(container_id: str = "", local_root: str = "") -> str:
+    """工作区标识：容器优先，否则使用本地目录的绝对路径"""
+    return container_id or os.path.abspath(local_root or ".")
+
+
+def _index_path(key: str) -> Path:
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return Path(settings.search.INDEX_DIR) / f"{digest}.json.gz"
+
+
+def _iter_local_files(root: str, max_bytes: int) -> Iterator[Tuple[str, bytes]]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name not in DEFAULT_EXCLUDES]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.path.getsize(path) > max_bytes:
+                    continue
+                yield path, Path(path).read_bytes()
+            except OSError:
+                continue
+
+
+def _build_index(files: Iterable[Tuple[str, bytes]]) -> SearchIndex:
+    index = SearchIndex(chunk_lines=settings.search.CHUNK_LINES)
+    for path, data in files:
+        if is_binary(data):
+            continue
+        index.add_file(path, data.decode("utf-8", errors="replace"))
+    return index
+
+
+def _generation(container_id: str) -> int:
+    return command_cache.generation(container_id) if container_id else 0
+
+
+async def _changed_since(container_id: str, timestamp: float) -> bool:
+    """容器 /app 中是否有在 timestamp 之后修改过的文件或目录（删除文件会修改所在目录）"""
+    names = " -o ".join(f"-name {shlex.quote(name)}" for name in DEFAULT_EXCLUDES)
+    script = (
+        f"find /app \\( {names} \\) -prune -o -newermt @{int(timestamp)} -print -quit"
+    )
+    with lifecycle_manager.in_use(container_id):
+        exit_code, output = await get_backend().exec(container_id, script, "/app", 60)
+    return exit_code != 0 or bool(output.strip())
+
+
+def _is_stale(container_id: str, index: SearchIndex) -> bool:
+    """索引建立之后容器中执行过写命令、复制过文件或写入过其他文件时需要重建"""
+    return bool(container_id) and index.generation != _generation(container_id)
+
+
+async def get_search_index(container_id: str = "", local_root: str = "") -> SearchIndex:
+    """获取工作区索引：内存中没有则从磁盘加载，磁盘上也没有则全量构建
+
+    容器的索引在文件系统代数变化后（执行过可能写文件的命令，例如 git clone、npm init）
+    重新全量构建；编辑工具的写入由 update_search_index 增量更新，不会触发重建。
+    从磁盘加载的容器索引在 /app 中有更新的文件时同样重建。
+    """
+    if container_id:
+        # 短ID与完整ID指向同一容器，索引按完整ID保存
+        container_id = (await get_backend().describe(container_id)).id
+    key = workspace_key(container_id, local_root)
+    index = _indexes.get(key)
+    if index is not None and not _is_stale(container_id, index):
+        return index
+
+    async with _locks.setdefault(key, asyncio.Lock()):
+        index = _indexes.get(key)
+        if index is not None and not _is_stale(container_id, index):
+            return index
+
+        path = _index_path(key)
+        if index is None and path.exists():
+            generation = _generation(container_id)
+            index = await asyncio.to_thread(SearchIndex.load, path)
+            if container_id and await _changed_since(container_id, index.built_at):
+                index = None
+            else:
+                index.generation = generation
+                log_info(f"已加载搜索索引: {key} ({len(index)} 个文件)")
+
+        if index is None or _is_stale(container_id, index):
+            # 在扫描之前记录代数与时间，扫描期间发生的变化会在下次获取时再次触发重建
+            generation, built_at = _generation(container_id), time.time()
+            max_bytes = settings.search.MAX_FILE_BYTES
+            files = (
+                iter_container_files(container_id, "/app", max_bytes)
+                if container_id
+                else _iter_local_files(os.path.abspath(local_root), max_bytes)
+            )
+            index = await asyncio.to_thread(_build_index, files)
+            index.generation, index.built_at = generation, built_at
+            await asyncio.to_thread(index.save, path)
+            log_info(f"已构建搜索索引: {key} ({len(index)} 个文件)")
+
+        _indexes[key] = index
+        return index
+
+
+async def search_workspace(
+    query: str,
+    container_id: str = "",
+    local_root: str = "",
+    top_k: Optional[int] = None,
+) -> List[SearchHit]:
+    index = await get_search_index(container_id, local_root)
+    return index.search(query, top_k or settings.search.TOP_K)
+
+
+async def update_search_index(
+    path: str, content: Optional[str], container_id: str = "", local_root: str = ""
+) -> None:
+    """编辑工具写入文件后增量更新索引，content 为 None 表示文件被删除
+
+    容器内的相对路径相对于 /app，与 write_file 一致；规范化后才写入索引，
+    避免同一文件以不同写法重复出现。
+
+    只更新已经存在的索引，尚未建立索引的工作区会在首次搜索时全量构建。
+    """
+    if container_id:
+        container_id = (await get_backend().describe(container_id)).id
+    key = workspace_key(container_id, local_root)
+    # 与全量构建时的路径保持一致：容器内为 /app 下的绝对路径，本地为绝对路径
+    if container_id:
+        root = "/app"
+        path = posixpath.normpath(posixpath.join(root, path))
+    else:
+        root = os.path.abspath(local_root or ".")
+        path = os.path.abspath(path)
+    # 工作区之外的文件不在索引范围内
+    if path != root and not path.startswith(root.rstrip("/") + "/"):
+        return
+    if key not in _indexes and not _index_path(key).exists():
+        return
+
+    try:
+        index = await get_search_index(container_id, local_root)
+        if content is None:
+            index.remove_file(path)
+        else:
+            index.add_file(path, content)
+        if container_id and index.generation == _generation(container_id) - 1:
+            # 这次写入是建立索引之后唯一的变化，增量更新后索引仍与容器一致
+            index.generation += 1
+            index.built_at = time.time()
+        _schedule_save(key)
+    except Exception as e:
+        log_error(f"更新搜索索引失败: {e}")
+
+
+async def _save_index(key: str) -> None:
+    index = _indexes.get(key)
+    if index is None:
+        return
+    # 同一工作区的写盘串行执行，后生成的快照总是最后落盘
+    async with _locks.setdefault(key, asyncio.Lock()):
+        # 在事件循环中生成快照，避免写盘线程与后续更新并发修改同一字典
+        await asyncio.to_thread(_write_index, _index_path(key), index.to_dict())
+
+
+async def _save_later(key: str) -> None:
+    await asyncio.sleep(settings.search.SAVE_DELAY)
+    _pending_saves.pop(key, None)
+    try:
+        await _save_index(key)
+    except Exception as e:
+        log_error(f"保存搜索索引失败: {e}")
+
+
+def _schedule_save(key: str) -> None:
+    if key not in _pending_saves:
+        _pending_saves[key] = asyncio.create_task(_save_later(key))
+
+
+async def flush_search_indexes() -> None:
+    """立即保存所有等待落盘的索引，应用关闭时调用"""
+    pending = list(_pending_saves.items())
+    _pending_saves.clear()
+    for _, task in pending:
+        task.cancel()
+    await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+    for key, _ in pending:
+        try:
+            await _save_index(key)
+        except Exception as e:
+            log_error(f"保存搜索索引失败: {e}")
+
+
+async def forget_search_index(container_id: str) -> None:
+    """容器删除后丢弃它的索引，包括内存中的索引、等待中的保存任务和磁盘文件"""
+    key = workspace_key(container_id)
+    task = _pending_saves.pop(key, None)
+    if task is not None:
+        task.cancel()
+    _indexes.pop(key, None)
+    # 等待正在进行的写盘完成后再删除文件，避免文件被重新写出
+    async with _locks.setdefault(key, asyncio.Lock()):
+        try:
+            _index_path(key).unlink()
+        except FileNotFoundError:
+            pass
+    _locks.pop(key, None)
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from docker.errors import APIError, ImageNotFound
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.core.sqlite_store import SQLiteStore
+from app.runtime.cache import command_cache
+from app.runtime.docker_client import container_handles, get_docker_client
+
+SNAPSHOT_REPOSITORY = "manus-snapshot"
+
+
+def fingerprint(base_image_id: str, commands: List[str]) -> str:
+    """环境指纹：基础镜像 + 按顺序成功执行的安装命令"""
+    payload = "\n".join([base_image_id] + [" ".join(c.split()) for c in commands])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SnapshotRegistry(SQLiteStore):
+    """快照镜像登记表，按最近使用时间做 LRU 淘汰"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            fingerprint TEXT PRIMARY KEY,
+            image TEXT NOT NULL,
+            commands INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """
+
+    def get(self, fp: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT image FROM snapshots WHERE fingerprint = ?", (fp,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add(self, fp: str, image: str, commands: int) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+                (fp, image, commands, now, now),
+            )
+
+    def mark_used(self, fp: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE snapshots SET last_used = ? WHERE fingerprint = ?",
+                (time.time(), fp),
+            )
+
+    def remove(self, fp: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM snapshots WHERE fingerprint = ?", (fp,))
+
+    def least_recently_used(self, keep: int) -> List[Tuple[str, str]]:
+        """返回超出保留数量的快照 (指纹, 镜像)，最久未使用的在前"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT fingerprint, image FROM snapshots ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?",
+                (keep,),
+            ).fetchall()[::-1]
+
+    def fingerprints_of(self, image: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT fingerprint FROM snapshots WHERE image = ?", (image,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+
+@dataclass
+class SetupChain:
+    """容器从基础镜像开始成功执行过的安装命令序列"""
+
+    base_image_id: str
+    commands: List[str] = field(default_factory=list)
+
+
+class SnapshotManager:
+    """环境快照缓存
+
+    容器在只执行过安装类命令（以及只读命令）的阶段，每成功执行一条安装命令就把容器状态
+    提交为以指纹命名的镜像。之后创建容器时，如果给出的安装命令序列有已缓存的前缀，
+    直接从对应镜像启动，只执行剩余的命令。
+
+    快照只能在创建容器时复用，因此只为创建请求中给出了 setup_commands 的容器记录安装序列；
+    不带安装命令创建的容器（例如计划在已有容器中执行的安装步骤）不提交快照。
+    登记的镜像被外部删除时移除登记，从更短的前缀或基础镜像启动。
+    """
+
+    def __init__(self, registry: SnapshotRegistry, patterns: List[str], max_images: int):
+        self.registry = registry
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.max_images = max_images
+        self._chains: Dict[str, SetupChain] = {}
+        self.metrics: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "commits": 0,
+            "evictions": 0,
+            "stale": 0,
+        }
+
+    def is_setup_command(self, command: str) -> bool:
+        return any(pattern.search(command) for pattern in self.patterns)
+
+    async def find_snapshot(
+        self, base_image_id: str, setup_commands: List[str]
+    ) -> Tuple[Optional[str], int]:
+        """查找最长的、镜像仍然存在的已缓存前缀，返回 (镜像, 已覆盖的命令数)"""
+        for size in range(len(setup_commands), 0, -1):
+            fp = fingerprint(base_image_id, setup_commands[:size])
+            image = self.registry.get(fp)
+            if image and not await asyncio.to_thread(self._image_exists, image):
+                # 镜像已在外部被删除（例如 docker image prune），丢弃登记，继续查找更短的前缀
+                self.discard(fp)
+                continue
+            if image:
+                self.registry.mark_used(fp)
+                self.metrics["hits"] += 1
+                return image, size
+        if setup_commands:
+            self.metrics["misses"] += 1
+        return None, 0
+
+    def discard(self, fp: str) -> None:
+        """丢弃镜像已不存在的快照登记"""
+        self.registry.remove(fp)
+        self.metrics["stale"] += 1
+        log_info(f"快照镜像 {SNAPSHOT_REPOSITORY}:{fp[:16]} 已不存在，已移除登记")
+
+    def discard_image(self, image: str) -> None:
+        for fp in self.registry.fingerprints_of(image):
+            self.discard(fp)
+
+    @staticmethod
+    def _image_exists(image: str) -> bool:
+        try:
+            get_docker_client().images.get(image)
+        except ImageNotFound:
+            return False
+        return True
+
+    def start_chain(
+        self, container_id: str, base_image_id: str, commands: Optional[List[str]] = None
+    ) -> None:
+        self._chains[container_id] = SetupChain(base_image_id, list(commands or []))
+
+    def forget(self, container_id: str) -> None:
+        self._chains.pop(container_id, None)
+
+    async def record(self, container_id: str, command: str, exit_code: int) -> None:
+        """在命令执行完成后调用，维护安装序列并在需要时提交快照"""
+        chain = self._chains.get(container_id)
+        if chain is None:
+            return
+
+        if not self.is_setup_command(command):
+            # 非安装类的写命令让容器状态偏离可复现的安装序列，不再为它做快照
+            if not command_cache.is_cacheable(command):
+                self.forget(container_id)
+            return
+
+        if exit_code != 0:
+            self.forget(container_id)
+            return
+
+        chain.commands.append(command)
+        fp = fingerprint(chain.base_image_id, chain.commands)
+        if self.registry.get(fp):
+            return
+
+        try:
+            await asyncio.to_thread(self._commit, container_id, fp, len(chain.commands))
+            await asyncio.to_thread(self._evict)
+        except Exception as e:
+            log_error(f"提交环境快照失败: {e}")
+
+    def _commit(self, container_id: str, fp: str, commands: int) -> None:
+        container = container_handles.get(container_id)
+        image = container.commit(repository=SNAPSHOT_REPOSITORY, tag=fp[:16], pause=True)
+        self.registry.add(fp, image.id, commands)
+        self.metrics["commits"] += 1
+        log_info(f"已提交环境快照 {SNAPSHOT_REPOSITORY}:{fp[:16]} ({commands} 条命令)")
+
+    def _evict(self) -> None:
+        for fp, image in self.registry.least_recently_used(self.max_images):
+            try:
+                get_docker_client().images.remove(image)
+            except ImageNotFound:
+                pass
+            except APIError as e:
+                # 仍有容器在使用该镜像，下次再尝试
+                log_error(f"删除快照镜像 {image} 失败: {e}")
+                continue
+            self.registry.remove(fp)
+            self.metrics["evictions"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"images": self.registry.count(), **self.metrics}
+
+
+snapshot_manager = SnapshotManager(
+    registry=SnapshotRegistry(settings.runtime.STATE_DB),
+    patterns=settings.runtime.SETUP_COMMAND_PATTERNS,
+    max_images=settings.runtime.MAX_SNAPSHOT_IMAGES,
+)
@@ -0,0 +1,205 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from docker.errors import NotFound
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.runtime.docker_client import get_docker_client
+
+
+@dataclass(frozen=True)
+class CacheVolume:
+    name: str
+    mount_path: str
+    env: Dict[str, str]
+    # 清理时逐个删除的条目，相对于缓存根目录的 glob（空格分隔），"files" 表示每个文件都是条目
+    entries: str = "files"
+    # 删除条目后回收空间的包管理器命令（缓存目录挂载在 /cache），为空表示删除即回收
+    gc: str = ""
+
+
+# 这些包管理器的缓存都支持多个进程并发读写（uv/npm 使用文件锁或内容寻址，
+# pip 与 nvm 使用先写临时文件再原子重命名的方式）
+CACHE_VOLUMES: List[CacheVolume] = [
+    CacheVolume(
+        name="manus-cache-uv",
+        mount_path="/root/.cache/uv",
+        # 缓存卷与虚拟环境不在同一文件系统，硬链接不可用，直接复制
+        env={"UV_CACHE_DIR": "/root/.cache/uv", "UV_LINK_MODE": "copy"},
+        # 按包删除 wheels/sdists/simple 下的目录，不再被引用的 archive 由 uv cache prune 回收
+        entries="wheels-v*/*/* sdists-v*/*/* simple-v*/*/*",
+        gc="command -v uv >/dev/null && UV_CACHE_DIR=/cache uv cache prune",
+    ),
+    CacheVolume(
+        name="manus-cache-pip",
+        mount_path="/root/.cache/pip",
+        env={"PIP_CACHE_DIR": "/root/.cache/pip"},
+        # pip 的缓存文件都是先写临时文件再重命名的完整条目
+        entries="files",
+    ),
+    CacheVolume(
+        name="manus-cache-npm",
+        mount_path="/root/.npm",
+        env={"npm_config_cache": "/root/.npm"},
+        # 删除 _cacache 的索引条目，之后 npm cache verify 回收不再被引用的内容
+        entries="_cacache/index-v5/*/*/*",
+        gc="command -v npm >/dev/null && npm cache verify --cache /cache",
+    ),
+    CacheVolume(
+        name="manus-cache-nvm",
+        mount_path="/root/.nvm/.cache",
+        env={},
+        # bin/node-vX 与 src/node-vX 各是一个版本的完整下载
+        entries="bin/* src/*",
+    ),
+]
+
+# 总大小超过上限（$1 字节）时按条目（$2）做 LRU 清理：条目的时间取其中文件最新的访问或修改时间，
+# 最近 $3 秒内用过的条目不删除。每轮从最旧的条目开始删除，直到删除的大小抵消超出部分；
+# 有回收命令（$4）时每轮最多删除十分之一的候选条目，执行回收命令后重新统计，最多十轮
+_PRUNE_SCRIPT = """
+cd /cache || exit 0
+collect() {
+    if [ "$2" = "files" ]; then
+        find . -type f -printf '%A@ %T@ %s %p\\n'
+    else
+        for entry in $2; do
+            [ -e "$entry" ] || continue
+            latest=$(find "$entry" -type f -printf '%A@\\n%T@\\n' | sort -n | tail -1)
+            echo "$latest $latest $(du -sb "$entry" | cut -f1) $entry"
+        done
+    fi
+}
+round=0
+while [ "$round" -lt 10 ]; do
+    round=$((round + 1))
+    total=$(du -sb . | cut -f1)
+    [ "$total" -le "$1" ] && break
+    overflow=$((total - $1))
+    cutoff=$(($(date +%s) - $3))
+    collect "$@" | awk -v cutoff="$cutoff" \\
+        '{ t = $1 > $2 ? $1 : $2; if (t < cutoff) printf "%.0f %s\\n", t, $0 }' \\
+        | sort -n > /tmp/candidates
+    count=$(wc -l < /tmp/candidates)
+    [ "$count" -eq 0 ] && break
+    limit=$(((count + 9) / 10))
+    freed=0
+    removed=0
+    while read -r t atime mtime size path; do
+        rm -rf -- "$path"
+        freed=$((freed + size))
+        removed=$((removed + 1))
+        [ "$freed" -ge "$overflow" ] && break
+        [ -n "$4" ] && [ "$removed" -ge "$limit" ] && break
+    done < /tmp/candidates
+    if [ -n "$4" ]; then
+        sh -c "$4" >/dev/null 2>&1 || break
+    fi
+done
+find . -mindepth 1 -type d -empty -delete
+"""
+
+
+def container_volume_options() -> Dict[str, Dict]:
+    """返回创建容器时需要的 volumes 与 environment 参数，未启用时为空"""
+    if not settings.runtime.CACHE_VOLUMES_ENABLED:
+        return {}
+    return {
+        "volumes": {
+            volume.name: {"bind": volume.mount_path, "mode": "rw"}
+            for volume in CACHE_VOLUMES
+        },
+        "environment": {
+            key: value for volume in CACHE_VOLUMES for key, value in volume.env.items()
+        },
+    }
+
+
+class CacheVolumeManager:
+    """共享缓存卷的创建与定期 LRU 清理
+
+    容器常驻数小时，清理不等待卷空闲，挂载期间同样执行。按包或文件粒度删除条目，
+    最近用过的条目不删除；删除正被读取的条目最坏只会让包管理器重新下载。
+    """
+
+    def __init__(self, max_bytes: int, interval: float, grace: float):
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.grace = grace
+        self.metrics: Dict[str, int] = {
+            "prune_runs": 0,
+            "prune_errors": 0,
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_volumes(self) -> None:
+        client = get_docker_client()
+        for volume in CACHE_VOLUMES:
+            try:
+                client.volumes.get(volume.name)
+            except NotFound:
+                client.volumes.create(
+                    name=volume.name, labels={"manus.cache": volume.mount_path}
+                )
+                log_info(f"已创建缓存卷 {volume.name}")
+
+    def prune_volume(self, volume: CacheVolume) -> None:
+        """在临时容器中清理缓存卷"""
+        get_docker_client().containers.run(
+            settings.runtime.BASE_IMAGE,
+            command=[
+                "/bin/sh",
+                "-c",
+                _PRUNE_SCRIPT,
+                "prune",
+                str(self.max_bytes),
+                volume.entries,
+                str(int(self.grace)),
+                volume.gc,
+            ],
+            volumes={volume.name: {"bind": "/cache", "mode": "rw"}},
+            network_mode="none",
+            remove=True,
+        )
+
+    async def prune_all(self) -> None:
+        for volume in CACHE_VOLUMES:
+            try:
+                await asyncio.to_thread(self.prune_volume, volume)
+                self.metrics["prune_runs"] += 1
+            except Exception as e:
+                self.metrics["prune_errors"] += 1
+                log_error(f"清理缓存卷 {volume.name} 失败: {e}")
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.prune_all()
+
+    async def start(self) -> None:
+        if not settings.runtime.CACHE_VOLUMES_ENABLED or self._task is not None:
+            return
+        await asyncio.to_thread(self.ensure_volumes)
+        self._task = asyncio.create_task(self._loop())
+        log_info("缓存卷清理任务已启动")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"enabled": int(settings.runtime.CACHE_VOLUMES_ENABLED), **self.metrics}
+
+
+cache_volume_manager = CacheVolumeManager(
+    max_bytes=settings.runtime.CACHE_VOLUME_MAX_MB * 1024 * 1024,
+    interval=settings.runtime.CACHE_PRUNE_INTERVAL,
+    grace=settings.runtime.CACHE_PRUNE_GRACE,
+)
@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+
+_RUN_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class CheckpointStore:
+    """计划运行的检查点
+
+    每个运行一个 JSONL 文件，只追加写入：start 记录任务参数，plan 记录解析后的计划，
+    每完成一个步骤追加一条 step 记录（步骤序号、结果与新增的记忆消息），步骤失败后重新规划时
+    追加 replan 记录（新的完整计划），error 记录失败原因。
+    读取时按顺序回放得到最新状态；进程崩溃时写了一半的最后一行会被忽略。
+    运行成功或被主动取消后删除检查点，失败与被中断的运行保留，用于继续执行；
+    保留的检查点在后台任务队列启动时按 TTL 与最大数量清理。
+    """
+
+    def __init__(self, directory: str, ttl: float, max_files: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def path(self, run_id: str) -> str:
+        if not _RUN_ID_PATTERN.match(run_id):
+            raise ValueError(f"无效的运行ID: {run_id}")
+        return os.path.join(self.directory, f"{run_id}.jsonl")
+
+    def start(self, run_id: str, data: Dict[str, Any]) -> None:
+        """开始新的运行：覆盖同一 run_id 之前留下的检查点，只保留本次的 start 记录"""
+        self._write(run_id, "start", data, "w")
+
+    def append(self, run_id: str, kind: str, data: Dict[str, Any]) -> None:
+        self._write(run_id, kind, data, "a")
+
+    def _write(self, run_id: str, kind: str, data: Dict[str, Any], mode: str) -> None:
+        record = {"type": kind, "ts": time.time(), **data}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        path = self.path(run_id)
+        with self._lock:
+            # 第一次写入时才创建目录，导入模块时不创建
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, mode, encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def load(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """回放检查点，返回运行的最新状态；不存在时返回 None"""
+        path = self.path(run_id)
+        if not os.path.exists(path):
+            return None
+
+        state: Dict[str, Any] = {
+            "run_id": run_id,
+            "plan": None,
+            "current_step": 0,
+            "step_results": [],
+            "memory": [],
+            "error": None,
+        }
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    log_error(f"检查点 {path} 中有无法解析的记录，已忽略")
+                    continue
+                kind = record.pop("type", None)
+                state["updated_at"] = record.pop("ts", None)
+                if kind == "start":
+                    state.update(record)
+                elif kind == "plan":
+                    state["plan"] = record["plan"]
+                    state["current_step"] = 0
+                    state["step_results"] = []
+                elif kind == "step":
+                    state["current_step"] = record["current_step"]
+                    state["step_results"].append(
+                        {"step": record["current_step"], "result": record["result"]}
+                    )
+                    if record.get("memory_reset"):
+                        state["memory"] = []
+                    state["memory"].extend(record.get("memory", []))
+                    state["error"] = None
+                elif kind == "replan":
+                    # 从失败的步骤开始替换为新的后续步骤，已完成的步骤结果不变
+                    state["plan"] = record["plan"]
+                    state["current_step"] = record["current_step"]
+                elif kind == "error":
+                    state["error"] = record["error"]
+        return state
+
+    def resumable(self, run_id: str) -> bool:
+        """检查点中已有计划，可以跳过规划从下一个步骤继续"""
+        state = self.load(run_id)
+        return state is not None and state["plan"] is not None
+
+    def remove(self, run_id: str) -> None:
+        try:
+            os.remove(self.path(run_id))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, keep: Iterable[str] = ()) -> int:
+        """删除过期与超出数量上限的检查点，keep 中的运行（待继续执行的任务）不删除
+
+        返回:
+            int: 删除的检查点数
+        """
+        keep = set(keep)
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+
+        entries = []
+        for name in names:
+            run_id, ext = os.path.splitext(name)
+            if ext != ".jsonl" or run_id in keep:
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((mtime, run_id))
+        entries.sort(reverse=True)
+
+        now = time.time()
+        expired = [
+            run_id
+            for index, (mtime, run_id) in enumerate(entries)
+            if (self.ttl and now - mtime > self.ttl)
+            or (self.max_files and index >= self.max_files)
+        ]
+        for run_id in expired:
+            self.remove(run_id)
+        if expired:
+            log_info(f"已清理 {len(expired)} 个过期的检查点")
+        return len(expired)
+
+
+checkpoint_store = CheckpointStore(
+    settings.checkpoint.DIR,
+    ttl=settings.checkpoint.TTL,
+    max_files=settings.checkpoint.MAX_FILES,
+)
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.core.admission import admission_controller
+from app.core.logger import log_info, log_error
+from app.core.setting import settings
+from app.core.sqlite_store import SQLiteStore
+from app.service.checkpoint_store import checkpoint_store
+from app.service.manus_service import generate_conversation_plan
+from app.service.run_registry import run_registry
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+_COLUMNS = (
+    "id",
+    "kind",
+    "status",
+    "payload",
+    "progress",
+    "result",
+    "error",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+_JSON_COLUMNS = ("payload", "progress", "result")
+
+
+class QueueFullError(Exception):
+    """等待中的任务已达到上限"""
+
+
+class JobStore(SQLiteStore):
+    """任务记录，保存在 SQLite 中，进程重启后仍可查询状态与结果"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    """
+
+    def create(self, kind: str, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), time.time()),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        for column in _JSON_COLUMNS:
+            if column in fields:
+                fields[column] = json.dumps(fields[column], ensure_ascii=False)
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def _row_to_dict(self, row) -> Dict[str, Any]:
+        job = dict(zip(_COLUMNS, row))
+        for column in _JSON_COLUMNS:
+            if job[column] is not None:
+                job[column] = json.loads(job[column])
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_by_status(self, *statuses: str) -> List[Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs "
+                f"WHERE status IN ({placeholders}) ORDER BY created_at",
+                statuses,
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+
+JobHandler = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], None]], Awaitable[Any]]
+
+
+async def run_plan_job(
+    payload: Dict[str, Any], report: Callable[[Dict[str, Any]], None]
+) -> Dict[str, Any]:
+    """执行计划生成任务，与同步接口共用计划的并发名额
+
+    重新排队的任务（服务关闭时被中断或进程崩溃）有检查点时从上次完成的步骤继续。
+    """
+    os.makedirs(payload["result_path"], exist_ok=True)
+    async with admission_controller.hold("plan"):
+        return await generate_conversation_plan(
+            payload["query"],
+            payload["result_path"],
+            payload["container_id"],
+            on_progress=lambda step, total: report({"step": step, "total": total}),
+            run_id=payload["run_id"],
+            resume=checkpoint_store.resumable(payload["run_id"]),
+        )
+
+
+class JobManager:
+    """后台任务队列与固定大小的工作协程池
+
+    提交时只写入记录并入队，立即返回任务ID；工作协程数量决定同时执行的任务数上限，
+    超出的任务在队列中等待，队列满时拒绝提交。
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, JobHandler],
+        workers: int,
+        max_queue: int,
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        if self._queue is None or self._stopping:
+            raise RuntimeError("任务队列未在运行")
+        if self._queue.qsize() >= self.max_queue:
+            raise QueueFullError("任务队列已满，请稍后重试")
+        job_id = self.store.create(kind, payload)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消任务，已结束的任务返回 False"""
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED_STATES:
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            # 通过运行登记表取消，计划会返回已完成步骤的部分结果
+            if run_registry.cancel(job_id) is None:
+                task.cancel()
+        else:
+            # 仍在队列中，工作协程取到时会跳过
+            self.store.update(job_id, status=CANCELLED, finished_at=time.time())
+        return True
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        handler = self.handlers[job["kind"]]
+        self.store.update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            # 任务ID同时作为运行ID，可以通过运行登记表查询或取消
+            result = await handler(
+                {"run_id": job_id, **job["payload"]},
+                lambda progress: self.store.update(job_id, progress=progress),
+            )
+            cancelled = isinstance(result, dict) and result.get("cancelled")
+            if cancelled and result.get("reason") == "shutdown":
+                # 服务关闭时被中断：保留部分结果作为检查点，重新排队等待下次启动执行
+                self.store.update(job_id, status=QUEUED, result=result, started_at=None)
+                return
+            status = CANCELLED if cancelled else SUCCEEDED
+            self.store.update(
+                job_id, status=status, result=result, finished_at=time.time()
+            )
+        except asyncio.CancelledError:
+            if self._stopping:
+                self.store.update(job_id, status=QUEUED, started_at=None)
+            else:
+                self.store.update(job_id, status=CANCELLED, finished_at=time.time())
+        except Exception as e:
+            log_error(f"任务 {job_id} 执行失败: {e}")
+            self.store.update(
+                job_id, status=FAILED, error=str(e), finished_at=time.time()
+            )
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = self.store.get(job_id)
+                if job is None or job["status"] != QUEUED:
+                    continue
+                if self._stopping:
+                    # 已开始关闭，任务保持排队状态，下次启动时执行
+                    continue
+                # 在独立的任务中执行，取消单个任务不会影响工作协程本身；
+                # 任务结束时才从执行表中移除，工作协程被取消后仍能等待它
+                task = asyncio.create_task(self._execute(job))
+                self._running[job_id] = task
+                task.add_done_callback(
+                    lambda _, job_id=job_id: self._running.pop(job_id, None)
+                )
+                await asyncio.shield(task)
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        # 清理过期的检查点，排队与上次中断的任务还要用来继续执行
+        checkpoint_store.sweep(
+            keep=[
+                job["id"]
+                for status in (RUNNING, QUEUED)
+                for job in self.store.list_by_status(status)
+            ]
+        )
+        # 上次退出时正在执行的任务有检查点的重新排队继续执行，没有的记为失败
+        for job in self.store.list_by_status(RUNNING):
+            if checkpoint_store.resumable(job["id"]):
+                self.store.update(job["id"], status=QUEUED, started_at=None)
+                continue
+            self.store.update(
+                job["id"], status=FAILED, error="服务重启，任务中断", finished_at=time.time()
+            )
+        for job in self.store.list_by_status(QUEUED):
+            self._queue.put_nowait(job["id"])
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        log_info(f"后台任务队列已启动，工作协程数: {self.workers}")
+
+    async def pause(self) -> None:
+        """停止接收与领取任务，执行中的任务继续运行，关闭流程开始时调用"""
+        self._stopping = True
+        # 工作协程以 shield 等待任务，取消工作协程不会中断任务本身
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def stop(self, timeout: float = 0) -> None:
+        """停止接收与领取任务，等待执行中的任务最多 timeout 秒
+
+        仍未结束的任务被中断后重新标记为排队，下次启动时继续执行，而不是记为取消。
+        """
+        await self.pause()
+        running = list(self._running.values())
+        if running and timeout > 0:
+            await asyncio.wait(running, timeout=timeout)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        self._running.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": len(self._running),
+            "jobs": self.store.count_by_status(),
+        }
+
+
+job_manager = JobManager(
+    store=JobStore(settings.job.DB_PATH),
+    handlers={"plan": run_plan_job},
+    workers=settings.job.WORKERS,
+    max_queue=settings.job.MAX_QUEUE,
+)
@@ -1,23 +1,76 @@
+import asyncio
+import uuid
 from app.agent import PlanAgent
-from typing import Dict
+from app.service.checkpoint_store import checkpoint_store
+from app.service.run_registry import run_registry
+from typing import Any, Callable, Dict, Optional
 
 
 async def generate_conversation_plan(
-    query: str, result_path: str, container_id: str
-) -> Dict[str, str]:
+    query: str,
+    result_path: str,
+    container_id: str,
+    on_progress: Optional[Callable[[int, int], Any]] = None,
+    run_id: Optional[str] = None,
+    resume: bool = False,
+) -> Dict[str, Any]:
     """
     生成对话计划的服务函数
 
     Args:
         query: 用户查询字符串
+        on_progress: 可选的进度回调，参数为 (已完成步骤数, 总步骤数)
+        run_id: 运行ID，可通过它查询或取消本次运行，为空时自动生成
+        resume: 为真时从 run_id 的检查点继续，跳过规划与已完成的步骤
 
     Returns:
-        包含生成计划的字典
+        包含生成计划的字典；运行被取消时还包含 cancelled 与已完成步骤的部分结果
     """
+    run_id = run_id or uuid.uuid4().hex
     # 调用 plan_agent 生成计划
-    plan_agent = PlanAgent(result_path=result_path, container_id=container_id)
+    plan_agent = PlanAgent(
+        result_path=result_path,
+        container_id=container_id,
+        on_progress=on_progress,
+        on_checkpoint=lambda kind, data: checkpoint_store.append(run_id, kind, data),
+    )
 
-    execution_result = await plan_agent.run(query)
+    if resume:
+        state = checkpoint_store.load(run_id)
+        if state is None or state["plan"] is None:
+            raise ValueError(f"运行 {run_id} 没有可以继续的检查点")
+        plan_agent.restore(state)
+        query = state["query"]
 
+    # 先登记运行：同一 run_id 正在执行时在这里拒绝，不会写入它的检查点
+    with run_registry.track(run_id, plan_agent, container_id) as run:
+        if not resume:
+            checkpoint_store.start(
+                run_id,
+                {"query": query, "result_path": result_path, "container_id": container_id},
+            )
+        try:
+            execution_result = await plan_agent.run(query, resume=resume)
+        except asyncio.CancelledError:
+            # 只处理通过取消接口发起的取消，其他取消（例如服务关闭）继续向上传播
+            if not run.cancel_requested:
+                raise
+            task = asyncio.current_task()
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            # 服务关闭时中断的运行保留检查点，之后可以继续
+            if run.cancel_reason != "shutdown":
+                checkpoint_store.remove(run_id)
+            return {
+                "run_id": run_id,
+                "cancelled": True,
+                "reason": run.cancel_reason,
+                **run.partial_result(),
+            }
+        except Exception as e:
+            checkpoint_store.append(run_id, "error", {"error": str(e)})
+            raise
+
+    checkpoint_store.remove(run_id)
     # 将字符串结果包装成字典返回
-    return {"plan": execution_result}
+    return {"run_id": run_id, "plan": execution_result}
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core.logger import log_info
+
+
+@dataclass
+class PlanRun:
+    """一次正在执行或已结束的计划运行"""
+
+    id: str
+    container_id: str
+    agent: Any
+    task: Optional[asyncio.Task]
+    status: str = "running"
+    cancel_requested: bool = False
+    # 取消原因：user 为通过接口取消，shutdown 为服务关闭时中断
+    cancel_reason: Optional[str] = None
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def partial_result(self) -> Dict[str, Any]:
+        """当前已有的结果：计划本身与已完成步骤的输出"""
+        return {
+            "plan": list(self.agent.plan),
+            "completed_steps": len(self.agent.step_results),
+            "results": list(self.agent.step_results),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.id,
+            "container_id": self.container_id,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.partial_result(),
+        }
+
+
+class RunRegistry:
+    """计划运行登记表，用于查询与取消正在执行的计划
+
+    取消会对执行该计划的 asyncio 任务调用 cancel()，取消沿着 PlanAgent.step、
+    子代理、LLM 请求与容器命令逐层传播；已结束的运行保留最近 max_finished 条。
+    """
+
+    def __init__(self, max_finished: int = 200):
+        self.max_finished = max_finished
+        self._active: Dict[str, PlanRun] = {}
+        self._finished: "OrderedDict[str, PlanRun]" = OrderedDict()
+
+    @contextmanager
+    def track(self, run_id: str, agent: Any, container_id: str = ""):
+        """在当前任务中登记一次运行，退出时根据结果更新状态"""
+        if run_id in self._active:
+            raise ValueError(f"运行 {run_id} 已在执行中")
+        run = PlanRun(
+            id=run_id,
+            container_id=container_id,
+            agent=agent,
+            task=asyncio.current_task(),
+        )
+        self._active[run_id] = run
+        try:
+            yield run
+            run.status = "succeeded"
+        except asyncio.CancelledError:
+            run.status = "cancelled"
+            raise
+        except Exception:
+            run.status = "failed"
+            raise
+        finally:
+            if run.cancel_requested:
+                run.status = "cancelled"
+            run.finished_at = time.time()
+            run.task = None
+            self._active.pop(run_id, None)
+            self._finished[run_id] = run
+            while len(self._finished) > self.max_finished:
+                self._finished.popitem(last=False)
+
+    def get(self, run_id: str) -> Optional[PlanRun]:
+        return self._active.get(run_id) or self._finished.get(run_id)
+
+    def list_active(self) -> List[PlanRun]:
+        return list(self._active.values())
+
+    def cancel(self, run_id: str, reason: str = "user") -> Optional[PlanRun]:
+        """请求取消运行，返回该运行；不存在或已结束时返回 None"""
+        run = self._active.get(run_id)
+        if run is None:
+            return None
+        run.cancel_requested = True
+        run.cancel_reason = reason
+        if run.task is not None:
+            run.task.cancel()
+        log_info(f"已请求取消计划运行 {run_id}，原因: {reason}")
+        return run
+
+    async def drain(self, timeout: float) -> None:
+        """等待正在执行的运行结束，超时仍未结束的以 shutdown 原因中断
+
+        被中断的运行会返回部分结果并保存检查点，等待它们完成收尾后再返回。
+        在应用关闭流程中调用时，同步请求发起的运行已由 uvicorn 等待结束，
+        剩下的是后台任务队列中的运行。
+        """
+        tasks = [run.task for run in self._active.values() if run.task is not None]
+        if not tasks:
+            return
+        log_info(f"等待 {len(tasks)} 个计划运行完成，最长 {timeout} 秒")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if not pending:
+            return
+        for run in list(self._active.values()):
+            if run.task in pending:
+                self.cancel(run.id, reason="shutdown")
+        await asyncio.wait(pending, timeout=10)
+
+
+run_registry = RunRegistry()
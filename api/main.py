@@ -3,8 +3,15 @@ from contextlib import asynccontextmanager
 from app.middreware.exception_handler import register_exception_handlers
 from app.controller import chat
 from app.controller import manus
+from app.controller import runtime
 from app.core.setting import get_settings
 from app.core.logger import setup_logging, logger
+from app.core.admission import admission_controller
+from app.runtime.backend import get_backend
+from app.runtime.lifecycle import lifecycle_manager
+from app.runtime.search import flush_search_indexes
+from app.service.job_service import job_manager
+from app.service.run_registry import run_registry
 
 # 获取设置
 settings = get_settings()
@@ -16,12 +23,30 @@ async def lifespan(app: FastAPI):
     # 启动事件
     await setup_logging()
     logger.info("日志系统已初始化")
+    await get_backend().start()
+    lifecycle_manager.start()
+    job_manager.start()
     logger.info("应用程序已启动")
 
     yield
 
-    # 关闭事件（如果有需要）
+    # 关闭事件：停止接受新请求与领取后台任务，等待执行中的计划完成，超时的保存检查点后中断。
+    # uvicorn 在收到关闭信号后先停止接受连接并等待进行中的请求（受 --timeout-graceful-shutdown
+    # 限制），之后才执行这里，因此同步的 /generate-plan 请求由 uvicorn 等待，
+    # 这里的排空实际覆盖的是后台任务队列执行的计划
+    admission_controller.start_drain()
+    await job_manager.pause()
+    await run_registry.drain(settings.admission.DRAIN_TIMEOUT)
+    await job_manager.stop(timeout=10)
+    await lifecycle_manager.stop()
+    await flush_search_indexes()
+    await get_backend().shutdown()
+    # 后端关闭后不再有登记表写入，关闭 SQLite 连接
+    job_manager.store.close()
+    lifecycle_manager.registry.close()
     logger.info("应用程序已关闭")
+    # 等待异步日志队列写完
+    await logger.complete()
 
 
 # 创建应用
@@ -39,3 +64,4 @@ register_exception_handlers(app)
 
 app.include_router(chat.router)
 app.include_router(manus.router)
+app.include_router(runtime.router)
@@ -0,0 +1,87 @@
+import pytest
+
+from app.service.checkpoint_store import CheckpointStore
+
+PLAN = [{"tool": "command", "command": "ls"}, {"tool": "command", "command": "make"}]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CheckpointStore(str(tmp_path / "checkpoints"), ttl=0, max_files=0)
+
+
+def test_replay(store):
+    store.start("run1", {"query": "build"})
+    store.append("run1", "plan", {"plan": PLAN})
+    store.append(
+        "run1",
+        "step",
+        {"current_step": 1, "result": "ok", "memory": [{"role": "user", "content": "a"}]},
+    )
+    store.append("run1", "error", {"error": "make failed"})
+
+    state = store.load("run1")
+    assert state["query"] == "build"
+    assert state["plan"] == PLAN
+    assert state["current_step"] == 1
+    assert state["step_results"] == [{"step": 1, "result": "ok"}]
+    assert state["memory"] == [{"role": "user", "content": "a"}]
+    assert state["error"] == "make failed"
+    assert store.resumable("run1")
+
+
+def test_replan_and_memory_reset(store):
+    store.start("run1", {"query": "build"})
+    store.append("run1", "plan", {"plan": PLAN})
+    store.append("run1", "step", {"current_step": 1, "result": "ok", "memory": [{"n": 1}]})
+    new_plan = PLAN[:1] + [{"tool": "command", "command": "make -j1"}]
+    store.append("run1", "replan", {"plan": new_plan, "current_step": 1})
+    store.append(
+        "run1",
+        "step",
+        {"current_step": 2, "result": "built", "memory": [{"n": 2}], "memory_reset": True},
+    )
+
+    state = store.load("run1")
+    assert state["plan"] == new_plan
+    assert state["current_step"] == 2
+    assert [r["result"] for r in state["step_results"]] == ["ok", "built"]
+    assert state["memory"] == [{"n": 2}]
+    assert state["error"] is None
+
+
+def test_partial_last_line_ignored(store):
+    store.start("run1", {"query": "build"})
+    store.append("run1", "plan", {"plan": PLAN})
+    with open(store.path("run1"), "a", encoding="utf-8") as f:
+        f.write('{"type":"step","current_')
+
+    state = store.load("run1")
+    assert state["plan"] == PLAN
+    assert state["current_step"] == 0
+
+
+def test_start_overwrites_previous_run(store):
+    store.start("run1", {"query": "old"})
+    store.append("run1", "plan", {"plan": PLAN})
+    store.start("run1", {"query": "new"})
+
+    state = store.load("run1")
+    assert state["query"] == "new"
+    assert state["plan"] is None
+    assert not store.resumable("run1")
+
+
+def test_missing_and_invalid_ids(store):
+    assert store.load("nope") is None
+    store.remove("nope")
+    with pytest.raises(ValueError):
+        store.path("../etc/passwd")
+
+
+def test_sweep_keeps_pending(tmp_path):
+    store = CheckpointStore(str(tmp_path), ttl=0, max_files=1)
+    for run_id in ["a", "b", "c"]:
+        store.start(run_id, {})
+    assert store.sweep(keep=["a"]) == 1
+    assert store.load("a") is not None
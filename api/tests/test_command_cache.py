@@ -0,0 +1,60 @@
+from app.runtime.cache import CommandCache
+
+CONTAINER = "a" * 64
+
+
+def make_cache(max_entries: int = 16) -> CommandCache:
+    return CommandCache(
+        patterns=[r"ls( .*)?", r"cat .*"],
+        image_patterns=[r"python3? --version"],
+        max_entries=max_entries,
+    )
+
+
+def test_hit_until_generation_bumped():
+    cache = make_cache()
+    cache.put(CONTAINER, "img", "/app", "ls  -la", "out", cache.generation(CONTAINER))
+    assert cache.get(CONTAINER, "img", "/app", "ls -la") == "out"
+    assert cache.get(CONTAINER, "img", "/tmp", "ls -la") is None
+
+    cache.bump(CONTAINER)
+    assert cache.generation(CONTAINER) == 1
+    assert cache.get(CONTAINER, "img", "/app", "ls -la") is None
+
+
+def test_put_dropped_when_generation_changed_during_exec():
+    cache = make_cache()
+    generation = cache.generation(CONTAINER)
+    cache.bump(CONTAINER)
+    cache.put(CONTAINER, "img", "/app", "ls", "stale", generation)
+    assert cache.get(CONTAINER, "img", "/app", "ls") is None
+
+
+def test_image_facts_shared_until_first_write():
+    cache = make_cache()
+    cache.put(CONTAINER, "img", "/app", "python --version", "Python 3.11", 0)
+
+    other = "b" * 64
+    assert cache.get(other, "img", "/app", "python --version") == "Python 3.11"
+    cache.bump(other)
+    assert cache.get(other, "img", "/app", "python --version") is None
+
+
+def test_forget_and_lru():
+    cache = make_cache(max_entries=2)
+    for command in ["ls", "ls /a", "ls /b"]:
+        cache.put(CONTAINER, "img", "/", command, command, 0)
+    assert cache.get(CONTAINER, "img", "/", "ls") is None
+    assert cache.get(CONTAINER, "img", "/", "ls /b") == "ls /b"
+
+    cache.bump(CONTAINER)
+    cache.forget(CONTAINER)
+    assert cache.generation(CONTAINER) == 0
+    assert cache.stats()["entries"] == 0
+
+
+def test_is_cacheable():
+    cache = make_cache()
+    assert cache.is_cacheable("ls")
+    assert cache.is_cacheable("python3  --version")
+    assert not cache.is_cacheable("rm -rf /app")
@@ -0,0 +1,78 @@
+import pytest
+
+from app.core.plan_cache import PlanCache, extract_slots
+
+TOOLS = [{"type": "function", "function": {"name": "command"}}]
+
+
+def make_plan(path: str, result_path: str):
+    return [
+        {"tool": "command", "command": f"cd {path} && pytest"},
+        {"tool": "command", "command": f"cp report.xml {result_path}/"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "query, template, slots",
+    [
+        ("run tests in /app/api", "run tests in <slot>", ["/app/api"]),
+        ("open https://example.com/a?b=1", "open <slot>", ["https://example.com/a?b=1"]),
+        ('grep "TODO list" in main.py', "grep <slot> in <slot>", ["TODO list", "main.py"]),
+        ("upgrade to v2.0.1", "upgrade to <slot>", ["v2.0.1"]),
+        ("install flask==2.3.2", "install flask==<slot>", ["2.3.2"]),
+        ("retry 3 times", "retry 3 times", []),
+    ],
+)
+def test_extract_slots(query, template, slots):
+    assert extract_slots(query) == (template, slots)
+
+
+def test_exact_hit_fills_slots():
+    cache = PlanCache(max_entries=8, similarity=0.8, ttl=0)
+    cache.store("run tests in /app/api", TOOLS, "/results/1", make_plan("/app/api", "/results/1"))
+
+    plan = cache.lookup("Run tests in /srv/web", TOOLS, "/results/2")
+    assert plan == make_plan("/srv/web", "/results/2")
+    assert cache.metrics["hits"] == 1
+
+
+def test_near_hit_allows_extra_words():
+    cache = PlanCache(max_entries=8, similarity=0.7, ttl=0)
+    cache.store("run the tests in /app/api", TOOLS, "/r/1", make_plan("/app/api", "/r/1"))
+
+    assert cache.lookup("please run the tests in /srv/web", TOOLS, "/r/2") == make_plan(
+        "/srv/web", "/r/2"
+    )
+    assert cache.metrics["near_hits"] == 1
+
+
+@pytest.mark.parametrize(
+    "stored, query",
+    [
+        ("delete the tests in /app/api", "do not delete the tests in /app/api"),
+        ("删除 /app/api 中的测试", "不要删除 /app/api 中的测试"),
+        # 词被替换是不同的任务
+        ("run flask tests in /app/api", "run django tests in /app/api"),
+    ],
+)
+def test_near_match_refused(stored, query):
+    cache = PlanCache(max_entries=8, similarity=0.1, ttl=0)
+    cache.store(stored, TOOLS, "/r/1", make_plan("/app/api", "/r/1"))
+    assert cache.lookup(query, TOOLS, "/r/2") is None
+
+
+def test_different_tools_miss():
+    cache = PlanCache(max_entries=8, similarity=0.8, ttl=0)
+    cache.store("run tests in /app/api", TOOLS, "/r/1", make_plan("/app/api", "/r/1"))
+    other_tools = TOOLS + [{"type": "function", "function": {"name": "edit_file"}}]
+    assert cache.lookup("run tests in /app/api", other_tools, "/r/2") is None
+
+
+def test_invalidate_and_lru():
+    cache = PlanCache(max_entries=1, similarity=0.8, ttl=0)
+    cache.store("run tests in /app/api", TOOLS, "/r/1", make_plan("/app/api", "/r/1"))
+    cache.store("build docs in /app/docs", TOOLS, "/r/1", make_plan("/app/docs", "/r/1"))
+    assert cache.lookup("run tests in /app/api", TOOLS, "/r/2") is None
+
+    cache.invalidate("build docs in /app/docs", TOOLS)
+    assert cache.stats()["entries"] == 0
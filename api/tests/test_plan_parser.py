@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from app.core.plan_parser import StreamingJSONParser, drop_last_step
+
+PLAN = {
+    "plan": [
+        {"tool": "command", "command": "ls /app"},
+        {"tool": "command", "command": "rm -rf /app/build"},
+    ]
+}
+
+
+def parse(text: str, chunk_size: int = 0):
+    parser = StreamingJSONParser()
+    if chunk_size:
+        for i in range(0, len(text), chunk_size):
+            parser.feed(text[i : i + chunk_size])
+    else:
+        parser.feed(text)
+    return parser
+
+
+@pytest.mark.parametrize("chunk_size", [0, 1, 7])
+def test_complete_plan_after_prose(chunk_size):
+    text = "计划如下 [v1]：\n```json\n" + json.dumps(PLAN) + "\n```\n以上。"
+    parser = parse(text, chunk_size)
+    assert parser.done
+    assert parser.result() == (PLAN, False)
+
+
+def test_truncated_inside_string_drops_partial_value():
+    text = json.dumps(PLAN)
+    cut = text.index("/app/build") + len("/app/bu")
+    parsed, repaired = parse(text[:cut]).result()
+
+    assert repaired
+    # 半截的命令不能被补全成 "rm -rf /app/bu"
+    assert "rm -rf /app/bu" not in json.dumps(parsed)
+    assert parsed["plan"][0] == PLAN["plan"][0]
+
+
+def test_truncated_between_elements_keeps_complete_steps():
+    text = json.dumps(PLAN)
+    cut = text.index("}, {") + 1
+    parsed, repaired = parse(text[:cut]).result()
+    assert repaired
+    assert parsed == {"plan": [PLAN["plan"][0]]}
+
+
+def test_drop_last_step():
+    assert drop_last_step(PLAN) == {"plan": [PLAN["plan"][0]]}
+    assert drop_last_step(PLAN["plan"]) == [PLAN["plan"][0]]
+    assert drop_last_step("text") == "text"
+
+
+def test_no_json_raises():
+    with pytest.raises(ValueError):
+        parse("没有计划").result()
+
+
+def test_mismatched_bracket_sets_error():
+    parser = parse('{"plan": [}')
+    assert parser.error
@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+from typing import Iterator, List, Optional, Tuple
+
+import pytest
+
+from app.runtime.backend import RuntimeBackend, RuntimeHandle, RuntimeNotFoundError
+from app.runtime.scheduler import (
+    HostState,
+    NoCapacityError,
+    PlacementRegistry,
+    ScheduledBackend,
+)
+
+GB = 1024**3
+_ids = itertools.count()
+
+
+class FakeBackend(RuntimeBackend):
+    """只在内存中记录容器的后端"""
+
+    name = "fake"
+
+    def __init__(self, fail_create: bool = False):
+        self.containers: List[str] = []
+        self.fail_create = fail_create
+
+    async def create(self, setup_commands: List[str]) -> RuntimeHandle:
+        if self.fail_create:
+            raise RuntimeError("创建失败")
+        runtime_id = f"c{next(_ids):04d}" + "0" * 60
+        self.containers.append(runtime_id)
+        return RuntimeHandle(id=runtime_id, image="fake")
+
+    async def fork(self, runtime_id: str, count: int) -> List[RuntimeHandle]:
+        return [await self.create([]) for _ in range(count)]
+
+    async def describe(self, runtime_id: str) -> RuntimeHandle:
+        if runtime_id not in self.containers:
+            raise RuntimeNotFoundError(runtime_id)
+        return RuntimeHandle(id=runtime_id, image="fake")
+
+    async def exec(
+        self, runtime_id: str, command: str, workdir: str, timeout: Optional[int]
+    ) -> Tuple[int, bytes]:
+        return 0, b""
+
+    async def write_file(self, runtime_id: str, path: str, data: bytes) -> None:
+        pass
+
+    async def read_file(self, runtime_id: str, path: str) -> bytes:
+        return b""
+
+    def stream_tar(self, runtime_id: str, script: str) -> Iterator[bytes]:
+        return iter(())
+
+    async def delete(self, runtime_id: str) -> None:
+        self.containers.remove(runtime_id)
+
+
+def make_backend(tmp_path, *hosts: HostState) -> ScheduledBackend:
+    return ScheduledBackend(
+        list(hosts),
+        PlacementRegistry(str(tmp_path / "state.db")),
+        container_memory=1 * GB,
+        container_cpus=1.0,
+        headroom=0.1,
+    )
+
+
+def make_host(name: str, memory_gb: int, cpus: float, **kwargs) -> HostState:
+    return HostState(
+        name=name,
+        backend=FakeBackend(**kwargs),
+        memory=memory_gb * GB,
+        cpus=cpus,
+        healthy=True,
+    )
+
+
+def test_place_prefers_fullest_host_that_fits(tmp_path):
+    small, large = make_host("small", 4, 4), make_host("large", 16, 16)
+    small.allocated_memory, small.allocated_cpus = 2 * GB, 2.0
+    backend = make_backend(tmp_path, small, large)
+    assert backend.place() is small
+
+
+def test_place_avoids_hosts_at_exec_limit(tmp_path):
+    busy, idle = make_host("busy", 4, 4), make_host("idle", 16, 16)
+    busy.allocated_memory, busy.allocated_cpus = 2 * GB, 2.0
+    busy.active_execs = busy.max_execs
+    backend = make_backend(tmp_path, busy, idle)
+    assert backend.place() is idle
+
+
+def test_place_skips_unhealthy_and_full_hosts(tmp_path):
+    down = make_host("down", 16, 16)
+    down.healthy = False
+    full = make_host("full", 4, 4)
+    full.allocated_memory = 3 * GB
+    backend = make_backend(tmp_path, down, full)
+    with pytest.raises(NoCapacityError):
+        backend.place()
+    assert backend.metrics["rejected"] == 1
+
+
+def test_create_records_placement(tmp_path):
+    host = make_host("a", 4, 4)
+    backend = make_backend(tmp_path, host)
+    handle = asyncio.run(backend.create([]))
+
+    assert host.containers == 1
+    assert host.allocated_memory == 1 * GB
+    assert backend.registry.list_all() == [(handle.id, "a", 1 * GB, 1.0)]
+    # 短ID也能路由到所在主机
+    assert asyncio.run(backend.describe(handle.id[:12])).id == handle.id
+
+
+def test_create_releases_reservation_on_failure(tmp_path):
+    host = make_host("a", 4, 4, fail_create=True)
+    backend = make_backend(tmp_path, host)
+    with pytest.raises(RuntimeError):
+        asyncio.run(backend.create([]))
+    assert host.containers == 0
+    assert host.allocated_memory == 0
+    assert backend.registry.list_all() == []
+
+
+def test_create_until_capacity_exhausted(tmp_path):
+    # 4G 留 10% 余量，可以放 3 个 1G 的容器
+    host = make_host("a", 4, 8)
+    backend = make_backend(tmp_path, host)
+    for _ in range(3):
+        asyncio.run(backend.create([]))
+    with pytest.raises(NoCapacityError):
+        asyncio.run(backend.create([]))
+
+
+def test_fork_reserves_on_same_host(tmp_path):
+    a, b = make_host("a", 8, 8), make_host("b", 8, 8)
+    backend = make_backend(tmp_path, a, b)
+    handle = asyncio.run(backend.create([]))
+    host = backend.hosts[backend._placements[handle.id][0]]
+
+    forks = asyncio.run(backend.fork(handle.id, 2))
+    assert len(forks) == 2
+    assert host.containers == 3
+    assert all(backend._placements[fork.id][0] == host.name for fork in forks)
+
+
+def test_fork_rejects_when_host_lacks_room(tmp_path):
+    host = make_host("a", 4, 4)
+    backend = make_backend(tmp_path, host)
+    handle = asyncio.run(backend.create([]))
+    with pytest.raises(NoCapacityError):
+        asyncio.run(backend.fork(handle.id, 3))
+    assert host.containers == 1
+
+
+def test_delete_releases_placement(tmp_path):
+    host = make_host("a", 4, 4)
+    backend = make_backend(tmp_path, host)
+    handle = asyncio.run(backend.create([]))
+    asyncio.run(backend.delete(handle.id))
+
+    assert host.containers == 0
+    assert host.allocated_memory == 0
+    assert backend.registry.list_all() == []
+    with pytest.raises(RuntimeNotFoundError):
+        asyncio.run(backend.describe(handle.id))